@@ -5,9 +5,17 @@ from .models import Course, CourseTuple
 
 @admin.register(CourseTuple)
 class CourseTupleAdmin(admin.ModelAdmin):
-    pass
+    list_display = ("__str__", "subscriber_count", "priority_subscriber_count")
+    list_select_related = ("course",)
 
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
-    pass
+    list_display = (
+        "__str__",
+        "status",
+        "subscriber_count",
+        "restricted_subscriber_count",
+        "priority_subscriber_count",
+        "last_open",
+    )
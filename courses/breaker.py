@@ -0,0 +1,162 @@
+import collections
+import json
+import logging
+import random
+import threading
+import time
+
+import redis
+
+from django.conf import settings
+
+from . import metrics
+from .redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request while the SSC is believed to be down."""
+
+
+class CircuitBreaker:
+    """Stops requests to the SSC while it is down, then probes it before resuming.
+
+    The breaker opens after SSC_BREAKER_FAILURE_THRESHOLD consecutive failures, or once at least
+    SSC_BREAKER_ERROR_RATE of the last SSC_BREAKER_WINDOW requests have failed. It stays open for
+    an exponentially growing, jittered delay. After that it is half-open: a single probe request
+    is let through at a time, and SSC_BREAKER_PROBES successful probes close it again while any
+    failed probe reopens it.
+    """
+
+    def __init__(self, name: str = "ssc"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.results = collections.deque(maxlen=settings.SSC_BREAKER_WINDOW)
+        self.opens = 0
+        self.retry_at = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        # Transitions that have yet to be logged and recorded, which is done without the lock.
+        self.transitions = []
+
+    def is_open(self) -> bool:
+        """Returns whether requests are being refused until the SSC is probed again."""
+        with self.lock:
+            return self.state == OPEN and time.monotonic() < self.retry_at
+
+    def is_probing(self) -> bool:
+        """Returns whether requests are waiting on the result of a probe."""
+        with self.lock:
+            return self.state == HALF_OPEN and self.probes_in_flight > 0
+
+    def before_request(self) -> bool:
+        """Returns whether the request about to be made is a probe, or raises CircuitOpenError if
+        a request may not be made right now.
+
+        The result must be passed on to record_success or record_failure, so that only the
+        results of probes count toward closing or reopening a half-open breaker.
+        """
+        try:
+            with self.lock:
+                if self.state == OPEN:
+                    if time.monotonic() < self.retry_at:
+                        raise CircuitOpenError(
+                            f"The {self.name} circuit breaker is open."
+                        )
+                    self._transition(HALF_OPEN)
+                if self.state == HALF_OPEN:
+                    if self.probes_in_flight > 0:
+                        raise CircuitOpenError(
+                            f"The {self.name} circuit breaker is waiting on a probe."
+                        )
+                    self.probes_in_flight += 1
+                    return True
+                return False
+        finally:
+            self._report()
+
+    def record_success(self, probe: bool = False) -> None:
+        with self.lock:
+            self.results.append(True)
+            self.consecutive_failures = 0
+            if probe and self.state == HALF_OPEN:
+                self.probes_in_flight -= 1
+                self.probe_successes += 1
+                if self.probe_successes >= settings.SSC_BREAKER_PROBES:
+                    self.opens = 0
+                    self.results.clear()
+                    self._transition(CLOSED)
+        self._report()
+
+    def record_failure(self, probe: bool = False) -> None:
+        with self.lock:
+            self.results.append(False)
+            self.consecutive_failures += 1
+            if probe and self.state == HALF_OPEN:
+                self._open()
+            elif self.state == CLOSED and (
+                self.consecutive_failures >= settings.SSC_BREAKER_FAILURE_THRESHOLD
+                or (
+                    len(self.results) == self.results.maxlen
+                    and self.results.count(False) / len(self.results)
+                    >= settings.SSC_BREAKER_ERROR_RATE
+                )
+            ):
+                self._open()
+        self._report()
+
+    def _open(self) -> None:
+        delay = min(
+            settings.SSC_BREAKER_MAX_DELAY,
+            settings.SSC_BREAKER_BASE_DELAY * 2 ** self.opens,
+        )
+        delay = random.uniform(delay / 2, delay)
+        self.opens += 1
+        self.retry_at = time.monotonic() + delay
+        self._transition(OPEN, f"retrying in {delay:.0f} seconds")
+
+    def _transition(self, state: str, detail: str = "") -> None:
+        """Changes state and forgets any probes. Must be called with the lock held."""
+        self.transitions.append((self.state, state, detail))
+        self.state = state
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+
+    def _report(self) -> None:
+        """Logs and records the transitions made since the last call.
+
+        This is done after the lock is released, since the poller's event loop takes the lock
+        and recording a transition may wait on Redis.
+        """
+        with self.lock:
+            transitions, self.transitions = self.transitions, []
+        for previous, state, detail in transitions:
+            message = f"The {self.name} circuit breaker went from {previous} to {state}"
+            logger.warning(f"{message} ({detail})." if detail else f"{message}.")
+            record_transition(self.name, previous, state)
+            metrics.set_gauge(
+                "ucm_circuit_breaker_open", int(state != CLOSED), breaker=self.name
+            )
+
+
+def record_transition(name: str, previous: str, state: str) -> None:
+    """Appends a breaker transition to a capped list in Redis so that outages can be reviewed."""
+    client = get_redis()
+    if client is None:
+        return
+    transition = json.dumps(
+        {"breaker": name, "from": previous, "to": state, "time": time.time()}
+    )
+    try:
+        client.lpush("breaker:transitions", transition)
+        client.ltrim("breaker:transitions", 0, 999)
+    except redis.RedisError:
+        logger.exception("Failed to record a circuit breaker transition.")
@@ -0,0 +1,235 @@
+import logging
+from typing import Iterable, Tuple
+
+import redis
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from .models import Course, CourseTuple
+from .redis_client import get_redis
+from users.models import Profile
+
+
+logger = logging.getLogger(__name__)
+
+KEY = "site:totals"
+
+
+def count_site_totals() -> Tuple[int, int]:
+    """Counts the monitored sections and the users on the site."""
+    courses_total = Course.objects.filter(subscriber_count__gt=0).count()
+    return courses_total, Profile.objects.count()
+
+
+def site_totals() -> Tuple[int, int]:
+    """Returns the number of monitored sections and users, counting them only on a cache miss.
+
+    The cached totals are cleared whenever a subscription, course or profile changes, and also
+    expire after SITE_TOTALS_TTL seconds in case a change is made without sending signals.
+    """
+    client = get_redis()
+    if client is None:
+        return count_site_totals()
+
+    try:
+        cached = client.hmget(KEY, "courses", "users")
+    except redis.RedisError:
+        logger.exception("Failed to read the site totals.")
+        return count_site_totals()
+    if None not in cached:
+        return int(cached[0]), int(cached[1])
+
+    courses_total, users_total = count_site_totals()
+    try:
+        pipeline = client.pipeline()
+        pipeline.hset(KEY, mapping={"courses": courses_total, "users": users_total})
+        pipeline.expire(KEY, settings.SITE_TOTALS_TTL)
+        pipeline.execute()
+    except redis.RedisError:
+        logger.exception("Failed to cache the site totals.")
+    return courses_total, users_total
+
+
+def invalidate_site_totals() -> None:
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(KEY)
+    except redis.RedisError:
+        logger.exception("Failed to invalidate the site totals.")
+
+
+def refresh_course_tuples(ids: Iterable[int]) -> int:
+    """Recounts the subscribers of the given course tuples and of their courses.
+
+    The course tuples are locked while they are recounted, so that two concurrent changes to
+    their subscribers can't both write a count that misses the other. Returns the number of
+    course tuples and courses whose counts were wrong.
+    """
+    ids = set(ids)
+    if len(ids) == 0:
+        return 0
+    priority = Q(profile__is_premium=True) | Q(profile__user__is_staff=True)
+    with transaction.atomic():
+        # Locked in a consistent order so that concurrent recounts can't deadlock.
+        list(
+            CourseTuple.objects.select_for_update()
+            .filter(pk__in=ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        course_tuples = CourseTuple.objects.filter(pk__in=ids).annotate(
+            subscribers=Count("profile", distinct=True),
+            priority_subscribers=Count("profile", filter=priority, distinct=True),
+        )
+
+        changed = []
+        course_ids = set()
+        for ct in course_tuples:
+            course_ids.add(ct.course_id)
+            if (ct.subscriber_count, ct.priority_subscriber_count) != (
+                ct.subscribers,
+                ct.priority_subscribers,
+            ):
+                ct.subscriber_count = ct.subscribers
+                ct.priority_subscriber_count = ct.priority_subscribers
+                changed.append(ct)
+        CourseTuple.objects.bulk_update(
+            changed, ["subscriber_count", "priority_subscriber_count"]
+        )
+        return len(changed) + refresh_courses(course_ids)
+
+
+def refresh_courses(ids: Iterable[int]) -> int:
+    """Recounts the subscribers of the given courses from their course tuples' counts.
+
+    The courses are locked while they are recounted, like the course tuples in
+    refresh_course_tuples. Returns the number of courses whose counts were wrong.
+    """
+    ids = set(ids)
+    if len(ids) == 0:
+        return 0
+    restricted = Q(coursetuple__restricted=True)
+    with transaction.atomic():
+        list(
+            Course.objects.select_for_update()
+            .filter(pk__in=ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        courses = Course.objects.filter(pk__in=ids).annotate(
+            subscribers=Coalesce(Sum("coursetuple__subscriber_count"), 0),
+            restricted_subscribers=Coalesce(
+                Sum("coursetuple__subscriber_count", filter=restricted), 0
+            ),
+            priority_subscribers=Coalesce(
+                Sum("coursetuple__priority_subscriber_count"), 0
+            ),
+        )
+
+        fields = [
+            "subscriber_count",
+            "restricted_subscriber_count",
+            "priority_subscriber_count",
+        ]
+        changed = []
+        for course in courses:
+            counts = (
+                course.subscribers,
+                course.restricted_subscribers,
+                course.priority_subscribers,
+            )
+            if tuple(getattr(course, field) for field in fields) != counts:
+                for field, count in zip(fields, counts):
+                    setattr(course, field, count)
+                changed.append(course)
+        Course.objects.bulk_update(changed, fields)
+        return len(changed)
+
+
+@receiver(m2m_changed, sender=Profile.courses.through)
+def subscriptions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        instance._cleared_course_tuples = (
+            [instance.pk]
+            if reverse
+            else list(instance.courses.values_list("pk", flat=True))
+        )
+    elif action in ("post_add", "post_remove"):
+        refresh_course_tuples([instance.pk] if reverse else pk_set)
+    elif action == "post_clear":
+        refresh_course_tuples(getattr(instance, "_cleared_course_tuples", []))
+
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_site_totals()
+
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, **kwargs):
+    invalidate_site_totals()
+
+
+@receiver(post_delete, sender=CourseTuple)
+def course_tuple_deleted(sender, instance, **kwargs):
+    if instance.subscriber_count > 0:
+        refresh_courses([instance.course_id])
+    invalidate_site_totals()
+
+
+@receiver(post_init, sender=Profile)
+def profile_loaded(sender, instance, **kwargs):
+    # Remembered so that saving the profile only recounts if its premium status changed. A
+    # deferred field counts as changed.
+    instance._saved_is_premium = instance.__dict__.get("is_premium")
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate_site_totals()
+    elif instance.is_premium != instance._saved_is_premium:
+        refresh_course_tuples(instance.courses.values_list("pk", flat=True))
+    instance._saved_is_premium = instance.is_premium
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    instance._saved_is_staff = instance.__dict__.get("is_staff")
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # Staff count as priority subscribers, like premium users.
+    if not created and instance.is_staff != instance._saved_is_staff:
+        refresh_course_tuples(
+            Profile.courses.through.objects.filter(profile__user=instance).values_list(
+                "coursetuple_id", flat=True
+            )
+        )
+    instance._saved_is_staff = instance.is_staff
+
+
+@receiver(pre_delete, sender=Profile)
+def profile_deleting(sender, instance, **kwargs):
+    instance._deleted_course_tuples = list(
+        instance.courses.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    refresh_course_tuples(getattr(instance, "_deleted_course_tuples", []))
+    invalidate_site_totals()
@@ -0,0 +1,327 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .parsing import Seats
+
+
+logger = logging.getLogger(__name__)
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+<title>Course Schedule - UBC Student Services Centre</title>
+</head>
+<body>
+<div id="ubc7-header" class="row-fluid expand" role="banner"></div>
+<div class="container">
+<div class="content expand">
+{content}
+</div>
+</div>
+<div id="ubc7-footer" class="row-fluid expand" role="contentinfo"></div>
+</body>
+</html>
+"""
+SEAT_SUMMARY = (
+    "<br><h4>Seat Summary</h4>\n<table class='table'>"
+    "<tr><td width=200px>Total Seats Remaining:</td><td align=left><strong>{}</strong></td></tr>"
+    "<tr><td width=200px>Currently Registered:</td><td align=left><strong>{}</strong></td></tr>"
+    "<tr><td width=200px>General Seats Remaining:</td><td align=left><strong>{}</strong></td></tr>"
+    "<tr><td width=200px>Restricted Seats Remaining*:</td><td align=left><strong>{}</strong>"
+    "</td></tr></table>"
+)
+BLOCKED_NOTE = (
+    "<strong>Note: this section is blocked from registration. Check the comments for details or "
+    "contact the department for further details.</strong><br><br>"
+)
+STT_NOTE = (
+    "<strong>Note: The remaining seats in this section are only available through a Standard "
+    "Timetable (STT). If you are not registered in an STT, you can add yourself to a waiting "
+    "list.</strong><br><br>"
+)
+NOT_OFFERED = (
+    "<p>The requested section is either no longer offered at UBC {} or is not being offered "
+    "this session.</p>"
+)
+SECTION_ROW = (
+    '<tr class=section{}><td>{}</td><td><a href="/cs/courseschedule?pname=subjarea&amp;'
+    'tname=subj-section&amp;dept={}&amp;course={}&amp;section={}">{} {} {}</a></td>'
+    "<td>Lecture</td><td>1</td></tr>"
+)
+MAINTENANCE = """<!DOCTYPE html>
+<html>
+<head><title>Student Services Centre - Maintenance</title></head>
+<body>
+<h1>The Student Services Centre is currently unavailable</h1>
+<p>The SSC is undergoing scheduled maintenance. Please try again later.</p>
+</body>
+</html>
+"""
+
+
+def load_timeline(
+    path: str,
+) -> typing.Dict[str, typing.List[typing.Tuple[float, Seats]]]:
+    """Reads a timeline of seat changes from a JSON file.
+
+    The file maps sections, e.g. "CPSC 110 101", to lists of changes such as
+    {"at": 30, "seats": [total, registered, general, restricted], "blocked": false} or
+    {"at": 60, "state": "stt"}, where at is the number of seconds since the server started.
+    """
+    with open(path) as f:
+        raw = json.load(f)
+    timeline = {}
+    for section, changes in raw.items():
+        entries = []
+        for change in changes:
+            if "seats" in change:
+                total_open, registered, general_open, restricted_open = change["seats"]
+                seats = (
+                    total_open,
+                    registered,
+                    general_open,
+                    restricted_open,
+                    bool(change.get("blocked", False)),
+                )
+            elif change.get("state") in ("stt", "invalid"):
+                seats = change["state"]
+            else:
+                raise ValueError(f"Invalid change to {section}: {change!r}")
+            entries.append((float(change["at"]), seats))
+        timeline[" ".join(section.upper().split())] = sorted(
+            entries, key=lambda entry: entry[0]
+        )
+    return timeline
+
+
+def _status(seats: Seats) -> str:
+    """Returns a section's status as shown on its course page."""
+    if seats == "stt":
+        return "STT"
+    elif seats == "invalid":
+        return "Cancelled"
+    elif seats[4]:
+        return "Blocked"
+    elif seats[2] > 0:
+        return ""
+    elif seats[3] > 0:
+        return "Restricted"
+    return "Full"
+
+
+class FakeSSC:
+    """Stand-in for the SSC's section and course pages, for testing the poller offline.
+
+    A section's seats come from a recorded page in pages_dir if there is one, then from the
+    timeline, and otherwise change at random: every change_interval seconds, each section is
+    open with probability open_rate. Responses are delayed by latency +/- jitter seconds, fail
+    with a 503 with probability error_rate, and are maintenance pages during the maintenance
+    windows, given as (start, duration) in seconds since the server started.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        maintenance: typing.Iterable[typing.Tuple[float, float]] = (),
+        timeline: typing.Dict[str, typing.List[typing.Tuple[float, Seats]]] = None,
+        pages_dir: str = None,
+        open_rate: float = 0.05,
+        change_interval: float = 300,
+        seed: int = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.maintenance = list(maintenance)
+        self.timeline = timeline or {}
+        self.pages_dir = pages_dir
+        self.open_rate = open_rate
+        self.change_interval = change_interval
+        self.random = random.Random(seed)
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        # The sections of each course that have been asked for, to list on its course page.
+        self.sections = collections.defaultdict(set)
+        for section in self.timeline:
+            subject, number, name = section.split()
+            self.sections[(subject, number)].add(name)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def in_maintenance(self) -> bool:
+        elapsed = self.elapsed()
+        return any(
+            start <= elapsed < start + length for start, length in self.maintenance
+        )
+
+    def seats(self, subject: str, number: str, section: str) -> Seats:
+        """Returns a section's seats at the current time."""
+        changes = self.timeline.get(f"{subject} {number} {section}")
+        elapsed = self.elapsed()
+        if changes:
+            current = changes[0][1]
+            for at, seats in changes:
+                if at > elapsed:
+                    break
+                current = seats
+            return current
+
+        period = int(elapsed // self.change_interval)
+        digest = hashlib.blake2b(
+            f"{subject} {number} {section} {period}".encode("utf-8"), digest_size=8
+        ).digest()
+        value = int.from_bytes(digest, "big")
+        registered = 50 + value % 200
+        if (value >> 32) / 2 ** 32 < self.open_rate:
+            general_open, restricted_open = 1 + value % 3, (value >> 8) % 2
+            return (
+                general_open + restricted_open,
+                registered,
+                general_open,
+                restricted_open,
+                False,
+            )
+        return 0, registered, 0, 0, False
+
+    def _recorded(self, name: str) -> str or None:
+        if self.pages_dir is None:
+            return None
+        path = os.path.join(self.pages_dir, f"{name}.html")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read()
+
+    def section_page(self, campus: str, subject: str, number: str, section: str) -> str:
+        recorded = self._recorded(f"{subject}-{number}-{section}")
+        if recorded is not None:
+            return recorded
+        seats = self.seats(subject, number, section)
+        content = f"<h4>{subject} {number} {section} (Lecture)</h4>\n"
+        if seats == "invalid":
+            campus_name = "Okanagan" if campus == "UBCO" else "Vancouver"
+            content += NOT_OFFERED.format(campus_name)
+        elif seats == "stt":
+            content += STT_NOTE
+        else:
+            if seats[4]:
+                content += BLOCKED_NOTE
+            content += SEAT_SUMMARY.format(*seats[:4])
+        return PAGE.format(content=content)
+
+    def course_page(self, subject: str, number: str) -> str:
+        recorded = self._recorded(f"{subject}-{number}")
+        if recorded is not None:
+            return recorded
+        with self.lock:
+            sections = sorted(self.sections[(subject, number)])
+        rows = "\n".join(
+            SECTION_ROW.format(
+                i % 2 + 1,
+                _status(self.seats(subject, number, section)),
+                subject,
+                number,
+                section,
+                subject,
+                number,
+                section,
+            )
+            for i, section in enumerate(sections)
+        )
+        content = (
+            f"<h4>{subject} {number}</h4>\n<table class='table table-striped section-summary'>"
+            f"<tbody>\n{rows}\n</tbody></table>"
+        )
+        return PAGE.format(content=content)
+
+    def respond(
+        self, path: str, headers: typing.Mapping[str, str]
+    ) -> typing.Tuple[int, str]:
+        """Returns the status and body of the response to a GET request."""
+        url = urlparse(path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path != "/cs/courseschedule":
+            return 404, ""
+
+        with self.lock:
+            self.stats["requests"] += 1
+            delay = max(0.0, self.random.gauss(self.latency, self.jitter))
+            error = self.random.random() < self.error_rate
+        time.sleep(delay)
+        if error:
+            self._count("errors")
+            return 503, ""
+        if self.in_maintenance():
+            self._count("maintenance")
+            return 200, MAINTENANCE
+
+        subject = query.get("dept", "").upper()
+        number = query.get("course", "").upper()
+        if query.get("tname") == "subj-section" and "section" in query:
+            section = query["section"].upper()
+            with self.lock:
+                self.sections[(subject, number)].add(section)
+            return (
+                200,
+                self.section_page(
+                    query.get("campuscd", "UBC"), subject, number, section
+                ),
+            )
+        elif query.get("tname") == "subj-course":
+            return 200, self.course_page(subject, number)
+        return 404, ""
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        """Returns a server for the fake SSC, bound but not yet serving.
+
+        Port 0 picks a free port, which can be read from the server's server_port.
+        """
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        server.fake_ssc = self
+        return server
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keeps connections alive between requests, like the real SSC.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        fake = self.server.fake_ssc
+        status, body = fake.respond(self.path, self.headers)
+        content = body.encode("utf-8")
+        # Maintenance pages aren't tagged, so they are never mistaken for an unchanged section.
+        etag = None
+        if status == 200 and body != MAINTENANCE:
+            etag = f'"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                fake._count("not_modified")
+                status, content = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(content)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
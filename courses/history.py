@@ -0,0 +1,246 @@
+import datetime
+import threading
+import typing
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Course, SeatObservation, SeatRollup
+from .parsing import Seats
+
+
+ROLLUP_BATCH_SIZE = 1000
+
+
+class ObservationBuffer:
+    """Collects seat observations in memory and writes them with bulk_create.
+
+    The buffer is flushed once it holds SEAT_HISTORY_BUFFER_SIZE observations, and should be
+    flushed explicitly at the end of every sweep.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.observations = []
+
+    def add(self, course: Course, seats: Seats, derived: bool = False) -> None:
+        with self.lock:
+            self.observations.append(
+                SeatObservation.from_seats(course, seats, derived=derived)
+            )
+            full = len(self.observations) >= settings.SEAT_HISTORY_BUFFER_SIZE
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes the buffered observations and returns how many there were."""
+        with self.lock:
+            observations, self.observations = self.observations, []
+        SeatObservation.objects.bulk_create(
+            observations, batch_size=settings.SEAT_HISTORY_BUFFER_SIZE
+        )
+        return len(observations)
+
+
+observations = ObservationBuffer()
+
+
+def _truncate(time: datetime.datetime, resolution: str) -> datetime.datetime:
+    time = time.astimezone(datetime.timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+    return time.replace(hour=0) if resolution == "day" else time
+
+
+def _merge(rollup: SeatRollup, other: SeatRollup) -> None:
+    rollup.samples += other.samples
+    rollup.open_samples += other.open_samples
+    rollup.changes += other.changes
+    for field, pick in (
+        ("min_total_open", min),
+        ("max_total_open", max),
+        ("max_general_open", max),
+    ):
+        values = [
+            value
+            for value in (getattr(rollup, field), getattr(other, field))
+            if value is not None
+        ]
+        setattr(rollup, field, pick(values) if values else None)
+
+
+def _save_rollups(rollups: typing.Iterable[SeatRollup]) -> int:
+    """Saves rollups in batches, skipping any saved by an earlier, interrupted run."""
+    saved = 0
+    batch = []
+    for rollup in rollups:
+        batch.append(rollup)
+        if len(batch) == ROLLUP_BATCH_SIZE:
+            SeatRollup.objects.bulk_create(batch, ignore_conflicts=True)
+            saved += len(batch)
+            batch = []
+    SeatRollup.objects.bulk_create(batch, ignore_conflicts=True)
+    return saved + len(batch)
+
+
+def _hourly_rollups(before: datetime.datetime) -> typing.Iterator[SeatRollup]:
+    rows = (
+        SeatObservation.objects.filter(time__lt=before)
+        .order_by("course", "time")
+        .values_list(
+            "course_id",
+            "time",
+            "state",
+            "total_open",
+            "general_open",
+            "restricted_open",
+        )
+    )
+    rollup = None
+    previous = None
+    for (
+        course_id,
+        time,
+        state,
+        total_open,
+        general_open,
+        restricted_open,
+    ) in rows.iterator(chunk_size=ROLLUP_BATCH_SIZE):
+        start = _truncate(time, "hour")
+        if rollup is None or (rollup.course_id, rollup.start) != (course_id, start):
+            if rollup is not None:
+                if rollup.course_id != course_id:
+                    previous = None
+                yield rollup
+            rollup = SeatRollup(course_id=course_id, resolution="hour", start=start)
+            rollup.samples = rollup.open_samples = rollup.changes = 0
+
+        sample = SeatRollup(
+            samples=1,
+            open_samples=int(state == "seats" and total_open > 0),
+            changes=0,
+            min_total_open=total_open,
+            max_total_open=total_open,
+            max_general_open=general_open,
+        )
+        # A failed check says nothing about whether the seats changed.
+        if state != "failed":
+            seats = (state, total_open, general_open, restricted_open)
+            sample.changes = int(previous is not None and seats != previous)
+            previous = seats
+        _merge(rollup, sample)
+    if rollup is not None:
+        yield rollup
+
+
+def _daily_rollups(before: datetime.datetime) -> typing.Iterator[SeatRollup]:
+    hourly = SeatRollup.objects.filter(resolution="hour", start__lt=before).order_by(
+        "course", "start"
+    )
+    rollup = None
+    for hour in hourly.iterator(chunk_size=ROLLUP_BATCH_SIZE):
+        start = _truncate(hour.start, "day")
+        if rollup is None or (rollup.course_id, rollup.start) != (
+            hour.course_id,
+            start,
+        ):
+            if rollup is not None:
+                yield rollup
+            rollup = SeatRollup(course_id=hour.course_id, resolution="day", start=start)
+            rollup.samples = rollup.open_samples = rollup.changes = 0
+        _merge(rollup, hour)
+    if rollup is not None:
+        yield rollup
+
+
+def _cutoffs(
+    now: datetime.datetime,
+) -> typing.Tuple[datetime.datetime, datetime.datetime]:
+    """Returns the times before which observations and hourly rollups are rolled up."""
+    return (
+        _truncate(now - settings.SEAT_HISTORY_RAW_RETENTION, "hour"),
+        _truncate(now - settings.SEAT_HISTORY_HOURLY_RETENTION, "day"),
+    )
+
+
+def roll_up(now: datetime.datetime = None) -> typing.Dict[str, int]:
+    """Summarizes old seat history into coarser rollups and returns how many were created.
+
+    Observations older than SEAT_HISTORY_RAW_RETENTION become hourly rollups, and hourly rollups
+    older than SEAT_HISTORY_HOURLY_RETENTION become daily rollups. Only whole hours and days are
+    rolled up, so a rollup never has to be updated once it exists. The rows that were rolled up
+    are left for the caller to delete through expired.
+    """
+    raw_cutoff, hourly_cutoff = _cutoffs(timezone.now() if now is None else now)
+    return {
+        "hourly": _save_rollups(_hourly_rollups(raw_cutoff)),
+        "daily": _save_rollups(_daily_rollups(hourly_cutoff)),
+    }
+
+
+def expired(now: datetime.datetime = None) -> typing.Dict[str, models.QuerySet]:
+    """Returns the seat history that roll_up has summarized or that is past its retention."""
+    now = timezone.now() if now is None else now
+    raw_cutoff, hourly_cutoff = _cutoffs(now)
+    return {
+        "observations": SeatObservation.objects.filter(time__lt=raw_cutoff),
+        "hourly": SeatRollup.objects.filter(resolution="hour", start__lt=hourly_cutoff),
+        "daily": SeatRollup.objects.filter(
+            resolution="day", start__lt=now - settings.SEAT_HISTORY_DAILY_RETENTION
+        ),
+    }
+
+
+def seat_history(
+    course: Course, since: datetime.datetime, now: datetime.datetime = None
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Returns a course's seat history since the given time, oldest first.
+
+    Each point is a daily rollup, an hourly rollup or a single observation, whichever is the
+    finest that is kept for its time. Every query is served by a (course, time) index.
+    """
+    raw_cutoff, hourly_cutoff = _cutoffs(timezone.now() if now is None else now)
+    rollups = course.rollups.filter(
+        Q(
+            resolution="day",
+            start__gte=_truncate(since, "day"),
+            start__lt=hourly_cutoff,
+        )
+        | Q(
+            resolution="hour",
+            start__gte=max(_truncate(since, "hour"), hourly_cutoff),
+            start__lt=raw_cutoff,
+        )
+    ).order_by("start")
+    points = [
+        {
+            "time": rollup.start,
+            "resolution": rollup.resolution,
+            "samples": rollup.samples,
+            "open_samples": rollup.open_samples,
+            "changes": rollup.changes,
+            "min_total_open": rollup.min_total_open,
+            "max_total_open": rollup.max_total_open,
+            "max_general_open": rollup.max_general_open,
+        }
+        for rollup in rollups
+    ]
+    observations = course.observations.filter(
+        time__gte=max(since, raw_cutoff)
+    ).order_by("time")
+    points.extend(
+        {
+            "time": observation.time,
+            "resolution": "observation",
+            "state": observation.state,
+            "total_open": observation.total_open,
+            "registered": observation.registered,
+            "derived": observation.derived,
+            "general_open": observation.general_open,
+            "restricted_open": observation.restricted_open,
+        }
+        for observation in observations
+    )
+    return points
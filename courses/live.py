@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import typing
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+import redis
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib import auth
+from django.db import connection
+
+from .models import Course
+from .parsing import Seats, load_seats
+from .redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "live:course:"
+EVENTS_PATH = "/courses/events/"
+
+
+def seats_message(seats: Seats or None) -> str:
+    """Describes a section's seats for its subscribers."""
+    if not isinstance(seats, tuple):
+        return ""
+    _, _, general_open, restricted_open, blocked = seats
+    if blocked:
+        return ""
+    return f"{general_open} general and {restricted_open} restricted seats open."
+
+
+def event(course: Course, seats: Seats = None) -> dict:
+    """Returns what subscribers of a course are told about it, given its latest seats if they
+    might not have been saved yet."""
+    # Imported here because the views import the tasks, which import this module.
+    from .views import STATUS_MESSAGES
+
+    return {
+        "course": course.pk,
+        "status": course.status,
+        "message": STATUS_MESSAGES[course.status],
+        "seats": seats_message(
+            load_seats(course.last_seats) if seats is None else seats
+        ),
+        "time": time.time(),
+    }
+
+
+def publish(course: Course, seats: Seats = None) -> None:
+    """Tells everyone watching a course live that its status or seats changed."""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.publish(f"{CHANNEL_PREFIX}{course.pk}", json.dumps(event(course, seats)))
+    except redis.RedisError:
+        logger.exception(f"Failed to publish an update about {course}.")
+
+
+class Hub:
+    """Fans out the course updates published to Redis to the live connections in this process.
+
+    A single pattern subscription is shared by every connection, and is only held while there
+    are connections listening. redis-py blocks, so the subscription is read on its own thread,
+    which hands each update to the event loop.
+    """
+
+    def __init__(self):
+        self.listeners = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.reader = None
+
+    def listen(self, course_ids: typing.Iterable[int]) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        with self.lock:
+            for course_id in course_ids:
+                self.listeners.setdefault(course_id, set()).add(queue)
+            if self.reader is None:
+                self.loop = asyncio.get_event_loop()
+                self.reader = threading.Thread(
+                    target=self._read, name="live-hub", daemon=True
+                )
+                self.reader.start()
+        return queue
+
+    def stop_listening(self, queue: asyncio.Queue) -> None:
+        with self.lock:
+            for course_id in list(self.listeners):
+                self.listeners[course_id].discard(queue)
+                if len(self.listeners[course_id]) == 0:
+                    del self.listeners[course_id]
+
+    def _deliver(self, update: dict) -> None:
+        with self.lock:
+            queues = list(self.listeners.get(update["course"], ()))
+        for queue in queues:
+            if not queue.full():
+                queue.put_nowait(update)
+
+    def _read(self) -> None:
+        pubsub = None
+        try:
+            while True:
+                with self.lock:
+                    if len(self.listeners) == 0:
+                        self.reader = None
+                        return
+                try:
+                    if pubsub is None:
+                        pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                        pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                    message = pubsub.get_message(timeout=settings.LIVE_POLL_INTERVAL)
+                except redis.RedisError:
+                    logger.exception(
+                        "Lost the live update subscription; resubscribing."
+                    )
+                    pubsub = None
+                    time.sleep(settings.LIVE_RECONNECT_DELAY)
+                    continue
+                if message is not None:
+                    update = json.loads(message["data"])
+                    self.loop.call_soon_threadsafe(self._deliver, update)
+        except Exception:
+            with self.lock:
+                self.reader = None
+            raise
+        finally:
+            if pubsub is not None:
+                pubsub.close()
+
+
+hub = Hub()
+
+
+def _subscriptions(session_key: str) -> typing.Dict[int, typing.List[int]] or None:
+    """Returns the ids of the course tuples that the session's user monitors, by course id."""
+    try:
+        engine = import_module(settings.SESSION_ENGINE)
+        request = SimpleNamespace(session=engine.SessionStore(session_key))
+        user = auth.get_user(request)
+        if not user.is_authenticated:
+            return None
+        courses = {}
+        for pk, course_id in user.profile.courses.values_list("pk", "course_id"):
+            courses.setdefault(course_id, []).append(pk)
+        return courses
+    finally:
+        # This runs on one of asgiref's executor threads, whose connections Django never
+        # closes, so they would otherwise be left open until the database dropped them.
+        connection.close()
+
+
+async def respond(send, status: int) -> None:
+    """Sends an empty response."""
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain")],
+        }
+    )
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _send_event(send, data: dict) -> None:
+    await send(
+        {
+            "type": "http.response.body",
+            "body": f"data: {json.dumps(data)}\n\n".encode("utf-8"),
+            "more_body": True,
+        }
+    )
+
+
+async def events(scope, receive, send) -> None:
+    """ASGI application that streams updates about the user's subscriptions as server-sent events.
+
+    Each event has the id, status, message and seats fields of an entry of the courses-status
+    view.
+    """
+    cookies = SimpleCookie()
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            cookies.load(value.decode("latin-1"))
+    session = cookies.get(settings.SESSION_COOKIE_NAME)
+    subscriptions = None
+    if session is not None:
+        subscriptions = await sync_to_async(_subscriptions)(session.value)
+    if subscriptions is None or get_redis() is None:
+        await respond(send, 403 if subscriptions is None else 503)
+        return
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": f"retry: {settings.LIVE_RETRY * 1000}\n\n".encode("utf-8"),
+            "more_body": True,
+        }
+    )
+
+    queue = hub.listen(subscriptions)
+    disconnected = asyncio.ensure_future(_disconnect(receive))
+    try:
+        while True:
+            update = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {update, disconnected},
+                timeout=settings.LIVE_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                update.cancel()
+                return
+            if update in done:
+                data = update.result()
+                for ct in subscriptions[data["course"]]:
+                    await _send_event(send, dict(data, id=ct))
+            else:
+                update.cancel()
+                # Keeps proxies from closing a quiet connection.
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": b": keepalive\n\n",
+                        "more_body": True,
+                    }
+                )
+    finally:
+        hub.stop_listening(queue)
+        disconnected.cancel()
@@ -0,0 +1,93 @@
+import logging
+import threading
+import uuid
+
+import redis
+
+from .redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Only extend or delete a lease if it is still held by the token that acquired it, so that a
+# worker whose lease already expired can't take it back from the worker that picked it up.
+RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class Lease:
+    """A Redis lock that expires unless its holder keeps renewing it.
+
+    Used as a context manager, the lease is renewed in the background every third of its
+    lifetime until the block exits. If the holder dies, the lease lapses after ttl seconds and
+    can be acquired by someone else. If it can't be renewed, the lost event is set, and the
+    holder must stop what it was doing since someone else may now hold the lease. Without Redis
+    every lease is granted.
+    """
+
+    def __init__(self, name: str, ttl: int):
+        self.name = name
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self.stop = threading.Event()
+        self.lost = threading.Event()
+        self.renewer = None
+
+    def acquire(self) -> bool:
+        client = get_redis()
+        if client is None:
+            return True
+        try:
+            return bool(client.set(self.name, self.token, nx=True, ex=self.ttl))
+        except redis.RedisError:
+            logger.exception(f"Failed to acquire lease {self.name}.")
+            return False
+
+    def renew(self) -> bool:
+        client = get_redis()
+        if client is None:
+            return True
+        try:
+            return bool(client.eval(RENEW_SCRIPT, 1, self.name, self.token, self.ttl))
+        except redis.RedisError:
+            logger.exception(f"Failed to renew lease {self.name}.")
+            return False
+
+    def release(self) -> None:
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.eval(RELEASE_SCRIPT, 1, self.name, self.token)
+        except redis.RedisError:
+            logger.exception(f"Failed to release lease {self.name}.")
+
+    def _keep_renewed(self) -> None:
+        while not self.stop.wait(self.ttl / 3):
+            if not self.renew():
+                logger.warning(f"Lost lease {self.name}.")
+                self.lost.set()
+                return
+
+    def __enter__(self) -> bool:
+        if not self.acquire():
+            return False
+        self.renewer = threading.Thread(target=self._keep_renewed, daemon=True)
+        self.renewer.start()
+        return True
+
+    def __exit__(self, *exc_info) -> None:
+        if self.renewer is not None:
+            self.stop.set()
+            self.renewer.join()
+            self.release()
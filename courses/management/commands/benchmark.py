@@ -0,0 +1,362 @@
+import datetime
+import itertools
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+
+from courses import notifiers, ssc, tasks
+from courses.fake_ssc import FakeSSC
+from courses.models import Course, CourseTuple
+from courses.views import context
+from ubccoursemonitor.celery import app
+from users.models import Profile
+
+
+SUBJECTS = [
+    "CPSC",
+    "MATH",
+    "PHYS",
+    "CHEM",
+    "BIOL",
+    "ECON",
+    "ENGL",
+    "STAT",
+    "PSYC",
+    "COMM",
+]
+SECTIONS_PER_COURSE = 5
+
+
+def _commit() -> str or None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _latencies(seconds: list) -> dict:
+    ordered = sorted(seconds)
+    return {
+        "requests": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds a synthetic dataset in a throwaway test database and benchmarks monitor sweeps "
+        "against a fake SSC, purge_courses, the page context and the busiest views. Prints the "
+        "results as JSON, so that they can be compared between commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--courses", type=int, default=5000)
+        parser.add_argument("--subscriptions", type=int, default=30000)
+        parser.add_argument(
+            "--premium", type=float, default=0.1, help="Fraction of premium users."
+        )
+        parser.add_argument(
+            "--staff", type=float, default=0.01, help="Fraction of staff users."
+        )
+        parser.add_argument(
+            "--restricted",
+            type=float,
+            default=0.3,
+            help="Fraction of subscriptions that include restricted seats.",
+        )
+        parser.add_argument(
+            "--sweeps",
+            type=int,
+            default=2,
+            help="Number of sweeps to time. The first downloads every page; later ones can "
+            "reuse them.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=50,
+            help="Number of times each view and the page context are timed.",
+        )
+        parser.add_argument(
+            "--ssc-latency",
+            type=float,
+            default=0.05,
+            help="Average seconds taken by the fake SSC to respond.",
+        )
+        parser.add_argument(
+            "--ssc-rate",
+            type=float,
+            default=200,
+            help="SSC requests per second that the monitor may make.",
+        )
+        parser.add_argument(
+            "--ssc-concurrency",
+            type=int,
+            default=settings.SSC_MAX_CONCURRENT_REQUESTS,
+            help="SSC requests that the monitor may make at once.",
+        )
+        parser.add_argument(
+            "--open-rate",
+            type=float,
+            default=0.05,
+            help="Chance that a section has open seats.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="File to write the results to.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        fake = FakeSSC(
+            latency=options["ssc_latency"],
+            jitter=options["ssc_latency"] / 4,
+            open_rate=options["open_rate"],
+            seed=options["seed"],
+        )
+        server = fake.serve()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        # Notifications are sent while sweeping, to the in-memory outbox, and the test
+        # environment swaps in the locmem mail backend. Redis is left out so that the benchmark
+        # can't touch a real seat cache, lease or metrics.
+        overrides = override_settings(
+            REDIS_URL=None,
+            SSC_BASE_URL=f"http://127.0.0.1:{server.server_port}",
+            SSC_REQUESTS_PER_SECOND=options["ssc_rate"],
+            SSC_MAX_CONCURRENT_REQUESTS=options["ssc_concurrency"],
+            SCHEDULER_MIN_INTERVAL=0,
+            MONITOR_SHARDS=1,
+            MONITOR_PROFILE_DIR=None,
+            NON_PREMIUM_NOTIFICATIONS=True,
+            NOTIFICATION_DIGEST_WINDOW=0,
+            NOTIFIERS={
+                "email": {"BACKEND": "courses.notifiers.LocmemNotifier", "RATE": 1e6}
+            },
+            TRACE_SAMPLE_RATE=0,
+        )
+        overrides.enable()
+        ssc._session = None
+        notifiers._notifiers.clear()
+        try:
+            results = {
+                "commit": _commit(),
+                "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "options": {
+                    name: options[name]
+                    for name in (
+                        "users",
+                        "courses",
+                        "subscriptions",
+                        "premium",
+                        "staff",
+                        "restricted",
+                        "ssc_latency",
+                        "ssc_rate",
+                        "ssc_concurrency",
+                        "open_rate",
+                        "seed",
+                    )
+                },
+                "database": connection.vendor,
+            }
+            results["dataset"] = self.build(options, fake)
+            results["context"] = self.time_context(options["requests"])
+            results["views"] = self.time_views(options["requests"])
+            results["sweeps"] = [
+                self.time_sweep(fake) for _ in range(options["sweeps"])
+            ]
+            results["purge"] = tasks.purge_courses()
+        finally:
+            overrides.disable()
+            ssc._session = None
+            notifiers._notifiers.clear()
+            notifiers.outbox.clear()
+            app.conf.task_always_eager = eager
+            server.shutdown()
+            server.server_close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def build(self, options: dict, fake: FakeSSC) -> dict:
+        """Creates the users, courses and subscriptions, and returns how long that took."""
+        start = time.perf_counter()
+        rng = random.Random(options["seed"])
+
+        users = User.objects.bulk_create(
+            User(
+                username=f"user{i}",
+                email=f"user{i}@example.com",
+                is_staff=rng.random() < options["staff"],
+            )
+            for i in range(options["users"])
+        )
+        if connection.features.can_return_rows_from_bulk_insert:
+            user_ids = [user.pk for user in users]
+        else:
+            user_ids = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        Profile.objects.bulk_create(
+            Profile(user_id=pk, is_premium=rng.random() < options["premium"])
+            for pk in user_ids
+        )
+
+        Course.objects.bulk_create(
+            Course(
+                campus="UBC",
+                year="2020",
+                session="W",
+                subject=SUBJECTS[i // SECTIONS_PER_COURSE % len(SUBJECTS)],
+                number=str(100 + i // (SECTIONS_PER_COURSE * len(SUBJECTS))),
+                section=str(101 + i % SECTIONS_PER_COURSE),
+                status="valid",
+            )
+            for i in range(options["courses"])
+        )
+        courses = list(Course.objects.all())
+        for course in courses:
+            fake.sections[(course.subject, course.number)].add(course.section)
+        CourseTuple.objects.bulk_create(
+            CourseTuple(course=course, restricted=restricted)
+            for course in courses
+            for restricted in (False, True)
+        )
+        tuples = {
+            (course_id, restricted): pk
+            for pk, course_id, restricted in CourseTuple.objects.values_list(
+                "pk", "course_id", "restricted"
+            )
+        }
+
+        # Popular courses get most of the subscriptions, as they do in practice.
+        weights = list(
+            itertools.accumulate(1 / (rank + 1) for rank in range(len(courses)))
+        )
+        pairs = {}
+        for _ in range(10 * options["subscriptions"]):
+            if len(pairs) == options["subscriptions"]:
+                break
+            profile_id = rng.choice(user_ids)
+            course = rng.choices(courses, cum_weights=weights)[0]
+            if (profile_id, course.pk) not in pairs:
+                pairs[(profile_id, course.pk)] = tuples[
+                    (course.pk, rng.random() < options["restricted"])
+                ]
+        profiles = dict(Profile.objects.values_list("user_id", "pk"))
+        Through = Profile.courses.through
+        Through.objects.bulk_create(
+            (
+                Through(profile_id=profiles[user_id], coursetuple_id=tuple_id)
+                for (user_id, _), tuple_id in pairs.items()
+            )
+        )
+        # Bulk inserts skip the signals that keep the subscriber counts up to date.
+        call_command("repair_subscriber_counts", stdout=StringIO())
+
+        return {
+            "users": len(user_ids),
+            "courses": len(courses),
+            "course_tuples": len(tuples),
+            "subscriptions": len(pairs),
+            "monitored_courses": Course.objects.monitored().count(),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def time_context(self, repeat: int) -> dict:
+        seconds = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                context(title="Benchmark")
+                seconds.append(time.perf_counter() - start)
+        return dict(_latencies(seconds), queries_per_call=len(queries) / repeat)
+
+    def time_views(self, repeat: int) -> dict:
+        """Times each view for the user with the most subscriptions."""
+        profile = (
+            Profile.objects.annotate(subscriptions=Count("courses"))
+            .select_related("user")
+            .order_by("-subscriptions")
+            .first()
+        )
+        client = Client()
+        client.force_login(profile.user)
+        results = {"subscriptions": profile.subscriptions}
+        for name in ("courses-list", "courses-status", "profile", "courses-home"):
+            url = reverse(name)
+            seconds = []
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    seconds.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise CommandError(
+                            f"{url} responded with {response.status_code}."
+                        )
+            results[name] = dict(
+                _latencies(seconds), queries_per_request=len(queries) / repeat
+            )
+        return results
+
+    def time_sweep(self, fake: FakeSSC) -> dict:
+        """Runs every shard's sweep, as the monitor task would, and summarizes them."""
+        fake_requests = fake.stats["requests"]
+        sent = len(notifiers.outbox)
+        start = time.perf_counter()
+        summaries = [
+            tasks.monitor_shard(shard, settings.MONITOR_SHARDS)
+            for shard in range(settings.MONITOR_SHARDS)
+        ]
+        seconds = time.perf_counter() - start
+
+        result = {
+            key: sum(summary[key] for summary in summaries)
+            for key in summaries[0]
+            if key != "seconds"
+        }
+        result["seconds"] = seconds
+        if result["courses"] > 0:
+            result["courses_per_second"] = result["courses"] / seconds
+            result["queries_per_course"] = result["db_queries"] / result["courses"]
+        result["fake_ssc_requests"] = fake.stats["requests"] - fake_requests
+        result["notifications"] = len(notifiers.outbox) - sent
+        return result
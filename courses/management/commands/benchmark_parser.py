@@ -0,0 +1,72 @@
+import json
+import os
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.parsing import parse_seats_fast, parse_seats_soup
+
+
+PAGES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "ssc_pages",
+)
+
+
+def _normalize(result):
+    return list(result) if isinstance(result, tuple) else result
+
+
+class Command(BaseCommand):
+    help = "Checks both SSC seat parsers against the sample pages and compares their speed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--number",
+            type=int,
+            default=200,
+            help="Number of times each page is parsed by each parser.",
+        )
+        parser.add_argument(
+            "--pages",
+            default=PAGES_DIR,
+            help="Directory of SSC pages and their expected.json results.",
+        )
+
+    def handle(self, *args, **options):
+        with open(os.path.join(options["pages"], "expected.json")) as f:
+            expected = json.load(f)
+
+        failures = 0
+        totals = {"soup": 0.0, "fast": 0.0}
+        for name in sorted(expected):
+            with open(os.path.join(options["pages"], name)) as f:
+                html = f.read()
+
+            row = []
+            for parser_name, parser in (
+                ("soup", parse_seats_soup),
+                ("fast", parse_seats_fast),
+            ):
+                result = _normalize(parser(html))
+                if result != expected[name]:
+                    failures += 1
+                    self.stderr.write(
+                        f"{parser_name} parser returned {result!r} for {name}, expected "
+                        f"{expected[name]!r}."
+                    )
+                seconds = timeit.timeit(lambda: parser(html), number=options["number"])
+                totals[parser_name] += seconds
+                row.append(seconds / options["number"] * 1e6)
+
+            self.stdout.write(
+                f"{name:<28} soup {row[0]:>9.1f} us   fast {row[1]:>7.1f} us   "
+                f"{row[0] / row[1]:>6.1f}x"
+            )
+
+        self.stdout.write(
+            f"{'total':<28} soup {totals['soup'] * 1e3:>9.1f} ms   fast "
+            f"{totals['fast'] * 1e3:>7.1f} ms   {totals['soup'] / totals['fast']:>6.1f}x"
+        )
+        if failures > 0:
+            raise CommandError(f"{failures} parse results did not match expected.json.")
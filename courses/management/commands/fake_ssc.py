@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.fake_ssc import FakeSSC, load_timeline
+
+
+def _window(value: str):
+    start, _, duration = value.partition(":")
+    try:
+        return float(start), float(duration)
+    except ValueError:
+        raise CommandError(f"Invalid maintenance window {value!r}; use START:DURATION.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves a local stand-in for the SSC's section and course pages. Set UCM_SSC_BASE_URL "
+        "to its address to point the monitor at it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.2,
+            help="Average seconds taken to respond.",
+        )
+        parser.add_argument(
+            "--jitter",
+            type=float,
+            default=0.05,
+            help="Standard deviation of the response time, in seconds.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0,
+            help="Fraction of requests that fail with a 503.",
+        )
+        parser.add_argument(
+            "--maintenance",
+            action="append",
+            default=[],
+            metavar="START:DURATION",
+            help="Seconds after starting at which to serve maintenance pages, and for how "
+            "long. May be given more than once.",
+        )
+        parser.add_argument(
+            "--timeline",
+            help="JSON file of scripted seat changes, by section, e.g. "
+            '{"CPSC 110 101": [{"at": 0, "seats": [0, 150, 0, 0]}, '
+            '{"at": 60, "seats": [2, 148, 2, 0]}]}.',
+        )
+        parser.add_argument(
+            "--pages",
+            help="Directory of recorded pages to serve instead, named like CPSC-110-101.html "
+            "for sections and CPSC-110.html for courses.",
+        )
+        parser.add_argument(
+            "--open-rate",
+            type=float,
+            default=0.05,
+            help="Chance that a section without a timeline has open seats.",
+        )
+        parser.add_argument(
+            "--change-interval",
+            type=float,
+            default=300,
+            help="Seconds between random changes to the seats of sections without a timeline.",
+        )
+        parser.add_argument("--seed", type=int, help="Seed for latencies and errors.")
+
+    def handle(self, *args, **options):
+        try:
+            timeline = (
+                load_timeline(options["timeline"]) if options["timeline"] else None
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read the timeline: {e}")
+        fake = FakeSSC(
+            latency=options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            maintenance=[_window(value) for value in options["maintenance"]],
+            timeline=timeline,
+            pages_dir=options["pages"],
+            open_rate=options["open_rate"],
+            change_interval=options["change_interval"],
+            seed=options["seed"],
+        )
+        server = fake.serve(options["host"], options["port"])
+        host, port = server.server_address[:2]
+        self.stdout.write(
+            f"Serving a fake SSC at http://{host}:{port}. Set UCM_SSC_BASE_URL to this "
+            "address to monitor it."
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        stats = ", ".join(
+            f"{count} {name}" for name, count in sorted(fake.stats.items())
+        )
+        self.stdout.write(f"Served {stats or 'no requests'}.")
@@ -0,0 +1,64 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.locks import Lease
+from courses.profiling import Sampler
+from courses.tasks import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs one monitor sweep under a sampling profiler and writes its samples as collapsed "
+        "stacks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shard", type=int, default=0, help="Shard to sweep.",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=settings.MONITOR_SHARDS,
+            help="Number of shards the courses are split into.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.005,
+            help="Seconds between samples of every thread's stack.",
+        )
+        parser.add_argument(
+            "--output",
+            default="sweep.folded",
+            help="File the collapsed stacks are written to.",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=20,
+            help="Number of functions with the most samples to list.",
+        )
+
+    def handle(self, *args, **options):
+        shard, shards = options["shard"], options["shards"]
+        lease = Lease(f"monitor:shard:{shard}:{shards}", settings.MONITOR_LEASE_TIMEOUT)
+        with lease as acquired:
+            if not acquired:
+                raise CommandError(f"Shard {shard} of {shards} is being swept.")
+            start = time.perf_counter()
+            with Sampler(options["interval"]) as sampler:
+                sweep(shard, shards, lease.lost)
+            seconds = time.perf_counter() - start
+
+        with open(options["output"], "w") as f:
+            sampler.write_collapsed(f)
+        self.stdout.write(
+            f"Took {sampler.samples} samples over {seconds:.2f} seconds and wrote them to "
+            f"{options['output']}."
+        )
+        self.stdout.write(f"{'self':>7} {'total':>7}  function")
+        for function, own, total in sampler.top(options["top"]):
+            self.stdout.write(f"{own:>7} {total:>7}  {function}")
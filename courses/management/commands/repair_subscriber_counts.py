@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from courses.counters import refresh_course_tuples, refresh_courses
+from courses.models import Course, CourseTuple
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts the denormalized subscriber counts of every course tuple and course."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of course tuples recounted per query.",
+        )
+
+    def handle(self, *args, **options):
+        ids = list(CourseTuple.objects.values_list("pk", flat=True).order_by("pk"))
+        repaired = 0
+        for i in range(0, len(ids), options["batch_size"]):
+            repaired += refresh_course_tuples(ids[i : i + options["batch_size"]])
+        # Courses without any tuples aren't reached through their tuples.
+        repaired += refresh_courses(
+            Course.objects.filter(
+                coursetuple__isnull=True, subscriber_count__gt=0
+            ).values_list("pk", flat=True)
+        )
+        self.stdout.write(
+            f"Recounted {len(ids)} course tuples and repaired {repaired} rows."
+        )
@@ -0,0 +1,280 @@
+import logging
+import os
+import socket
+import threading
+import time
+import typing
+
+import redis
+
+from django.conf import settings
+
+from .redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+KEY = "metrics"
+# Followed by the process's host and pid.
+GAUGES_KEY = "metrics:gauges:"
+# Sorted set of the processes' gauge keys, scored by when they expire, so that they can be read
+# without scanning the keyspace.
+GAUGES_INDEX_KEY = "metrics:gauges"
+
+# Upper bounds, in seconds, of the buckets that durations are counted in.
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+)
+STALENESS_BUCKETS = (30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+METRICS = {
+    "ucm_ssc_request_seconds": ("histogram", "Time taken by requests to the SSC."),
+    "ucm_ssc_requests_total": (
+        "counter",
+        "Requests made to the SSC, by response status.",
+    ),
+    "ucm_parse_seconds": ("histogram", "Time taken to parse an SSC page, by parser."),
+    "ucm_ssc_pages_total": (
+        "counter",
+        "SSC pages downloaded, by whether they were unchanged and reused without parsing.",
+    ),
+    "ucm_seat_cache_total": ("counter", "Seat cache lookups, by result."),
+    "ucm_checks_total": ("counter", "Checks of a section, by what they found."),
+    "ucm_course_staleness_seconds": (
+        "histogram",
+        "Time since a section was last checked, measured when it is checked again.",
+    ),
+    "ucm_sweep_seconds": ("histogram", "Time taken by a monitor sweep."),
+    "ucm_sweep_db_seconds": (
+        "histogram",
+        "Time spent on database queries during a monitor sweep.",
+    ),
+    "ucm_sweep_courses_total": ("counter", "Sections checked by monitor sweeps."),
+    "ucm_notifications_total": (
+        "counter",
+        "Notifications sent, by channel and whether they were sent.",
+    ),
+    "ucm_notifier_send_seconds": (
+        "histogram",
+        "Time taken by a notifier to send a batch of notifications, by channel.",
+    ),
+    "ucm_notification_latency_seconds": (
+        "histogram",
+        "Time from finding an opening to notifying a user about it, by channel.",
+    ),
+    "ucm_circuit_breaker_open": (
+        "gauge",
+        "Whether a circuit breaker is refusing requests (1) or not (0).",
+    ),
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name: str, labels: typing.Dict[str, str]) -> str:
+    if len(labels) == 0:
+        return name
+    values = ",".join(
+        f'{label}="{_escape(value)}"' for label, value in sorted(labels.items())
+    )
+    return f"{name}{{{values}}}"
+
+
+class Registry:
+    """Collects metrics in memory and periodically adds them to totals kept in Redis.
+
+    Every web and Celery process adds to the same totals, so the metrics view reports on all of
+    them together. Gauges can't be added up, so each process keeps its own and the metrics view
+    reports the highest. Without Redis, the totals are kept in memory and only cover this
+    process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.increments = {}
+        self.gauges = {}
+        self.gauges_changed = False
+        self.gauges_written = 0.0
+        self.totals = {}
+        self.flushed = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self.lock:
+            self._inc(_series(name, labels), value)
+        self._maybe_flush()
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: typing.Sequence[float] = DURATION_BUCKETS,
+        **labels,
+    ) -> None:
+        with self.lock:
+            for bound in buckets:
+                if value <= bound:
+                    self._inc(_series(f"{name}_bucket", dict(labels, le=bound)), 1)
+            self._inc(_series(f"{name}_bucket", dict(labels, le="+Inf")), 1)
+            self._inc(_series(f"{name}_sum", labels), value)
+            self._inc(_series(f"{name}_count", labels), 1)
+        self._maybe_flush()
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.gauges[_series(name, labels)] = value
+            self.gauges_changed = True
+        self._maybe_flush()
+
+    def _inc(self, series: str, value: float) -> None:
+        self.increments[series] = self.increments.get(series, 0) + value
+
+    def _maybe_flush(self) -> None:
+        if time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        """Adds the metrics collected since the last flush to the totals."""
+        with self.lock:
+            now = time.monotonic()
+            increments, self.increments = self.increments, {}
+            # Gauges are written again before they expire, even if they haven't changed.
+            gauges = {}
+            if self.gauges_changed or (
+                len(self.gauges) > 0
+                and now - self.gauges_written >= settings.METRICS_GAUGE_TTL / 2
+            ):
+                gauges = dict(self.gauges)
+                self.gauges_changed = False
+                self.gauges_written = now
+            self.flushed = now
+        if len(increments) == 0 and len(gauges) == 0:
+            return
+
+        client = get_redis()
+        if client is not None:
+            try:
+                pipeline = client.pipeline(transaction=False)
+                for series, value in increments.items():
+                    pipeline.hincrbyfloat(KEY, series, value)
+                if len(gauges) > 0:
+                    key = f"{GAUGES_KEY}{socket.gethostname()}:{os.getpid()}"
+                    pipeline.hset(key, mapping=gauges)
+                    pipeline.expire(key, settings.METRICS_GAUGE_TTL)
+                    pipeline.zadd(
+                        GAUGES_INDEX_KEY,
+                        {key: time.time() + settings.METRICS_GAUGE_TTL},
+                    )
+                pipeline.execute()
+                return
+            except redis.RedisError:
+                logger.exception("Failed to write metrics to Redis.")
+
+        with self.lock:
+            for series, value in increments.items():
+                self.totals[series] = self.totals.get(series, 0) + value
+            self.totals.update(gauges)
+
+    def collect(self) -> typing.Dict[str, float]:
+        """Returns the current value of every series."""
+        self.flush()
+        client = get_redis()
+        if client is not None:
+            try:
+                totals = {
+                    series: float(value)
+                    for series, value in client.hgetall(KEY).items()
+                }
+                client.zremrangebyscore(GAUGES_INDEX_KEY, "-inf", time.time())
+                pipeline = client.pipeline(transaction=False)
+                for key in client.zrange(GAUGES_INDEX_KEY, 0, -1):
+                    pipeline.hgetall(key)
+                for gauges in pipeline.execute():
+                    for series, value in gauges.items():
+                        value = float(value)
+                        totals[series] = max(totals.get(series, value), value)
+                return totals
+            except redis.RedisError:
+                logger.exception("Failed to read metrics from Redis.")
+        with self.lock:
+            return dict(self.totals)
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+set_gauge = registry.set
+flush = registry.flush
+
+
+class Timer:
+    """Context manager that observes how long its block took in a histogram."""
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.seconds = time.perf_counter() - self.start
+        observe(self.name, self.seconds, **self.labels)
+
+
+class QueryTimer:
+    """Database execute wrapper that counts queries and adds up the time spent running them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = 0.0
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.seconds += time.perf_counter() - start
+                self.queries += 1
+
+
+def render() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    totals = registry.collect()
+    families = {}
+    for series, value in totals.items():
+        base = series.split("{", 1)[0]
+        for suffix in ("_bucket", "_sum", "_count"):
+            if base.endswith(suffix) and base[: -len(suffix)] in METRICS:
+                base = base[: -len(suffix)]
+                break
+        families.setdefault(base, []).append((series, value))
+
+    lines = []
+    for name in sorted(families):
+        kind, description = METRICS.get(name, ("untyped", ""))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for series, value in sorted(families[name]):
+            # Totals kept in memory may be ints.
+            value = float(value)
+            value = int(value) if value.is_integer() else value
+            lines.append(f"{series} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_auto_20200718_0823'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='last_seats',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='ssc_etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='ssc_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='ssc_last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:37
+
+from django.db import migrations, models
+
+
+def mark_existing_courses_valid(apps, schema_editor):
+    # Courses added before this migration were checked against the SSC when they were added.
+    Course = apps.get_model('courses', 'Course')
+    Course.objects.update(status='valid')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_auto_20261018_0534'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending validation'), ('valid', 'Valid'), ('invalid', 'Invalid'), ('stt', 'STT only'), ('blocked', 'Blocked'), ('failed', 'Could not be checked')], default='pending', max_length=7),
+        ),
+        migrations.RunPython(mark_existing_courses_valid, migrations.RunPython.noop),
+    ]
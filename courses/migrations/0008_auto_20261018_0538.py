@@ -0,0 +1,23 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_course_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='last_checked',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='seat_change_rate',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:43
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def count_subscribers(apps, schema_editor):
+    Course = apps.get_model('courses', 'Course')
+    CourseTuple = apps.get_model('courses', 'CourseTuple')
+
+    priority = Q(profile__is_premium=True) | Q(profile__user__is_staff=True)
+    course_tuples = CourseTuple.objects.annotate(
+        subscribers=Count('profile', distinct=True),
+        priority_subscribers=Count('profile', filter=priority, distinct=True),
+    )
+    for ct in course_tuples.iterator():
+        ct.subscriber_count = ct.subscribers
+        ct.priority_subscriber_count = ct.priority_subscribers
+        ct.save(update_fields=['subscriber_count', 'priority_subscriber_count'])
+
+    restricted = Q(coursetuple__restricted=True)
+    courses = Course.objects.annotate(
+        subscribers=Sum('coursetuple__subscriber_count'),
+        restricted_subscribers=Sum('coursetuple__subscriber_count', filter=restricted),
+        priority_subscribers=Sum('coursetuple__priority_subscriber_count'),
+    )
+    for course in courses.iterator():
+        course.subscriber_count = course.subscribers or 0
+        course.restricted_subscriber_count = course.restricted_subscribers or 0
+        course.priority_subscriber_count = course.priority_subscribers or 0
+        course.save(
+            update_fields=[
+                'subscriber_count',
+                'restricted_subscriber_count',
+                'priority_subscriber_count',
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_auto_20261018_0538'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='priority_subscriber_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='restricted_subscriber_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='subscriber_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coursetuple',
+            name='priority_subscriber_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coursetuple',
+            name='subscriber_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['priority_subscriber_count', 'subscriber_count', 'last_open'], name='course_monitored_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetuple',
+            index=models.Index(fields=['course', 'restricted'], name='coursetuple_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetuple',
+            index=models.Index(fields=['subscriber_count'], name='coursetuple_subscribers_idx'),
+        ),
+        migrations.RunPython(count_subscribers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0009_auto_20261018_0543'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('open_samples', models.PositiveIntegerField(default=0)),
+                ('changes', models.PositiveIntegerField(default=0)),
+                ('min_total_open', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('max_total_open', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('max_general_open', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='courses.Course')),
+            ],
+            options={
+                'ordering': ['course', 'resolution', 'start'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SeatObservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('state', models.CharField(choices=[('seats', 'Seats'), ('blocked', 'Blocked'), ('stt', 'STT only'), ('invalid', 'Invalid'), ('failed', 'Could not be checked')], max_length=7)),
+                ('total_open', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('registered', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('general_open', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('restricted_open', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='courses.Course')),
+            ],
+            options={
+                'ordering': ['course', 'time'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='seatrollup',
+            index=models.Index(fields=['resolution', 'start'], name='rollup_start_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='seatrollup',
+            unique_together={('course', 'resolution', 'start')},
+        ),
+        migrations.AddIndex(
+            model_name='seatobservation',
+            index=models.Index(fields=['course', 'time'], name='observation_course_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seatobservation',
+            index=models.Index(fields=['time'], name='observation_time_idx'),
+        ),
+    ]
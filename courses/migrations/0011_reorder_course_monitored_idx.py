@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0010_seat_history'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='course',
+            name='course_monitored_idx',
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['subscriber_count', 'priority_subscriber_count', 'last_open'], name='course_monitored_idx'),
+        ),
+    ]
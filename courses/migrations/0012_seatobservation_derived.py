@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0011_reorder_course_monitored_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seatobservation',
+            name='derived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
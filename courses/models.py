@@ -1,11 +1,25 @@
-import re
-from typing import Tuple, Union
+from typing import Dict, List, Tuple
 
 import requests
-from bs4 import BeautifulSoup
 
+from django.conf import settings
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+from . import ssc, tracing
+from .breaker import CircuitOpenError
+from .parsing import (
+    Seats,
+    dump_seats,
+    fingerprint,
+    fingerprint_stats,
+    load_seats,
+    parse_seats,
+    parse_section_statuses,
+    seats_from_status,
+)
 
 
 year_validator = r"^20\d{2}$"
@@ -14,6 +28,27 @@ number_validator = r"^[A-Z0-9]{3,4}$"
 section_validator = r"^[A-Z0-9]{3,5}$"
 
 
+class CourseQuerySet(models.QuerySet):
+    def monitored(self) -> "CourseQuerySet":
+        """Returns the courses that the monitor should check.
+
+        A course is left out if it is known to be invalid, nobody monitors it, it is cooling
+        down after an opening, or only non-premium users monitor it while their notifications
+        are turned off.
+        """
+        courses = (
+            self.exclude(status="invalid")
+            .filter(subscriber_count__gt=0)
+            .filter(
+                Q(last_open__isnull=True)
+                | Q(last_open__lt=timezone.now() - settings.OPEN_COURSE_DELAY)
+            )
+        )
+        if not settings.NON_PREMIUM_NOTIFICATIONS:
+            courses = courses.filter(priority_subscriber_count__gt=0)
+        return courses
+
+
 class Course(models.Model):
     campus = models.CharField(
         max_length=4,
@@ -34,6 +69,37 @@ class Course(models.Model):
         max_length=5, validators=[RegexValidator(regex=section_validator)]
     )
     last_open = models.DateTimeField(blank=True, null=True, default=None)
+    # Denormalized from the course's tuples by the signal receivers in courses.counters.
+    subscriber_count = models.PositiveIntegerField(default=0)
+    restricted_subscriber_count = models.PositiveIntegerField(default=0)
+    priority_subscriber_count = models.PositiveIntegerField(default=0)
+    status = models.CharField(
+        max_length=7,
+        choices=[
+            ("pending", "Pending validation"),
+            ("valid", "Valid"),
+            ("invalid", "Invalid"),
+            ("stt", "STT only"),
+            ("blocked", "Blocked"),
+            ("failed", "Could not be checked"),
+        ],
+        default="pending",
+    )
+    last_checked = models.DateTimeField(blank=True, null=True, default=None)
+    seat_change_rate = models.FloatField(default=0)
+    ssc_fingerprint = models.CharField(max_length=32, blank=True, default="")
+    ssc_etag = models.CharField(max_length=255, blank=True, default="")
+    ssc_last_modified = models.CharField(max_length=64, blank=True, default="")
+    last_seats = models.CharField(max_length=64, blank=True, default="")
+
+    objects = CourseQuerySet.as_manager()
+
+    SSC_STATE_FIELDS = [
+        "ssc_fingerprint",
+        "ssc_etag",
+        "ssc_last_modified",
+        "last_seats",
+    ]
 
     def __str__(self) -> str:
         return f"{self.campus} {self.year}{self.session} {self.subject} {self.number} {self.section}"
@@ -41,90 +107,279 @@ class Course(models.Model):
     class Meta:
         unique_together = ["campus", "year", "session", "subject", "number", "section"]
         ordering = ["campus", "year", "session", "subject", "number", "section"]
+        indexes = [
+            # Leads with subscriber_count, which monitored() always filters on, unlike
+            # priority_subscriber_count.
+            models.Index(
+                fields=["subscriber_count", "priority_subscriber_count", "last_open"],
+                name="course_monitored_idx",
+            ),
+        ]
 
     def sub_num_sec(self) -> str:
         return f"{self.subject} {self.number} {self.section}"
 
     def url(self) -> str:
         return (
-            f"https://courses.students.ubc.ca/cs/courseschedule?pname=subjarea&tname=subj-section&campuscd="
+            f"{settings.SSC_BASE_URL}/cs/courseschedule?pname=subjarea&tname=subj-section&campuscd="
             f"{self.campus}&sessyr={self.year}&sesscd={self.session}&dept={self.subject}&course={self.number}"
             f"&section={self.section}"
         )
 
-    def download_ssc(self) -> BeautifulSoup or None:
-        """Downloads the course's SSC page and returns its HTML content."""
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, "
-            "like Gecko) Chrome/39.0.2171.95 Safari/537.36"
-        }
+    def course_url(self) -> str:
+        """Returns the URL of the SSC page listing every section of the course."""
+        return (
+            f"{settings.SSC_BASE_URL}/cs/courseschedule?pname=subjarea&tname=subj-course&campuscd="
+            f"{self.campus}&sessyr={self.year}&sesscd={self.session}&dept={self.subject}&course={self.number}"
+        )
+
+    def batch_key(self) -> Tuple[str, str, str, str, str]:
+        """Returns the key shared by every section that is listed on the same course page."""
+        return self.campus, self.year, self.session, self.subject, self.number
+
+    def download_ssc(self, headers: dict = None) -> requests.Response or None:
+        """Downloads the course's SSC page, or returns None if the download failed.
+
+        Raises CircuitOpenError if the SSC's circuit breaker is open, since no download was tried.
+        """
         try:
-            response = requests.get(self.url(), headers=headers)
-            return BeautifulSoup(response.text, "html.parser")
+            return ssc.get(self.url(), headers=headers)
+        except CircuitOpenError:
+            raise
         except Exception:
             return None
 
-    def get_seats(self) -> Union[Tuple[int, int, int, int, bool], str, bool]:
-        soup = self.download_ssc()
+    def get_seats(self) -> Seats:
+        """Downloads the course's SSC page and reads its seat counts.
+
+        If the SSC reports that the page is unmodified, or the part of it describing the section
+        has the same fingerprint as last time, the previous result is returned without parsing.
+        Raises CircuitOpenError if the SSC's circuit breaker is open.
+        """
+        previous = load_seats(self.last_seats)
+
+        headers = {}
+        if previous is not None:
+            if self.ssc_etag:
+                headers["If-None-Match"] = self.ssc_etag
+            if self.ssc_last_modified:
+                headers["If-Modified-Since"] = self.ssc_last_modified
 
-        if soup is not None:
+        with tracing.span("download", course=self.pk) as span:
+            response = self.download_ssc(headers)
+            span["status"] = None if response is None else response.status_code
+        if response is None:
+            return False
+
+        if response.status_code == 304 and previous is not None:
+            fingerprint_stats.record(hit=True)
+            return previous
+
+        html = response.text
+        digest = fingerprint(html)
+        # The validators are only kept along with a result read from the same page. Otherwise a
+        # maintenance or error page would be answered with a 304 next time, and last_seats
+        # returned as if it were current.
+        validators = {
+            "ssc_etag": response.headers.get("ETag", ""),
+            "ssc_last_modified": response.headers.get("Last-Modified", ""),
+        }
+        if previous is not None and digest == self.ssc_fingerprint:
+            fingerprint_stats.record(hit=True)
+            self._set_ssc_state(**validators)
+            return previous
+
+        fingerprint_stats.record(hit=False)
+        with tracing.span("parse", course=self.pk):
+            seats = parse_seats(html)
+        if seats is not False:
+            self._set_ssc_state(
+                ssc_fingerprint=digest, last_seats=dump_seats(seats), **validators
+            )
+        return seats
+
+    def get_section_statuses(self) -> Dict[str, str] or None:
+        """Downloads the course's SSC page and returns the status of each of its sections."""
+        with tracing.span("download_course_page", course=self.pk) as span:
             try:
-                seats = list(
-                    map(lambda i: i.text, soup.select("table > tr > td > strong"))
-                )
-                total_open = int(seats[0])
-                registered = int(seats[1])
-                general_open = int(seats[2])
-                restricted_open = int(seats[3])
-
-                blocked_regex = (
-                    r"Note: this section is blocked from registration. Check the comments for details or "
-                    r"contact the department for further details."
-                )
-                blocked_string = soup.select(
-                    "html > body > div.container > div.content.expand > strong"
-                )
-
-                if len(blocked_string) > 0 and re.search(
-                    blocked_regex, blocked_string[0].text
-                ):
-                    blocked = True
-                else:
-                    blocked = False
-
-                return total_open, registered, general_open, restricted_open, blocked
-
-            except IndexError:
-                stt_regex = (
-                    r"Note: The remaining seats in this section are only available through a Standard "
-                    r"Timetable \(STT\)"
-                )
-                stt_string = soup.select(
-                    "html > body > div.container > div.content.expand > strong"
-                )
-                if len(stt_string) > 0 and re.search(stt_regex, stt_string[0].text):
-                    return "stt"
-
-                nlo_regex = (
-                    r"The requested section is either no longer offered at UBC (Vancouver|Okanagan) "
-                    r"or is not being offered this session."
-                )
-                nlo_string = soup.select(
-                    "html > body > div.container > div.content.expand"
-                )
-                if len(nlo_string) > 0 and re.search(nlo_regex, nlo_string[0].text):
-                    return "invalid"
-
-        return False
+                response = ssc.get(self.course_url())
+            except Exception:
+                return None
+            span["status"] = response.status_code
+        if response.status_code != 200:
+            return None
+        return parse_section_statuses(response.text) or None
+
+    def get_seats_from_status(self, status: str or None) -> Seats or None:
+        """Returns the section's seats if they can be worked out from its status on the course page."""
+        if status is None:
+            return None
+        return seats_from_status(status, load_seats(self.last_seats))
+
+    def update_status(self, seats: Seats) -> bool:
+        """Sets the course's status from a get_seats result and returns whether it changed."""
+        if seats is False:
+            status = "failed" if self.status in ("pending", "failed") else self.status
+        elif seats in ("invalid", "stt"):
+            status = seats
+        elif seats[4]:
+            status = "blocked"
+        else:
+            status = "valid"
+        changed = status != self.status
+        self.status = status
+        return changed
+
+    def set_last_seats(self, seats: Seats) -> None:
+        """Remembers a check's result, however it was found, so that it is shown to users and
+        seat changes are measured against it.
+
+        If the seats differ from the last result, they came from the course page or the seat
+        cache rather than from parsing the section's page. That page's validators and
+        fingerprint are then forgotten, so that the page is parsed the next time it is
+        downloaded instead of returning last_seats as unchanged.
+        """
+        if seats is False:
+            return
+        dumped = dump_seats(seats)
+        if dumped != self.last_seats:
+            self._set_ssc_state(
+                last_seats=dumped, ssc_fingerprint="", ssc_etag="", ssc_last_modified=""
+            )
+
+    def _set_ssc_state(self, **fields) -> None:
+        for field, value in fields.items():
+            if getattr(self, field) != value:
+                setattr(self, field, value)
+                self._ssc_state_changed = True
+
+    def save_ssc_state(self, update_fields: List[str] = ()) -> None:
+        """Saves update_fields, along with the fingerprint of the course's last SSC page and its
+        result if they changed, in a single query."""
+        fields = list(update_fields)
+        if getattr(self, "_ssc_state_changed", False):
+            fields += self.SSC_STATE_FIELDS
+            self._ssc_state_changed = False
+        if fields:
+            self.save(update_fields=fields)
 
 
 class CourseTuple(models.Model):
     restricted = models.BooleanField()
     course = models.ForeignKey("Course", on_delete=models.CASCADE)
+    # Denormalized from Profile.courses by the signal receivers in courses.counters. Priority
+    # subscribers are premium or staff users.
+    subscriber_count = models.PositiveIntegerField(default=0)
+    priority_subscriber_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ["restricted", "course"]
         ordering = ["course", "restricted"]
+        indexes = [
+            models.Index(
+                fields=["course", "restricted"], name="coursetuple_ordering_idx"
+            ),
+            models.Index(
+                fields=["subscriber_count"], name="coursetuple_subscribers_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.course}" if self.restricted is False else f"{self.course} R"
+
+
+class SeatObservation(models.Model):
+    """A section's seats as seen by one check of the SSC.
+
+    Observations are summarized into SeatRollups and deleted once they are older than
+    SEAT_HISTORY_RAW_RETENTION.
+    """
+
+    course = models.ForeignKey(
+        "Course", on_delete=models.CASCADE, related_name="observations"
+    )
+    time = models.DateTimeField()
+    state = models.CharField(
+        max_length=7,
+        choices=[
+            ("seats", "Seats"),
+            ("blocked", "Blocked"),
+            ("stt", "STT only"),
+            ("invalid", "Invalid"),
+            ("failed", "Could not be checked"),
+        ],
+    )
+    # The seat counts are only known in the seats and blocked states.
+    total_open = models.PositiveSmallIntegerField(blank=True, null=True)
+    registered = models.PositiveSmallIntegerField(blank=True, null=True)
+    general_open = models.PositiveSmallIntegerField(blank=True, null=True)
+    restricted_open = models.PositiveSmallIntegerField(blank=True, null=True)
+    # Whether the seats were worked out from the section's status on its course page rather than
+    # read from its own page, in which case the number registered isn't known.
+    derived = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ["course", "time"]
+        indexes = [
+            models.Index(fields=["course", "time"], name="observation_course_idx"),
+            models.Index(fields=["time"], name="observation_time_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.course} at {self.time:%Y-%m-%d %H:%M:%S}"
+
+    @classmethod
+    def from_seats(
+        cls, course: Course, seats: Seats, time=None, derived: bool = False
+    ) -> "SeatObservation":
+        observation = cls(
+            course=course,
+            time=timezone.now() if time is None else time,
+            derived=derived,
+        )
+        if seats is False:
+            observation.state = "failed"
+        elif seats in ("invalid", "stt"):
+            observation.state = seats
+        else:
+            (
+                observation.total_open,
+                observation.registered,
+                observation.general_open,
+                observation.restricted_open,
+                blocked,
+            ) = seats
+            observation.state = "blocked" if blocked else "seats"
+            if derived:
+                observation.registered = None
+        return observation
+
+
+class SeatRollup(models.Model):
+    """Summarizes a section's seat observations over an hour or a day (in UTC)."""
+
+    course = models.ForeignKey(
+        "Course", on_delete=models.CASCADE, related_name="rollups"
+    )
+    resolution = models.CharField(
+        max_length=4, choices=[("hour", "Hourly"), ("day", "Daily")]
+    )
+    start = models.DateTimeField()
+    samples = models.PositiveIntegerField(default=0)
+    # Samples in which the section had seats that weren't blocked.
+    open_samples = models.PositiveIntegerField(default=0)
+    # Number of times the section's seats or state differed from the previous sample.
+    changes = models.PositiveIntegerField(default=0)
+    min_total_open = models.PositiveSmallIntegerField(blank=True, null=True)
+    max_total_open = models.PositiveSmallIntegerField(blank=True, null=True)
+    max_general_open = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ["course", "resolution", "start"]
+        ordering = ["course", "resolution", "start"]
+        indexes = [
+            models.Index(fields=["resolution", "start"], name="rollup_start_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.course} {self.resolution} from {self.start:%Y-%m-%d %H:%M}"
@@ -0,0 +1,213 @@
+import json
+import logging
+import queue
+import smtplib
+import socket
+import typing
+
+import redis
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from .redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the mail connection is reopened and the message sent again.
+DISCONNECTS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+# Open mail connections that no thread is using. A thread sending a message takes one, or opens
+# one if there are none, and puts it back afterwards, so each worker keeps about as many
+# connections open as there are threads sending email at once.
+_idle_connections = queue.LifoQueue()
+
+
+def get_mail_connection(reuse: bool = True):
+    """Takes an idle mail connection, opening a new one if there isn't one or reuse is False.
+
+    Connections are kept open between notifications, so only the first message sent over each
+    one pays for connecting, the TLS handshake and authenticating.
+    """
+    connection = None
+    if reuse:
+        try:
+            connection = _idle_connections.get_nowait()
+        except queue.Empty:
+            pass
+    if connection is None:
+        connection = get_connection(fail_silently=False)
+    connection.open()
+    return connection
+
+
+def release_mail_connection(connection) -> None:
+    """Puts a connection taken with get_mail_connection back so that it can be reused."""
+    _idle_connections.put(connection)
+
+
+def close_mail_connection(connection) -> None:
+    try:
+        connection.close()
+    except (smtplib.SMTPException, OSError):
+        logger.debug("Failed to close the mail connection cleanly.", exc_info=True)
+
+
+def _send(message: EmailMessage) -> bool:
+    """Sends a message over an idle connection, retrying once over a new connection if it was
+    dropped."""
+    for attempt in range(2):
+        connection = get_mail_connection(reuse=attempt == 0)
+        try:
+            sent = connection.send_messages([message]) == 1
+        except DISCONNECTS:
+            close_mail_connection(connection)
+            if attempt == 1:
+                raise
+            logger.info("The mail connection was dropped; reconnecting.")
+            continue
+        except smtplib.SMTPException:
+            # The server refused the message, but the connection can still be used.
+            release_mail_connection(connection)
+            raise
+        except Exception:
+            close_mail_connection(connection)
+            raise
+        release_mail_connection(connection)
+        return sent
+    return False
+
+
+def opening_email(courses: typing.List) -> typing.Tuple[str, str]:
+    """Returns the subject and body of an email about openings in one or more courses."""
+    footer = (
+        "If you do not want to receive any more emails like this, just go to your profile page "
+        "to unsubscribe."
+    )
+    if len(courses) == 1:
+        course = courses[0]
+        subject = f"There is an open seat in {course.sub_num_sec()}. Check the SSC."
+        body = (
+            f"There is an opening in {course.subject} {course.number}, section "
+            f"{course.section}.\n\n{course.url()}\n\n{footer}"
+        )
+    else:
+        subject = f"There are open seats in {len(courses)} sections. Check the SSC."
+        listing = "\n\n".join(
+            f"{course.subject} {course.number}, section {course.section}:\n{course.url()}"
+            for course in courses
+        )
+        body = f"There are openings in:\n\n{listing}\n\n{footer}"
+    return subject, body
+
+
+def invalid_section_email(course) -> typing.Tuple[str, str]:
+    """Returns the subject and body of an email about a section that was removed because it does
+    not exist on the SSC."""
+    subject = f"{course.sub_num_sec()} could not be found on the SSC"
+    body = (
+        f"We could not find {course.subject} {course.number}, section {course.section} on the SSC, "
+        f"so we have stopped monitoring it for you.\n\n{course.url()}\n\nPlease check the "
+        f"section for errors and add it again. If the course does, in fact, exist, please contact "
+        f"us at contact@ubccoursemonitor.email."
+    )
+    return subject, body
+
+
+def send_email(subject: str, body: str, address: str) -> bool:
+    """Emails a notification to a single address and returns whether it was sent."""
+    message = EmailMessage(subject, body, settings.EMAIL_NOTIFIER_ADDRESS, [address])
+    try:
+        return _send(message)
+    except (smtplib.SMTPException, OSError):
+        logger.exception(f"Failed to send a notification to {address}.")
+        return False
+
+
+def claim(key: str) -> bool:
+    """Claims the right to send the notification identified by key.
+
+    Returns False if it was already sent, or is being sent by another task. A claim that is not
+    marked as sent lapses after NOTIFICATION_CLAIM_TIMEOUT seconds, so the notification can be
+    retried if its sender died. Without Redis every claim is granted.
+    """
+    client = get_redis()
+    if client is None:
+        return True
+    try:
+        return bool(
+            client.set(key, "sending", nx=True, ex=settings.NOTIFICATION_CLAIM_TIMEOUT)
+        )
+    except redis.RedisError:
+        logger.exception(f"Failed to claim notification {key}.")
+        return True
+
+
+def mark_sent(key: str) -> None:
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.set(key, "sent", ex=settings.NOTIFICATION_IDEMPOTENCY_TTL)
+    except redis.RedisError:
+        logger.exception(f"Failed to mark notification {key} as sent.")
+
+
+def release(key: str) -> None:
+    """Gives up a claim on a notification that could not be sent, so that it can be retried."""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(key)
+    except redis.RedisError:
+        logger.exception(f"Failed to release notification {key}.")
+
+
+def add_to_digest(profile_id: int, key: str, course_id: int) -> bool or None:
+    """Adds an opening to a user's pending digest.
+
+    Returns True if the opening started a new digest, which the caller must then schedule to be
+    sent, False if it joined one that is already scheduled, or None if it couldn't be added.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    digest = f"digest:{profile_id}"
+    try:
+        pipeline = client.pipeline()
+        pipeline.rpush(digest, json.dumps({"key": key, "course": course_id}))
+        # A digest whose sender died is dropped eventually, so later openings start a new one.
+        pipeline.expire(
+            digest,
+            settings.NOTIFICATION_DIGEST_WINDOW + settings.NOTIFICATION_CLAIM_TIMEOUT,
+        )
+        length, _ = pipeline.execute()
+    except redis.RedisError:
+        logger.exception(f"Failed to add {key} to a digest.")
+        return None
+    return length == 1
+
+
+def pop_digest(profile_id: int) -> typing.List[dict]:
+    """Removes and returns the openings in a user's pending digest."""
+    client = get_redis()
+    if client is None:
+        return []
+    digest = f"digest:{profile_id}"
+    pipeline = client.pipeline()
+    pipeline.lrange(digest, 0, -1)
+    pipeline.delete(digest)
+    entries, _ = pipeline.execute()
+    return [json.loads(entry) for entry in entries]
+
+
+def restore_digest(profile_id: int, entries: typing.List[dict]) -> None:
+    """Puts back openings taken by pop_digest that could not be sent."""
+    client = get_redis()
+    if client is None or len(entries) == 0:
+        return
+    client.lpush(
+        f"digest:{profile_id}", *(json.dumps(entry) for entry in reversed(entries))
+    )
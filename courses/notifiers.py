@@ -0,0 +1,339 @@
+import ipaddress
+import logging
+import socket
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import metrics, notifications
+
+
+logger = logging.getLogger(__name__)
+
+
+class Notification(typing.NamedTuple):
+    """A message about one or more openings, addressed to one user on one channel."""
+
+    key: str
+    channel: str
+    address: str
+    subject: str
+    body: str
+    url: str
+
+
+class Throttle:
+    """Thread-safe token bucket that limits how many messages a notifier sends per second."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+class Notifier:
+    """Sends notifications over one channel.
+
+    Subclasses implement send_one, or override send to deliver a whole batch at once. Messages
+    are sent by up to CONCURRENCY threads, and at most RATE messages are sent per second.
+    """
+
+    def __init__(self, rate: float = 10, concurrency: int = 1, **options):
+        self.throttle = Throttle(rate, burst=concurrency)
+        self.concurrency = concurrency
+        self.options = options
+
+    def send_one(self, notification: Notification) -> bool:
+        raise NotImplementedError
+
+    def _send_one(self, notification: Notification) -> bool:
+        self.throttle.acquire()
+        try:
+            return self.send_one(notification)
+        except Exception:
+            logger.exception(f"Failed to send {notification.key}.")
+            return False
+
+    def send(self, batch: typing.List[Notification]) -> typing.List[bool]:
+        """Sends a batch of notifications and returns whether each of them was sent."""
+        if self.concurrency == 1 or len(batch) <= 1:
+            return [self._send_one(notification) for notification in batch]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(self._send_one, batch))
+
+
+class HTTPNotifier(Notifier):
+    """Base class for notifiers that call an HTTP API over a pooled session."""
+
+    adapter_class = HTTPAdapter
+
+    def __init__(self, timeout: float = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = self.adapter_class(pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.post(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+class SMTPNotifier(Notifier):
+    """Emails each user over the worker's pooled SMTP connections, one for each thread that is
+    sending at once."""
+
+    def send_one(self, notification: Notification) -> bool:
+        return notifications.send_email(
+            notification.subject, notification.body, notification.address
+        )
+
+
+class SendGridNotifier(HTTPNotifier):
+    """Emails users through SendGrid's HTTP API.
+
+    Notifications with the same content are sent with a single API call, with a personalization
+    for each recipient so that nobody sees anyone else's address.
+    """
+
+    API_URL = "https://api.sendgrid.com/v3/mail/send"
+    MAX_PERSONALIZATIONS = 1000
+
+    def __init__(self, api_key: str = None, **kwargs):
+        super().__init__(**kwargs)
+        # The SMTP password is also a SendGrid API key.
+        self.api_key = settings.EMAIL_HOST_PASSWORD if api_key is None else api_key
+
+    def send(self, batch: typing.List[Notification]) -> typing.List[bool]:
+        groups = {}
+        for i, notification in enumerate(batch):
+            groups.setdefault((notification.subject, notification.body), []).append(i)
+
+        chunks = []
+        for (subject, body), indices in groups.items():
+            for start in range(0, len(indices), self.MAX_PERSONALIZATIONS):
+                chunks.append(
+                    (subject, body, indices[start : start + self.MAX_PERSONALIZATIONS])
+                )
+
+        results = [False] * len(batch)
+
+        def send_chunk(chunk) -> None:
+            subject, body, indices = chunk
+            self.throttle.acquire()
+            try:
+                self.post(
+                    self.API_URL,
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    json={
+                        "personalizations": [
+                            {"to": [{"email": batch[i].address}]} for i in indices
+                        ],
+                        "from": {"email": settings.EMAIL_NOTIFIER_ADDRESS},
+                        "subject": subject,
+                        "content": [{"type": "text/plain", "value": body}],
+                    },
+                )
+            except requests.RequestException:
+                logger.exception(
+                    f"Failed to send {len(indices)} emails through SendGrid."
+                )
+                return
+            for i in indices:
+                results[i] = True
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(send_chunk, chunks))
+        return results
+
+
+def public_address(host: str, port: int) -> str:
+    """Resolves host and returns one of its addresses, or raises ValueError unless every address
+    it resolves to is public."""
+    try:
+        addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise ValueError(f"{host} could not be found.")
+    for *_, sockaddr in addresses:
+        if not ipaddress.ip_address(sockaddr[0].split("%")[0]).is_global:
+            raise ValueError(f"{host} is not a public address.")
+    return addresses[0][4][0]
+
+
+def check_webhook_url(url: str) -> None:
+    """Raises ValueError unless url is an HTTPS URL whose host only resolves to public addresses.
+
+    Webhook URLs are given by users, so otherwise anyone could make the worker post to our
+    internal network or to the cloud provider's metadata service.
+    """
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.hostname:
+        raise ValueError("Webhook URLs must use HTTPS.")
+    public_address(parts.hostname, parts.port or 443)
+
+
+class PublicHTTPSConnection(HTTPSConnection):
+    """An HTTPS connection that only connects to public addresses.
+
+    The host is resolved and checked again for each new connection, and the socket is opened to
+    the address that was checked, so a host whose DNS changes after check_webhook_url can't be
+    used to reach an internal address. TLS is still verified against the host's name.
+    """
+
+    def _new_conn(self):
+        self._dns_host = public_address(self.host, self.port)
+        return super()._new_conn()
+
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    """Transport adapter whose HTTPS connections only go to public addresses."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"https": PublicHTTPSConnectionPool}
+
+
+class WebhookNotifier(HTTPNotifier):
+    """Posts each notification as JSON to the webhook URL the user gave us.
+
+    The URL is checked before every post, since where its host resolves to can change after the
+    user saved it, and its host is checked again whenever a connection is opened to it. Redirects
+    aren't followed.
+    """
+
+    adapter_class = PublicAddressAdapter
+
+    def send_one(self, notification: Notification) -> bool:
+        try:
+            check_webhook_url(notification.address)
+            response = self.post(
+                notification.address,
+                allow_redirects=False,
+                json={
+                    "subject": notification.subject,
+                    "body": notification.body,
+                    "url": notification.url,
+                },
+            )
+        except ValueError as e:
+            logger.warning(f"Refused to post {notification.key}: {e}")
+            return False
+        if response.is_redirect:
+            logger.warning(f"Refused to follow a redirect for {notification.key}.")
+            return False
+        return True
+
+
+class TwilioSMSNotifier(HTTPNotifier):
+    """Texts each notification to the user's phone number through Twilio's messaging API."""
+
+    def send_one(self, notification: Notification) -> bool:
+        account = self.options["account_sid"]
+        self.post(
+            f"https://api.twilio.com/2010-04-01/Accounts/{account}/Messages.json",
+            auth=(account, self.options["auth_token"]),
+            data={
+                "From": self.options["from_number"],
+                "To": notification.address,
+                "Body": f"{notification.subject} {notification.url}",
+            },
+        )
+        return True
+
+
+# Notifications "sent" by LocmemNotifier, for use in tests.
+outbox = []
+
+
+class LocmemNotifier(Notifier):
+    """Keeps notifications in the outbox list instead of sending them."""
+
+    def send_one(self, notification: Notification) -> bool:
+        outbox.append(notification)
+        return True
+
+
+_notifiers = {}
+_notifiers_lock = threading.Lock()
+
+
+def get_notifier(channel: str) -> Notifier or None:
+    """Returns the process-wide notifier for a channel configured in the NOTIFIERS setting."""
+    if channel not in _notifiers:
+        with _notifiers_lock:
+            if channel not in _notifiers:
+                config = settings.NOTIFIERS.get(channel)
+                if config is None:
+                    return None
+                backend = import_string(config["BACKEND"])
+                _notifiers[channel] = backend(
+                    rate=config.get("RATE", 10),
+                    concurrency=config.get("CONCURRENCY", 1),
+                    **config.get("OPTIONS", {}),
+                )
+    return _notifiers[channel]
+
+
+def dispatch(batch: typing.List[Notification]) -> typing.List[Notification]:
+    """Sends notifications over their channels, with every channel sending at the same time.
+
+    Returns the notifications that could not be sent.
+    """
+    channels = {}
+    for notification in batch:
+        channels.setdefault(notification.channel, []).append(notification)
+
+    def send_channel(channel: str) -> typing.List[Notification]:
+        notifier = get_notifier(channel)
+        if notifier is None:
+            logger.error(f"No notifier is configured for {channel}.")
+            return channels[channel]
+        with metrics.Timer("ucm_notifier_send_seconds", channel=channel):
+            results = notifier.send(channels[channel])
+        for sent in (True, False):
+            count = results.count(sent)
+            if count > 0:
+                metrics.inc(
+                    "ucm_notifications_total",
+                    count,
+                    channel=channel,
+                    result="sent" if sent else "failed",
+                )
+        return [n for n, sent in zip(channels[channel], results) if not sent]
+
+    if len(channels) <= 1:
+        return [n for channel in channels for n in send_channel(channel)]
+    with ThreadPoolExecutor(max_workers=len(channels)) as executor:
+        return [n for failed in executor.map(send_channel, channels) for n in failed]
@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import re
+import threading
+import typing
+from typing import Tuple, Union
+
+from bs4 import BeautifulSoup
+
+from django.conf import settings
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+Seats = Union[Tuple[int, int, int, int, bool], str, bool]
+
+BLOCKED_REGEX = re.compile(
+    r"Note: this section is blocked from registration. Check the comments for details or "
+    r"contact the department for further details."
+)
+STT_REGEX = re.compile(
+    r"Note: The remaining seats in this section are only available through a Standard "
+    r"Timetable \(STT\)"
+)
+NLO_REGEX = re.compile(
+    r"The requested section is either no longer offered at UBC (Vancouver|Okanagan) "
+    r"or is not being offered this session."
+)
+
+# Matches the <strong> that is the first child of a table cell, which is where the SSC puts each
+# of the four seat counts in a section's seat summary table.
+SEAT_CELL_REGEX = re.compile(r"<td\b[^>]*>\s*<strong\b[^>]*>([^<]*)</strong>", re.I)
+WHITESPACE_REGEX = re.compile(r"\s+")
+# Matches a row of the section summary table on a course's SSC page, capturing the section's
+# status (e.g. "Full", "Blocked", or blank if it has seats) and its name.
+SECTION_ROW_REGEX = re.compile(
+    r"<tr\b[^>]*\bsection\d[^>]*>\s*<td\b[^>]*>([^<]*)</td>\s*<td\b[^>]*>\s*<a\b[^>]*>\s*"
+    r"[A-Z]{2,4}\s+[A-Z0-9]{3,4}\s+([A-Z0-9]{3,5})\s*</a>",
+    re.I,
+)
+
+
+def parse_seats_soup(html: str) -> Seats:
+    """Reads a section's seat counts by building the whole document tree with BeautifulSoup."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    try:
+        seats = list(map(lambda i: i.text, soup.select("table > tr > td > strong")))
+        total_open = int(seats[0])
+        registered = int(seats[1])
+        general_open = int(seats[2])
+        restricted_open = int(seats[3])
+
+        blocked_string = soup.select(
+            "html > body > div.container > div.content.expand > strong"
+        )
+
+        if len(blocked_string) > 0 and BLOCKED_REGEX.search(blocked_string[0].text):
+            blocked = True
+        else:
+            blocked = False
+
+        return total_open, registered, general_open, restricted_open, blocked
+
+    except IndexError:
+        stt_string = soup.select(
+            "html > body > div.container > div.content.expand > strong"
+        )
+        if len(stt_string) > 0 and STT_REGEX.search(stt_string[0].text):
+            return "stt"
+
+        nlo_string = soup.select("html > body > div.container > div.content.expand")
+        if len(nlo_string) > 0 and NLO_REGEX.search(nlo_string[0].text):
+            return "invalid"
+
+    return False
+
+
+def parse_seats_fast(html: str) -> Seats:
+    """Reads a section's seat counts by scanning the raw HTML for the handful of strings we need.
+
+    This returns the same results as parse_seats_soup without building a document tree.
+    """
+    seats = []
+    for match in SEAT_CELL_REGEX.finditer(html):
+        seats.append(match.group(1))
+        if len(seats) == 4:
+            break
+
+    if len(seats) == 4:
+        total_open, registered, general_open, restricted_open = map(int, seats)
+        blocked = BLOCKED_REGEX.search(html) is not None
+        return total_open, registered, general_open, restricted_open, blocked
+
+    if STT_REGEX.search(html):
+        return "stt"
+
+    # The not-offered message can be split across lines or wrapped in markup.
+    if "no longer offered" in html and NLO_REGEX.search(
+        WHITESPACE_REGEX.sub(" ", html)
+    ):
+        return "invalid"
+
+    return False
+
+
+def parse_section_statuses(html: str) -> typing.Dict[str, str]:
+    """Reads the status of every section listed on a course's SSC page."""
+    return {
+        section.upper(): status.strip()
+        for status, section in SECTION_ROW_REGEX.findall(html)
+    }
+
+
+def seats_from_status(status: str, previous: Seats or None) -> Seats or None:
+    """Works out a section's seats from its status on the course's SSC page where possible.
+
+    The course page doesn't say how many students are registered, so that is carried over from
+    the previous seats, or 0 if there are none. Returns None if the section's own page is needed
+    to tell how many seats it has.
+    """
+    registered = previous[1] if isinstance(previous, tuple) else 0
+    if status == "Full":
+        return 0, registered, 0, 0, False
+    elif status == "Blocked":
+        if isinstance(previous, tuple):
+            return previous[:4] + (True,)
+        return 0, registered, 0, 0, True
+    elif status == "STT":
+        return "stt"
+    elif status == "Cancelled":
+        return "invalid"
+    return None
+
+
+PARSERS = {"fast": parse_seats_fast, "soup": parse_seats_soup}
+
+
+def parse_seats(html: str) -> Seats:
+    """Reads a section's seat counts using the parser selected by the SSC_PARSER setting.
+
+    In "shadow" mode both parsers are run, any disagreement between them is logged, and the
+    BeautifulSoup result is returned.
+    """
+    with metrics.Timer("ucm_parse_seconds", parser=settings.SSC_PARSER):
+        return _parse_seats(html)
+
+
+def _parse_seats(html: str) -> Seats:
+    if settings.SSC_PARSER == "shadow":
+        expected = parse_seats_soup(html)
+        try:
+            actual = parse_seats_fast(html)
+        except Exception as e:
+            actual = e
+        if actual != expected:
+            logger.warning(
+                f"Fast SSC parser returned {actual!r} but BeautifulSoup returned {expected!r}."
+            )
+        return expected
+    return PARSERS[settings.SSC_PARSER](html)
+
+
+def fingerprint(html: str) -> str:
+    """Returns a digest of the part of a section's SSC page that describes the section.
+
+    The site header, navigation and footer are left out, so that changes to them don't make an
+    otherwise identical page look different.
+    """
+    start = html.find("content expand")
+    end = html.find("ubc7-footer", max(start, 0))
+    if start == -1:
+        start = 0
+    if end == -1:
+        end = len(html)
+    return hashlib.blake2b(html[start:end].encode("utf-8"), digest_size=16).hexdigest()
+
+
+def dump_seats(seats: Seats) -> str:
+    """Serializes a parse result so that it can be stored in Course.last_seats."""
+    if isinstance(seats, tuple):
+        return ",".join(str(int(value)) for value in seats)
+    return str(seats)
+
+
+def load_seats(value: str) -> Seats or None:
+    """Deserializes a parse result stored by dump_seats, or returns None if there isn't one."""
+    if not value:
+        return None
+    if value in ("stt", "invalid"):
+        return value
+    total_open, registered, general_open, restricted_open, blocked = map(
+        int, value.split(",")
+    )
+    return total_open, registered, general_open, restricted_open, bool(blocked)
+
+
+class FingerprintStats:
+    """Counts how often a course's SSC page was unchanged and did not need to be parsed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool) -> None:
+        metrics.inc("ucm_ssc_pages_total", result="reused" if hit else "parsed")
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def pop(self) -> Tuple[int, int]:
+        """Returns the number of hits and misses since the last call."""
+        with self.lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        return hits, misses
+
+
+fingerprint_stats = FingerprintStats()
@@ -0,0 +1,200 @@
+import asyncio
+import random
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import seat_cache, ssc, tracing
+from .breaker import CircuitOpenError
+from .models import Course
+from .parsing import Seats
+from .redis_client import get_redis
+
+
+class RateLimiter:
+    """Token bucket that spaces out SSC requests to a global requests-per-second budget."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                # Jitter the wait so that our requests don't arrive at the SSC on a fixed beat.
+                wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait * random.uniform(1, 1.5))
+
+
+async def lookup_seats_async(
+    course: Course, executor: ThreadPoolExecutor = None
+) -> Seats or None:
+    """Non-blocking equivalent of seat_cache.lookup_seats()."""
+    if get_redis() is None:
+        return None
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, seat_cache.lookup_seats, course)
+
+
+async def download_seats_async(
+    course: Course, executor: ThreadPoolExecutor = None
+) -> Seats:
+    """Non-blocking equivalent of seat_cache.download_seats()."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor, tracing.run_in_context(seat_cache.download_seats), course
+    )
+
+
+def _closing_connections(function: typing.Callable) -> typing.Callable:
+    """Wraps function to clean up the thread's database connections around each call.
+
+    The thread that handles results outlives the sweep and nothing else closes its connections,
+    so without this a connection that the database dropped would break every later sweep.
+    """
+
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
+
+
+def group_courses(
+    courses: typing.Iterable[Course],
+) -> typing.List[typing.List[Course]]:
+    """Groups courses whose sections are all listed on the same SSC course page."""
+    groups = {}
+    for course in courses:
+        groups.setdefault(course.batch_key(), []).append(course)
+    return list(groups.values())
+
+
+async def _poll(
+    courses: typing.Iterable[Course],
+    handle: typing.Callable,
+    rate: float,
+    concurrency: int,
+    batch: bool,
+    stop: threading.Event or None,
+) -> None:
+    limiter = RateLimiter(rate, burst=concurrency)
+    in_flight = asyncio.Semaphore(concurrency)
+    # Django's ORM is not safe to call from inside the event loop, so results are handed back
+    # to a single dedicated thread.
+    handle_async = sync_to_async(_closing_connections(handle), thread_sensitive=True)
+    loop = asyncio.get_event_loop()
+
+    def stopped() -> bool:
+        return stop is not None and stop.is_set()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def poll_one(course: Course) -> None:
+            async with in_flight:
+                if stopped():
+                    return
+                # Cached seats don't cost an SSC request, so they don't wait on the limiter.
+                seats = await lookup_seats_async(course, executor)
+                if seats is None:
+                    # Courses are skipped rather than waited on while the SSC is down. They
+                    # are still due, so they will be checked by a later sweep once it is back.
+                    while ssc.breaker.is_probing():
+                        await asyncio.sleep(1)
+                    if ssc.breaker.is_open():
+                        return
+                    await limiter.acquire()
+                    if stopped():
+                        return
+                    try:
+                        seats = await download_seats_async(course, executor)
+                    except CircuitOpenError:
+                        # The breaker opened while the course waited on the limiter.
+                        return
+            await handle_async(course, seats)
+
+        async def poll_group(group: typing.List[Course]) -> None:
+            # A single section is cheaper to check directly, since its page has the seat counts.
+            if len(group) == 1:
+                await poll_one(group[0])
+                return
+
+            async with in_flight:
+                if stopped():
+                    return
+                while ssc.breaker.is_probing():
+                    await asyncio.sleep(1)
+                if ssc.breaker.is_open():
+                    return
+                await limiter.acquire()
+                if stopped():
+                    return
+                statuses = await loop.run_in_executor(
+                    executor, tracing.run_in_context(group[0].get_section_statuses)
+                )
+
+            async def poll_section(course: Course) -> None:
+                if statuses is not None:
+                    seats = course.get_seats_from_status(statuses.get(course.section))
+                    if seats is not None:
+                        await handle_async(course, seats, True)
+                        return
+                await poll_one(course)
+
+            await asyncio.gather(*(poll_section(course) for course in group))
+
+        if batch:
+            await asyncio.gather(
+                *(poll_group(group) for group in group_courses(courses))
+            )
+        else:
+            await asyncio.gather(*(poll_one(course) for course in courses))
+
+
+def poll(
+    courses: typing.Iterable[Course],
+    handle: typing.Callable,
+    rate: float = None,
+    concurrency: int = None,
+    batch: bool = None,
+    stop: threading.Event = None,
+) -> None:
+    """Downloads the seat counts of every course concurrently and passes each result to handle.
+
+    At most concurrency SSC requests are in flight at any one time, and they are started no
+    faster than rate requests per second, so a sweep takes roughly len(courses) / rate seconds.
+
+    In batch mode, sections of the same course are looked up on the course's SSC page with a
+    single request, and only sections whose status there suggests they have seats have their
+    own page downloaded. Seats worked out from a section's status are passed to handle with
+    derived set.
+
+    Once stop is set, no more requests are started and courses that are still waiting are
+    skipped.
+    """
+    if rate is None:
+        rate = settings.SSC_REQUESTS_PER_SECOND
+    if concurrency is None:
+        concurrency = settings.SSC_MAX_CONCURRENT_REQUESTS
+    if batch is None:
+        batch = settings.SSC_BATCH_REQUESTS
+    asyncio.run(_poll(courses, handle, rate, concurrency, batch, stop))
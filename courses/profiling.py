@@ -0,0 +1,71 @@
+import collections
+import sys
+import threading
+import typing
+
+
+class Sampler:
+    """Statistical profiler that records the stack of every thread at a fixed interval.
+
+    Unlike cProfile it sees the poller's download and database threads, and its overhead
+    depends only on the interval, so it can be run against a production sweep.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self) -> "Sampler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, file: typing.TextIO) -> None:
+        """Writes the samples as collapsed stacks, which flamegraph.pl and speedscope read."""
+        for stack, count in self.stacks.most_common():
+            file.write(f"{';'.join(stack)} {count}\n")
+
+    def top(self, limit: int = 20) -> typing.List[typing.Tuple[str, int, int]]:
+        """Returns the functions seen in the most samples, with their self and total counts."""
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        return [
+            (function, own[function], count)
+            for function, count in total.most_common(limit)
+        ]
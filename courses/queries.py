@@ -0,0 +1,164 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+import traceback
+import typing
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a view, task or block runs more queries than its budget allows."""
+
+
+def _origin() -> str:
+    """Returns the innermost line of our own code on the stack, which is what ran a query."""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if (
+            frame.filename.startswith(settings.BASE_DIR)
+            and "site-packages" not in frame.filename
+            and frame.filename != __file__
+        ):
+            path = os.path.relpath(frame.filename, settings.BASE_DIR)
+            return f"{path}:{frame.lineno} in {frame.name}"
+    return "unknown"
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts and times queries, grouped by statement.
+
+    The statements are the SQL before parameters are filled in, so the queries of an N+1 show up
+    as a single statement that was run many times. If origins is set, or otherwise the
+    QUERY_ORIGINS setting, where each statement was first run from is recorded along with it.
+    """
+
+    def __init__(self, origins: bool = None):
+        self.origins = settings.QUERY_ORIGINS if origins is None else origins
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.seconds = 0.0
+        # [count, seconds, origin] of each statement.
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.queries += 1
+                self.seconds += elapsed
+                statement = self.statements.get(sql)
+                if statement is None:
+                    origin = _origin() if self.origins else None
+                    self.statements[sql] = [1, elapsed, origin]
+                else:
+                    statement[0] += 1
+                    statement[1] += elapsed
+
+    def duplicates(
+        self, threshold: int = 2
+    ) -> typing.List[typing.Tuple[str, int, float, str]]:
+        """Returns the statements run at least threshold times, most often run first."""
+        with self.lock:
+            repeated = [
+                (sql, count, seconds, origin)
+                for sql, (count, seconds, origin) in self.statements.items()
+                if count >= threshold
+            ]
+        return sorted(repeated, key=lambda statement: -statement[1])
+
+    def report(self, threshold: int = 2) -> str:
+        lines = [f"{self.queries} queries took {self.seconds * 1000:.1f} ms."]
+        for sql, count, seconds, origin in self.duplicates(threshold):
+            sql = sql if len(sql) <= 200 else sql[:197] + "..."
+            origin = f", from {origin}" if origin is not None else ""
+            lines.append(f"  {count}x, {seconds * 1000:.1f} ms{origin}: {sql}")
+        return "\n".join(lines)
+
+
+def budget_for(name: str) -> int or None:
+    """Returns the query budget of a view or task from the QUERY_BUDGETS setting."""
+    return settings.QUERY_BUDGETS.get(name, settings.QUERY_BUDGETS.get("default"))
+
+
+def check(recorder: QueryRecorder, name: str, description: str = None) -> None:
+    """Reports a view or task that went over its query budget or repeated a statement too often.
+
+    Views and tasks whose budget is None are not checked. Raises QueryBudgetExceeded instead of
+    logging if QUERY_BUDGET_ENFORCE is set, as it should be in tests.
+    """
+    budget = budget_for(name)
+    if budget is None:
+        return
+    threshold = settings.QUERY_DUPLICATE_THRESHOLD
+    over = recorder.queries > budget
+    if not over and len(recorder.duplicates(threshold)) == 0:
+        return
+    problem = (
+        f"went over its budget of {budget} queries"
+        if over
+        else f"ran a statement at least {threshold} times"
+    )
+    message = f"{description or name} {problem}. {recorder.report(threshold)}"
+    if settings.QUERY_BUDGET_ENFORCE:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+@contextlib.contextmanager
+def query_budget(
+    budget: int or str, using: str = "default"
+) -> typing.Iterator[QueryRecorder]:
+    """Fails the block with QueryBudgetExceeded if it runs more than budget queries.
+
+    budget may also be the name of a view or task in QUERY_BUDGETS. For use in tests, e.g.
+
+        with query_budget("profile"):
+            self.client.get(reverse("profile"))
+    """
+    limit = budget_for(budget) if isinstance(budget, str) else budget
+    recorder = QueryRecorder(origins=True)
+    with connections[using].execute_wrapper(recorder):
+        yield recorder
+    if limit is not None and recorder.queries > limit:
+        raise QueryBudgetExceeded(
+            f"Expected at most {limit} queries. "
+            f"{recorder.report(settings.QUERY_DUPLICATE_THRESHOLD)}"
+        )
+
+
+class QueryBudgetMiddleware:
+    """Counts and times the queries made by each request and checks them against the view's
+    budget in QUERY_BUDGETS, which is looked up by URL name.
+
+    If QUERY_SERVER_TIMING is set, the database and total time are reported in a Server-Timing
+    header, which browsers show in their developer tools.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connections["default"].execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        name = match.view_name if match is not None else request.path
+        check(recorder, name, f"{request.method} {request.path} ({name})")
+        if settings.QUERY_SERVER_TIMING:
+            response["Server-Timing"] = (
+                f'db;dur={recorder.seconds * 1000:.1f};desc="{recorder.queries} queries", '
+                f"total;dur={elapsed * 1000:.1f}"
+            )
+        return response
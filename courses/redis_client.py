@@ -0,0 +1,26 @@
+import threading
+
+import redis
+
+from django.conf import settings
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis or None:
+    """Returns the process-wide Redis client, or None if Redis isn't configured."""
+    global _client
+    if settings.REDIS_URL is None:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(
+                    settings.REDIS_URL,
+                    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    decode_responses=True,
+                )
+    return _client
@@ -0,0 +1,105 @@
+import datetime
+import heapq
+import typing
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Course
+from .parsing import Seats, dump_seats
+
+
+# How much a single check moves a course's seat change rate towards whether its seats changed.
+CHURN_SMOOTHING = 0.2
+
+
+def weight(subscribers: int, priority: bool, seat_change_rate: float) -> float:
+    """Returns how much of the SSC request budget a course deserves relative to other courses.
+
+    Courses with more subscribers, premium or staff subscribers, and seats that change often are
+    checked more frequently.
+    """
+    w = 1 + subscribers
+    if priority:
+        w *= settings.SCHEDULER_PRIORITY_WEIGHT
+    return w * (1 + settings.SCHEDULER_CHURN_WEIGHT * seat_change_rate)
+
+
+def shard_of(course: Course, shards: int) -> int:
+    """Assigns a course to one of shards monitor shards.
+
+    Sections of the same course always share a shard so that they can be batched. This uses
+    jump consistent hashing, so changing the number of shards only moves the courses that have
+    to move.
+    """
+    key = zlib.crc32("|".join(course.batch_key()).encode("utf-8"))
+    # Spread the 32-bit checksum over 64 bits before feeding it to the generator below.
+    key = (key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    shard, candidate = -1, 0
+    while candidate < shards:
+        shard = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((shard + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return shard
+
+
+class Scheduler:
+    """Decides which courses are due to be checked and in what order.
+
+    The request budget is shared between courses in proportion to their weights, so a course
+    with weight w out of a total W is checked every W / (rate * w) seconds, clamped to the
+    SCHEDULER_MIN_INTERVAL and SCHEDULER_MAX_INTERVAL settings.
+    """
+
+    def __init__(self, rate: float = None, now: datetime.datetime = None):
+        self.rate = settings.SSC_REQUESTS_PER_SECOND if rate is None else rate
+        self.now = timezone.now() if now is None else now
+        self.courses = []
+        self.previous_seats = {}
+
+    def add(self, course: Course, subscribers: int, priority: bool) -> None:
+        self.courses.append(
+            (course, weight(subscribers, priority, course.seat_change_rate))
+        )
+        self.previous_seats[course.pk] = course.last_seats
+
+    def interval(self, course_weight: float, total_weight: float) -> datetime.timedelta:
+        seconds = total_weight / (self.rate * course_weight)
+        seconds = max(settings.SCHEDULER_MIN_INTERVAL, seconds)
+        seconds = min(settings.SCHEDULER_MAX_INTERVAL, seconds)
+        return datetime.timedelta(seconds=seconds)
+
+    def due(self, limit: int = None) -> typing.List[Course]:
+        """Returns the courses that are due to be checked, most overdue first."""
+        total_weight = sum(w for _, w in self.courses)
+        queue = []
+        for course, w in self.courses:
+            if course.last_checked is None:
+                next_check = self.now - datetime.timedelta(days=365)
+            else:
+                next_check = course.last_checked + self.interval(w, total_weight)
+            if next_check <= self.now:
+                heapq.heappush(queue, (next_check, -w, course.pk, course))
+
+        due = []
+        while queue and (limit is None or len(due) < limit):
+            due.append(heapq.heappop(queue)[3])
+        return due
+
+    def record(self, course: Course, seats: Seats) -> typing.List[str]:
+        """Records that a course was checked and returns the fields that need saving.
+
+        The seats are also remembered in the course's SSC state, which is saved by
+        Course.save_ssc_state().
+        """
+        if seats is False:
+            return []
+        previous = self.previous_seats.get(course.pk)
+        changed = bool(previous) and dump_seats(seats) != previous
+        course.seat_change_rate += CHURN_SMOOTHING * (
+            int(changed) - course.seat_change_rate
+        )
+        course.last_checked = timezone.now()
+        course.set_last_seats(seats)
+        return ["last_checked", "seat_change_rate"]
@@ -0,0 +1,120 @@
+import logging
+import time
+import uuid
+
+import redis
+
+from django.conf import settings
+
+from . import metrics
+from .locks import RELEASE_SCRIPT
+from .models import Course
+from .parsing import Seats, dump_seats, load_seats
+from .redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+def _key(course: Course) -> str:
+    return (
+        f"seats:{course.campus}:{course.year}{course.session}:{course.subject}:"
+        f"{course.number}:{course.section}"
+    )
+
+
+def get_cached_seats(course: Course) -> Seats or None:
+    """Returns the course's cached seats, or None if they aren't cached."""
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        return load_seats(client.get(_key(course)))
+    except redis.RedisError:
+        logger.exception("Failed to read seats from the seat cache.")
+        return None
+
+
+def cache_seats(course: Course, seats: Seats) -> None:
+    """Caches the course's seats for SEAT_CACHE_TTL seconds. Failed downloads aren't cached."""
+    client = get_redis()
+    if client is None or seats is False:
+        return
+    try:
+        client.set(_key(course), dump_seats(seats), ex=settings.SEAT_CACHE_TTL)
+    except redis.RedisError:
+        logger.exception("Failed to write seats to the seat cache.")
+
+
+def invalidate_seats(course: Course) -> None:
+    """Removes the course's seats from the cache."""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(_key(course))
+    except redis.RedisError:
+        logger.exception("Failed to invalidate seats in the seat cache.")
+
+
+def get_seats(course: Course) -> Seats:
+    """Returns the course's seats from the cache, downloading them from the SSC on a miss."""
+    seats = lookup_seats(course)
+    if seats is not None:
+        return seats
+    return download_seats(course)
+
+
+def lookup_seats(course: Course) -> Seats or None:
+    """Returns the course's cached seats, counting the lookup, or None on a miss."""
+    seats = get_cached_seats(course)
+    if seats is not None:
+        metrics.inc("ucm_seat_cache_total", result="hit")
+    return seats
+
+
+def download_seats(course: Course) -> Seats:
+    """Downloads the course's seats from the SSC and caches them.
+
+    Only one process downloads a given section at a time. Anyone else who misses while that
+    download is in progress waits for its result instead of making their own request.
+    """
+    client = get_redis()
+    if client is None:
+        return course.get_seats()
+    metrics.inc("ucm_seat_cache_total", result="miss")
+
+    lock = _key(course) + ":lock"
+    # A download can outlast the lock, so the lock is only released by the token that took it
+    # rather than from under whoever holds it next.
+    token = uuid.uuid4().hex
+    try:
+        acquired = client.set(lock, token, nx=True, ex=settings.SEAT_CACHE_LOCK_TIMEOUT)
+    except redis.RedisError:
+        logger.exception("Failed to lock the seat cache.")
+        return course.get_seats()
+
+    if acquired:
+        try:
+            seats = course.get_seats()
+            cache_seats(course, seats)
+            return seats
+        finally:
+            try:
+                client.eval(RELEASE_SCRIPT, 1, lock, token)
+            except redis.RedisError:
+                pass
+
+    deadline = time.monotonic() + settings.SEAT_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        seats = get_cached_seats(course)
+        if seats is not None:
+            return seats
+        try:
+            if not client.exists(lock):
+                break
+        except redis.RedisError:
+            break
+    # The other download failed or is taking too long, so make our own.
+    return course.get_seats()
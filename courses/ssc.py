@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+from . import metrics
+from .breaker import CircuitBreaker
+
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, "
+    "like Gecko) Chrome/39.0.2171.95 Safari/537.36",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+breaker = CircuitBreaker("ssc")
+
+_session = None
+_session_lock = threading.Lock()
+
+_timings_lock = threading.Lock()
+_timings = {"requests": 0, "seconds": 0.0}
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide SSC session, creating it on first use.
+
+    Connections to the SSC are pooled and kept alive between requests, so only the first request
+    made by each pooled connection pays for the TCP and TLS handshakes.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # A request that couldn't connect never reached the SSC, so it is retried
+                # right away. Errors from the SSC itself are left to the circuit breaker and
+                # the scheduler, which would otherwise see several requests as one.
+                retries = Retry(
+                    total=None,
+                    connect=settings.SSC_MAX_RETRIES,
+                    read=0,
+                    redirect=0,
+                    status=0,
+                    backoff_factor=0.5,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=settings.SSC_MAX_CONCURRENT_REQUESTS,
+                    max_retries=retries,
+                )
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Downloads url from the SSC using the shared session and logs how long it took.
+
+    Raises CircuitOpenError without making a request if the SSC appears to be down.
+    """
+    kwargs.setdefault(
+        "timeout", (settings.SSC_CONNECT_TIMEOUT, settings.SSC_READ_TIMEOUT)
+    )
+    probe = breaker.before_request()
+    start = time.perf_counter()
+    try:
+        response = get_session().get(url, **kwargs)
+    except Exception as e:
+        breaker.record_failure(probe)
+        metrics.inc("ucm_ssc_requests_total", status=type(e).__name__)
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure(probe)
+    else:
+        breaker.record_success(probe)
+    elapsed = time.perf_counter() - start
+    metrics.observe("ucm_ssc_request_seconds", elapsed)
+    metrics.inc("ucm_ssc_requests_total", status=response.status_code)
+    with _timings_lock:
+        _timings["requests"] += 1
+        _timings["seconds"] += elapsed
+    logger.debug(
+        f"Downloaded {url} in {elapsed * 1000:.0f} ms "
+        f"(server {response.elapsed.total_seconds() * 1000:.0f} ms, "
+        f"{len(response.content)} bytes)."
+    )
+    return response
+
+
+def pop_timings() -> dict:
+    """Returns the number of requests made and the time spent on them since the last call."""
+    with _timings_lock:
+        timings = dict(_timings)
+        _timings["requests"] = 0
+        _timings["seconds"] = 0.0
+    return timings
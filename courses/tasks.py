@@ -1,50 +1,206 @@
+import contextlib
 import datetime
-import random
+import os
+import threading
 import time
 import typing
-from smtplib import SMTPException
+import uuid
 
 from django.conf import settings
-from django.core.mail import send_mail
-from django.db.models import QuerySet
+from django.db import connection, transaction
+from django.db.models import Count, Q, QuerySet
 from django.utils import timezone
 
 from celery import shared_task
+from celery.signals import task_postrun, task_prerun
 from celery.utils.log import get_task_logger
 
-from .models import Course
+from . import (
+    history,
+    live,
+    metrics,
+    notifications,
+    notifiers,
+    profiling,
+    queries,
+    seat_cache,
+    ssc,
+    tracing,
+)
+from .breaker import CircuitOpenError
+from .locks import Lease
+from .models import Course, CourseTuple
+from .parsing import Seats, dump_seats, fingerprint_stats
+from .poller import poll
+from .scheduler import Scheduler, shard_of
 from users.models import Profile
 
 
 logger = get_task_logger(__name__)
 
 
+@task_postrun.connect
+def flush_metrics(**kwargs) -> None:
+    """Reports the metrics collected by a task without waiting for the next flush."""
+    metrics.flush()
+
+
+# The query recorder of each running task, and the stack that removes it from the connection.
+_task_queries = {}
+
+
+@task_prerun.connect
+def record_task_queries(task_id: str, **kwargs) -> None:
+    recorder = queries.QueryRecorder()
+    stack = contextlib.ExitStack()
+    stack.enter_context(connection.execute_wrapper(recorder))
+    _task_queries[task_id] = (recorder, stack)
+
+
+@task_postrun.connect
+def check_task_queries(task_id: str, task, **kwargs) -> None:
+    """Checks the queries made by a task against its budget in QUERY_BUDGETS."""
+    recorder, stack = _task_queries.pop(task_id, (None, None))
+    if recorder is None:
+        return
+    stack.close()
+    queries.check(recorder, task.name, f"Task {task.name}[{task_id}]")
+
+
 @shared_task
 def monitor() -> None:
-    users = Profile.objects.all()
-    courses = list(Course.objects.all())
-    random.shuffle(courses)
-    for course in courses:
-        if users.filter(courses__course=course).count() > 0:
-            course_users = users.filter(courses__course=course)
-            if (
-                course.last_open is None
-                or course.last_open + settings.OPEN_COURSE_DELAY < timezone.now()
-            ) and (
-                settings.NON_PREMIUM_NOTIFICATIONS
-                or (course_users.filter(user__is_staff=True).count() > 0)
-                or (course_users.filter(is_premium=True).count() > 0)
-            ):
-                course_id = course.pk
-                check = check_course(course_id, users)
-                if check is not None:
-                    course.last_open = check
-                    course.save()
-                time.sleep(settings.POLL_FREQUENCY * (random.uniform(0.5, 1.5)))
+    """Starts a sweep of every monitor shard."""
+    for shard in range(settings.MONITOR_SHARDS):
+        monitor_shard.delay(shard, settings.MONITOR_SHARDS)
+
+
+@shared_task
+def monitor_shard(shard: int, shards: int) -> dict or None:
+    """Checks the courses assigned to one shard and returns the sweep's summary.
+
+    A lease in Redis stops two workers from sweeping the same shard at once. It is renewed for
+    as long as the sweep runs, so if a worker dies its shard is picked up by the next sweep
+    after MONITOR_LEASE_TIMEOUT seconds. If the lease can't be renewed, the sweep stops.
+    """
+    lease = Lease(f"monitor:shard:{shard}:{shards}", settings.MONITOR_LEASE_TIMEOUT)
+    with lease as acquired:
+        if acquired:
+            return sweep(shard, shards, lease.lost)
+        logger.info(f"Shard {shard} of {shards} is already being swept.")
+        return None
+
+
+def sweep(shard: int, shards: int, stop: threading.Event = None) -> dict:
+    """Checks the due courses of one shard, tracing it under a new sweep id.
+
+    Returns how many courses were checked, how long that took, and the database queries and SSC
+    requests it made. If MONITOR_PROFILE_DIR is set, the sweep is also profiled and its samples
+    are written there. Once stop is set, the sweep stops checking courses.
+    """
+    sweep_id = uuid.uuid4().hex[:12]
+    with tracing.trace(sweep=sweep_id, shard=shard):
+        if not settings.MONITOR_PROFILE_DIR:
+            with tracing.span("sweep"):
+                return _sweep(shard, shards, stop)
+        with profiling.Sampler(settings.MONITOR_PROFILE_INTERVAL) as sampler:
+            with tracing.span("sweep"):
+                summary = _sweep(shard, shards, stop)
+        path = os.path.join(settings.MONITOR_PROFILE_DIR, f"sweep-{sweep_id}.folded")
+        with open(path, "w") as f:
+            sampler.write_collapsed(f)
+        logger.info(f"Wrote a profile of sweep {sweep_id} to {path}.")
+        return summary
+
 
+def _sweep(shard: int, shards: int, stop: threading.Event or None) -> dict:
+    start = time.perf_counter()
+    db_timer = metrics.QueryTimer()
+    # The SSC request budget is shared between shards.
+    rate = settings.SSC_REQUESTS_PER_SECOND / shards
+    scheduler = Scheduler(rate=rate)
+    with connection.execute_wrapper(db_timer), tracing.span("schedule"):
+        for course in Course.objects.monitored().iterator(chunk_size=500):
+            if shard_of(course, shards) == shard:
+                scheduler.add(
+                    course,
+                    course.subscriber_count,
+                    course.priority_subscriber_count > 0,
+                )
+
+    def handle(course: Course, seats, derived: bool = False) -> None:
+        # Results are handled on a different thread, with its own database connection.
+        with connection.execute_wrapper(db_timer), tracing.context(course=course.pk):
+            with tracing.span("handle"):
+                _handle(course, seats, derived)
+
+    def _handle(course: Course, seats, derived: bool) -> None:
+        if course.last_checked is not None:
+            metrics.observe(
+                "ucm_course_staleness_seconds",
+                (timezone.now() - course.last_checked).total_seconds(),
+                buckets=metrics.STALENESS_BUCKETS,
+            )
+        with tracing.span("history"):
+            history.observations.add(course, seats, derived)
+        with tracing.span("check"):
+            check = check_course(course, seats)
+        seats_changed = seats is not False and dump_seats(
+            seats
+        ) != scheduler.previous_seats.get(course.pk)
+        update_fields = scheduler.record(course, seats)
+        if course.update_status(seats):
+            update_fields.append("status")
+        if seats_changed or "status" in update_fields:
+            with tracing.span("publish"):
+                live.publish(course, seats)
+        with tracing.span("save"):
+            # The course was loaded when the sweep began, so saving every field would overwrite
+            # the subscriber counts that have been kept up to date since.
+            if check is not None:
+                course.last_open = check
+                update_fields.append("last_open")
+            course.save_ssc_state(update_fields)
+
+    due = scheduler.due(limit=settings.MONITOR_SWEEP_BUDGET)
+    with tracing.span("poll", courses=len(due)):
+        poll(due, handle, rate=rate, stop=stop)
+    if stop is not None and stop.is_set():
+        logger.warning(f"Stopped sweeping shard {shard} of {shards}.")
+    with connection.execute_wrapper(db_timer), tracing.span("flush_history"):
+        history.observations.flush()
+
+    seconds = time.perf_counter() - start
+    metrics.inc("ucm_sweep_courses_total", len(due))
+    metrics.observe("ucm_sweep_seconds", seconds)
+    metrics.observe("ucm_sweep_db_seconds", db_timer.seconds)
+    metrics.flush()
 
-def check_course(course_id: int, users: QuerySet) -> datetime.datetime or None:
-    course = Course.objects.get(pk=course_id)
+    timings = ssc.pop_timings()
+    if timings["requests"] > 0:
+        logger.info(
+            f"Made {timings['requests']} SSC requests averaging "
+            f"{timings['seconds'] / timings['requests'] * 1000:.0f} ms each."
+        )
+    hits, misses = fingerprint_stats.pop()
+    if hits + misses > 0:
+        logger.info(
+            f"{hits} of {hits + misses} SSC pages were unchanged and reused without parsing "
+            f"({hits / (hits + misses):.0%})."
+        )
+    return {
+        "courses": len(due),
+        "seconds": seconds,
+        "db_queries": db_timer.queries,
+        "db_seconds": db_timer.seconds,
+        "ssc_requests": timings["requests"],
+        "ssc_seconds": timings["seconds"],
+        "pages_reused": hits,
+        "pages_parsed": misses,
+    }
+
+
+def check_course(course: Course, seats: Seats = None) -> datetime.datetime or None:
+    """Checks a course for openings and queues notifications to its subscribers about any."""
     c_name = course.sub_num_sec()
 
     def open_seats(seats: typing.Tuple[int, int, int, int]) -> str:
@@ -55,82 +211,88 @@ def check_course(course_id: int, users: QuerySet) -> datetime.datetime or None:
         else:
             return "none"
 
-    get_seats = course.get_seats()
-
     t = datetime.datetime.now().strftime("%H:%M:%S")
 
+    try:
+        get_seats = seat_cache.get_seats(course) if seats is None else seats
+    except CircuitOpenError:
+        metrics.inc("ucm_checks_total", result="skipped")
+        logger.info(f"{t}: Skipped {c_name} while the SSC is down.")
+        return None
+    detected = time.time()
+
     if get_seats is False:
+        metrics.inc("ucm_checks_total", result="failed")
         logger.warning(f"{t}: Failed to download SSC page for {c_name}.")
         return None
     elif get_seats == "invalid":
+        metrics.inc("ucm_checks_total", result="invalid")
         logger.warning(f"{t}: {c_name} appears to be invalid.")
         return None
     elif get_seats == "stt":
+        metrics.inc("ucm_checks_total", result="stt")
         logger.info(f"{t}: {c_name} only has STT seats available at the moment.")
         return None
     elif get_seats[4]:
+        metrics.inc("ucm_checks_total", result="blocked")
         logger.info(f"{t}: {c_name} is currently blocked for registration.")
     else:
         open_seats = open_seats(get_seats)
-        if open_seats != "none":
+        metrics.inc(
+            "ucm_checks_total", result="full" if open_seats == "none" else "open"
+        )
+        if open_seats == "restricted" and course.restricted_subscriber_count == 0:
+            logger.info(
+                f"{t}: Restricted opening in {c_name}, but nobody is monitoring it for "
+                f"restricted seats."
+            )
+            return None
+        elif open_seats != "none":
+            to_notify = Profile.objects.filter(courses__course=course)
             if open_seats == "general":
                 logger.info(f"{t}: General opening in {c_name}")
-                to_notify = users.filter(courses__course=course)
             else:
                 logger.info(f"{t}: Restricted opening in {c_name}.")
-                to_notify = users.filter(
-                    courses__course=course, courses__restricted=True
-                )
+                to_notify = to_notify.filter(courses__restricted=True)
 
-            staff_in_list = to_notify.filter(user__is_staff=True)
-            premium_in_list = to_notify.filter(is_premium=True)
-            if staff_in_list.count() > 0:
-                to_notify = staff_in_list
-                next_last_open = timezone.now() - (settings.OPEN_COURSE_DELAY * 3 / 4)
-            elif premium_in_list.count() > 0 or settings.NON_PREMIUM_NOTIFICATIONS:
-                to_notify = premium_in_list
-                next_last_open = timezone.now() - (settings.OPEN_COURSE_DELAY / 2)
-            else:
-                next_last_open = timezone.now()
-
-            try:
-                subject = f"There is an open seat in {c_name}. Check the SSC."
-                message = (
-                    f"There is an opening in {course.subject} {course.number}, section "
-                    f"{course.section}.\n\n{course.url()}\n\nIf you do not want to receive any more emails "
-                    f"like this, just go to your profile page to unsubscribe."
-                )
-                to_addresses = list(map(lambda profile: profile.user.email, to_notify))
-                notification = send_mail(
-                    subject, message, settings.EMAIL_NOTIFIER_ADDRESS, to_addresses
-                )
-            except SMTPException:
-                notification = None
-
-            if len(to_notify) == 0:
-                recipients = ""
-            elif len(to_notify) == 1:
-                recipients = str(to_notify[0])
-            elif len(to_notify) == 2:
-                recipients = str(to_notify[0]) + " and " + str(to_notify[1])
-            else:
-                recipients = ""
-                for user in to_notify[: (len(to_notify) - 1)]:
-                    recipients = recipients + str(user) + ", "
-                recipients = recipients + "and " + str(to_notify[-1])
-
-            if notification is not None and notification > 0:
-                logger.info(f"{t}: Sent email about {course} to {recipients}.")
-            elif notification is None:
-                logger.info(
-                    f"{t}: Failed to send email about {course} to {recipients}."
-                )
-            else:
+            with tracing.span("recipients") as span:
+                if course.priority_subscriber_count > 0:
+                    in_list = to_notify.aggregate(
+                        staff=Count("pk", filter=Q(user__is_staff=True)),
+                        premium=Count("pk", filter=Q(is_premium=True)),
+                    )
+                    staff_in_list, premium_in_list = (
+                        in_list["staff"],
+                        in_list["premium"],
+                    )
+                else:
+                    staff_in_list = premium_in_list = 0
+
+                if staff_in_list > 0:
+                    to_notify = to_notify.filter(user__is_staff=True)
+                    next_last_open = timezone.now() - (
+                        settings.OPEN_COURSE_DELAY * 3 / 4
+                    )
+                elif premium_in_list > 0 or settings.NON_PREMIUM_NOTIFICATIONS:
+                    to_notify = to_notify.filter(is_premium=True)
+                    next_last_open = timezone.now() - (settings.OPEN_COURSE_DELAY / 2)
+                else:
+                    next_last_open = timezone.now()
+                profile_ids = list(to_notify.values_list("pk", flat=True).distinct())
+                span["recipients"] = len(profile_ids)
+            if len(profile_ids) == 0:
                 logger.info(
                     f"{t}: No users are monitoring {course} for {open_seats} seats."
                 )
                 return None
 
+            with tracing.span("enqueue"):
+                notify_opening.delay(
+                    f"{course.pk}:{detected:.3f}", course.pk, profile_ids, detected
+                )
+            logger.info(
+                f"{t}: Queued notifications about {course} for {len(profile_ids)} users."
+            )
             return next_last_open
 
         else:
@@ -138,9 +300,288 @@ def check_course(course_id: int, users: QuerySet) -> datetime.datetime or None:
             return None
 
 
+def join_names(items: typing.List) -> str:
+    if len(items) == 0:
+        return ""
+    elif len(items) == 1:
+        return str(items[0])
+    elif len(items) == 2:
+        return str(items[0]) + " and " + str(items[1])
+    return ", ".join(str(item) for item in items[:-1]) + ", and " + str(items[-1])
+
+
+@shared_task
+def notify_opening(
+    opening: str, course_id: int, profile_ids: typing.List[int], detected: float
+) -> None:
+    """Splits the notifications about an opening into batches that are sent in parallel.
+
+    opening identifies this opening of the course, so that each subscriber is emailed about it
+    at most once however many times the batches are retried.
+    """
+    size = settings.NOTIFICATION_BATCH_SIZE
+    for i in range(0, len(profile_ids), size):
+        send_notifications.delay(
+            opening, course_id, profile_ids[i : i + size], detected
+        )
+
+
+@shared_task(bind=True, max_retries=5)
+def send_notifications(
+    self, opening: str, course_id: int, profile_ids: typing.List[int], detected: float
+) -> int:
+    """Notifies a batch of subscribers about an opening on each of their channels, retrying
+    those that couldn't be notified."""
+    try:
+        course = Course.objects.get(pk=course_id)
+    except Course.DoesNotExist:
+        return 0
+
+    subject, message = notifications.opening_email([course])
+    digest = settings.NOTIFICATION_DIGEST_WINDOW > 0
+
+    # The profile that each notification in the batch is for, by idempotency key.
+    recipients = {}
+    batch = []
+    for profile in Profile.objects.filter(pk__in=profile_ids).select_related("user"):
+        for channel, address in profile.notification_channels():
+            key = f"notification:{opening}:{profile.pk}:{channel}"
+            if not notifications.claim(key):
+                continue
+            # Premium and staff users are always emailed right away.
+            if (
+                channel == "email"
+                and digest
+                and profile.digest_notifications
+                and not (profile.is_premium or profile.user.is_staff)
+            ):
+                started = notifications.add_to_digest(profile.pk, key, course.pk)
+                if started is not None:
+                    if started:
+                        send_digest.apply_async(
+                            (profile.pk,),
+                            countdown=settings.NOTIFICATION_DIGEST_WINDOW,
+                        )
+                    continue
+            recipients[key] = profile
+            batch.append(
+                notifiers.Notification(
+                    key, channel, address, subject, message, course.url()
+                )
+            )
+
+    with tracing.trace(opening=opening, course=course_id), tracing.span(
+        "dispatch", notifications=len(batch)
+    ) as span:
+        failed = notifiers.dispatch(batch)
+        span["failed"] = len(failed)
+    failed_keys = {notification.key for notification in failed}
+    for notification in batch:
+        if notification.key not in failed_keys:
+            metrics.observe(
+                "ucm_notification_latency_seconds",
+                time.time() - detected,
+                channel=notification.channel,
+            )
+    for key in recipients:
+        if key in failed_keys:
+            notifications.release(key)
+        else:
+            notifications.mark_sent(key)
+
+    failed_profiles = {recipients[key] for key in failed_keys}
+    sent = sorted(set(recipients.values()) - failed_profiles, key=lambda p: p.pk)
+    if len(sent) > 0:
+        logger.info(
+            f"Notified {join_names(sent)} about {course} on "
+            f"{len(batch) - len(failed)} channels, "
+            f"{(time.time() - detected) * 1000:.0f} ms after the opening was found."
+        )
+    if len(failed_profiles) > 0:
+        failed_profiles = sorted(failed_profiles, key=lambda p: p.pk)
+        logger.info(f"Failed to notify {join_names(failed_profiles)} about {course}.")
+        raise self.retry(
+            args=(opening, course_id, [p.pk for p in failed_profiles], detected),
+            countdown=30 * 2 ** self.request.retries,
+        )
+    return len(batch)
+
+
+@shared_task(bind=True, max_retries=5)
+def send_digest(self, profile_id: int) -> int:
+    """Emails a user a single message listing the openings collected in their digest."""
+    entries = notifications.pop_digest(profile_id)
+    if len(entries) == 0:
+        return 0
+    courses = Course.objects.in_bulk({entry["course"] for entry in entries})
+    try:
+        profile = Profile.objects.select_related("user").get(pk=profile_id)
+    except Profile.DoesNotExist:
+        profile = None
+    if profile is None or len(courses) == 0:
+        for entry in entries:
+            notifications.release(entry["key"])
+        return 0
+
+    opened = []
+    for entry in entries:
+        course = courses.get(entry["course"])
+        if course is not None and course not in opened:
+            opened.append(course)
+    subject, message = notifications.opening_email(opened)
+    digest = notifiers.Notification(
+        f"digest:{profile_id}",
+        "email",
+        profile.user.email,
+        subject,
+        message,
+        opened[0].url(),
+    )
+    if len(notifiers.dispatch([digest])) == 0:
+        for entry in entries:
+            notifications.mark_sent(entry["key"])
+        logger.info(
+            f"Sent a digest about {join_names(opened)} to {profile} "
+            f"({len(entries)} openings)."
+        )
+        return len(entries)
+
+    if self.request.retries >= self.max_retries:
+        logger.error(
+            f"Gave up on sending a digest about {join_names(opened)} to {profile}."
+        )
+        for entry in entries:
+            notifications.release(entry["key"])
+        return 0
+    logger.info(f"Failed to send a digest about {join_names(opened)} to {profile}.")
+    notifications.restore_digest(profile_id, entries)
+    raise self.retry(countdown=30 * 2 ** self.request.retries)
+
+
+@shared_task(bind=True, max_retries=5)
+def validate_course(self, course_id: int) -> None:
+    """Checks a newly added course against the SSC and records whether it can be monitored."""
+    try:
+        course = Course.objects.get(pk=course_id)
+    except Course.DoesNotExist:
+        return
+
+    try:
+        seats = seat_cache.get_seats(course)
+    except CircuitOpenError:
+        seats = False
+    course.set_last_seats(seats)
+    if seats is False and self.request.retries < self.max_retries:
+        raise self.retry(countdown=60 * 2 ** self.request.retries)
+
+    changed = course.update_status(seats)
+    course.save_ssc_state(["status"] if changed else [])
+    live.publish(course, seats if seats is not False else None)
+    logger.info(f"Validated {course}: {course.get_status_display()}.")
+    if changed and course.status == "invalid":
+        unsubscribe_invalid.delay(course.pk)
+
+
+@shared_task
+def unsubscribe_invalid(course_id: int) -> None:
+    """Removes every subscription to an invalid course and emails the users who had one.
+
+    The subscriptions are cleared through the course tuples, so the subscriber counts are
+    updated and the sections no longer count toward MAX_NON_PREMIUM_SECTIONS.
+    """
+    try:
+        course = Course.objects.get(pk=course_id)
+    except Course.DoesNotExist:
+        return
+
+    profiles = list(
+        Profile.objects.filter(courses__course=course).select_related("user").distinct()
+    )
+    for course_tuple in course.coursetuple_set.all():
+        course_tuple.profile_set.clear()
+
+    subject, message = notifications.invalid_section_email(course)
+    batch = []
+    for profile in profiles:
+        batch.append(
+            notifiers.Notification(
+                f"invalid:{course.pk}:{profile.pk}",
+                "email",
+                profile.user.email,
+                subject,
+                message,
+                course.url(),
+            )
+        )
+    failed = notifiers.dispatch(batch)
+    logger.info(
+        f"Unsubscribed {len(batch)} users from invalid course {course}, "
+        f"{len(failed)} of whom could not be emailed."
+    )
+
+
+def delete_in_batches(queryset: QuerySet, batch_size: int) -> int:
+    """Deletes every row matching queryset, batch_size rows per transaction.
+
+    Each batch is deleted through queryset again, so a row that stopped matching after it was
+    selected (e.g. a course that was just subscribed to) is left alone.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset[:batch_size])
+            if len(batch) == 0:
+                return deleted
+            if queryset.model is Course:
+                for course in batch:
+                    seat_cache.invalidate_seats(course)
+            _, per_model = queryset.filter(pk__in=[row.pk for row in batch]).delete()
+            deleted += per_model.get(queryset.model._meta.label, 0)
+
+
+@shared_task
+def purge_courses() -> dict:
+    """Deletes course tuples that nobody monitors, then courses that have no tuples left."""
+    start = time.perf_counter()
+    # The denormalized counts narrow down the candidates, and the anti-join makes sure that
+    # nothing with subscribers is deleted even if a count is out of date.
+    course_tuples = delete_in_batches(
+        # The post_delete receiver reads the tuple's course and count, which can't be loaded
+        # once the row is gone.
+        CourseTuple.objects.filter(subscriber_count=0, profile__isnull=True).only(
+            "pk", "course_id", "subscriber_count"
+        ),
+        settings.PURGE_BATCH_SIZE,
+    )
+    courses = delete_in_batches(
+        Course.objects.filter(coursetuple__isnull=True).only(
+            "pk", "campus", "year", "session", "subject", "number", "section"
+        ),
+        settings.PURGE_BATCH_SIZE,
+    )
+    seconds = time.perf_counter() - start
+    logger.info(
+        f"Purged {course_tuples} course tuples and {courses} courses in {seconds:.2f} seconds."
+    )
+    return {"course_tuples": course_tuples, "courses": courses, "seconds": seconds}
+
+
 @shared_task
-def purge_courses() -> None:
-    users = Profile.objects.all()
-    for course in Course.objects.all():
-        if users.filter(courses__course=course).count() == 0:
-            course.delete()
+def roll_up_seat_history() -> dict:
+    """Summarizes old seat observations into rollups and deletes what is no longer kept."""
+    start = time.perf_counter()
+    # Both use the same time, so that no observations are deleted from an hour that began after
+    # the rollup and was never summarized.
+    now = timezone.now()
+    result = history.roll_up(now)
+    for name, queryset in history.expired(now).items():
+        result[f"deleted_{name}"] = delete_in_batches(
+            queryset.only("pk"), settings.PURGE_BATCH_SIZE
+        )
+    result["seconds"] = time.perf_counter() - start
+    logger.info(
+        f"Rolled up seat history into {result['hourly']} hourly and {result['daily']} daily "
+        f"rollups and deleted {result['deleted_observations']} observations in "
+        f"{result['seconds']:.2f} seconds."
+    )
+    return result
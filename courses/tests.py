@@ -1,3 +1,1586 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import itertools
+import json
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from asgiref.testing import ApplicationCommunicator
+from celery.exceptions import Retry
+import requests
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import get_connection
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    breaker,
+    history,
+    live,
+    locks,
+    metrics,
+    notifications,
+    parsing,
+    poller,
+    profiling,
+    queries,
+    seat_cache,
+    ssc,
+    tracing,
+)
+from .fake_ssc import MAINTENANCE, FakeSSC, load_timeline
+from .models import Course, CourseTuple, SeatObservation, SeatRollup
+from .parsing import (
+    dump_seats,
+    fingerprint_stats,
+    load_seats,
+    parse_section_statuses,
+    parse_seats,
+    parse_seats_fast,
+    parse_seats_soup,
+    seats_from_status,
+)
+from .queries import QueryBudgetExceeded, QueryRecorder, query_budget
+from .scheduler import Scheduler, shard_of
+from .tasks import (
+    check_course,
+    purge_courses,
+    send_digest,
+    send_notifications,
+    roll_up_seat_history,
+    unsubscribe_invalid,
+    validate_course,
+)
+from .views import context
+from ubccoursemonitor.asgi import application
+
+
+def create_course_tuples(count: int, restricted: bool = False) -> list:
+    """Creates count sections of CPSC 110 and a course tuple for each."""
+    courses = [
+        Course.objects.create(
+            year="2020",
+            session="W",
+            subject="CPSC",
+            number="110",
+            section=str(101 + i),
+            status="valid",
+        )
+        for i in range(count)
+    ]
+    return [
+        CourseTuple.objects.create(course=course, restricted=restricted)
+        for course in courses
+    ]
+
+
+class FakeSSCMixin:
+    """Serves a FakeSSC on a local port for the rest of the test, with a fresh breaker."""
+
+    def start_fake_ssc(self, **kwargs) -> FakeSSC:
+        fake = FakeSSC(**kwargs)
+        server = fake.serve()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        overrides = override_settings(
+            SSC_BASE_URL=f"http://127.0.0.1:{server.server_port}", SSC_PARSER="fast"
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch.object(ssc, "breaker", breaker.CircuitBreaker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return fake
+
+
+class FakeRedis:
+    """Stands in for the few Redis commands used by leases, the seat cache, metrics and
+    notifications, with expiry."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def _live(self, name: str) -> str or None:
+        value, expires = self.data.get(name, (None, None))
+        if expires is not None and time.monotonic() >= expires:
+            del self.data[name]
+            return None
+        return value
+
+    def get(self, name: str) -> str or None:
+        with self.lock:
+            return self._live(name)
+
+    def exists(self, name: str) -> int:
+        with self.lock:
+            return int(self._live(name) is not None)
+
+    def set(self, name: str, value: str, nx: bool = False, ex: float = None) -> bool:
+        with self.lock:
+            if nx and self._live(name) is not None:
+                return False
+            self.data[name] = (
+                value,
+                None if ex is None else time.monotonic() + ex,
+            )
+            return True
+
+    def delete(self, name: str) -> int:
+        with self.lock:
+            return int(self.data.pop(name, None) is not None)
+
+    def expire(self, name: str, seconds: float) -> int:
+        with self.lock:
+            value = self._live(name)
+            if value is None:
+                return 0
+            self.data[name] = (value, time.monotonic() + seconds)
+            return 1
+
+    def hset(self, name: str, mapping: dict) -> int:
+        with self.lock:
+            value = self._live(name) or {}
+            self.data[name] = (
+                dict(value, **{k: str(v) for k, v in mapping.items()}),
+                None,
+            )
+            return len(mapping)
+
+    def hgetall(self, name: str) -> dict:
+        with self.lock:
+            return dict(self._live(name) or {})
+
+    def hincrbyfloat(self, name: str, key: str, amount: float) -> float:
+        with self.lock:
+            value = self._live(name) or {}
+            total = float(value.get(key, 0)) + amount
+            self.data[name] = (dict(value, **{key: str(total)}), None)
+            return total
+
+    def rpush(self, name: str, *values: str) -> int:
+        with self.lock:
+            value = self._live(name) or []
+            _, expires = self.data.get(name, (None, None))
+            self.data[name] = (value + list(values), expires)
+            return len(value) + len(values)
+
+    def lpush(self, name: str, *values: str) -> int:
+        with self.lock:
+            value = self._live(name) or []
+            _, expires = self.data.get(name, (None, None))
+            self.data[name] = (list(reversed(values)) + value, expires)
+            return len(value) + len(values)
+
+    def lrange(self, name: str, start: int, end: int) -> list:
+        with self.lock:
+            value = self._live(name) or []
+            return value[start:] if end == -1 else value[start : end + 1]
+
+    def zadd(self, name: str, mapping: dict) -> int:
+        with self.lock:
+            value = self._live(name) or {}
+            self.data[name] = (dict(value, **mapping), None)
+            return len(mapping)
+
+    def zremrangebyscore(self, name: str, low: str, high: float) -> int:
+        with self.lock:
+            value = self._live(name) or {}
+            kept = {k: score for k, score in value.items() if score > high}
+            self.data[name] = (kept, None)
+            return len(value) - len(kept)
+
+    def zrange(self, name: str, start: int, end: int) -> list:
+        with self.lock:
+            value = self._live(name) or {}
+            return sorted(value, key=value.get)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def eval(self, script: str, numkeys: int, name: str, token: str, *args) -> int:
+        with self.lock:
+            if self._live(name) != token:
+                return 0
+            if script == locks.RENEW_SCRIPT:
+                self.data[name] = (token, time.monotonic() + float(args[0]))
+            elif script == locks.RELEASE_SCRIPT:
+                del self.data[name]
+            return 1
+
+
+class FakePipeline:
+    """Queues FakeRedis commands and runs them on execute, like a Redis pipeline."""
+
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name: str):
+        def queue_command(*args, **kwargs):
+            self.commands.append((getattr(self.client, name), args, kwargs))
+
+        return queue_command
+
+    def execute(self) -> list:
+        commands, self.commands = self.commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True, REDIS_URL=None)
+class QueryBudgetTests(TestCase):
+    """Checks that the busiest views stay within their query budgets however many sections
+    there are, so that an N+1 fails here rather than in production."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            "student", "student@example.com", "password"
+        )
+        cls.user.profile.courses.add(*create_course_tuples(20))
+        cls.admin = User.objects.create_superuser(
+            "admin", "admin@example.com", "password"
+        )
+
+    def test_context(self):
+        with query_budget(2):
+            context(title="Test")
+
+    def test_courses_views(self):
+        self.client.force_login(self.user)
+        for name in ("courses-home", "courses-list", "courses-status"):
+            with self.subTest(name=name), query_budget(name):
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        for name in (
+            "admin:courses_course_changelist",
+            "admin:courses_coursetuple_changelist",
+        ):
+            with self.subTest(name=name), query_budget(name):
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+
+    def test_query_budget_fails_when_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                for course_tuple in CourseTuple.objects.all()[:2]:
+                    str(course_tuple)
+
+    def test_origins_are_only_recorded_when_asked_for(self):
+        for origins in (False, True):
+            with self.subTest(origins=origins), override_settings(
+                QUERY_ORIGINS=origins
+            ), mock.patch(
+                "traceback.extract_stack", wraps=traceback.extract_stack
+            ) as extract_stack:
+                recorder = QueryRecorder()
+                with connection.execute_wrapper(recorder):
+                    for course_tuple in CourseTuple.objects.all()[:2]:
+                        str(course_tuple)
+                ((_, count, _, origin),) = recorder.duplicates()
+                self.assertEqual(count, 2)
+                self.assertEqual(extract_stack.called, origins)
+                if origins:
+                    self.assertIn("courses/models.py", origin)
+                else:
+                    self.assertIsNone(origin)
+
+    def test_unbudgeted_names_are_not_checked(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for course_tuple in CourseTuple.objects.all()[:10]:
+                str(course_tuple)
+        with override_settings(QUERY_BUDGETS={"default": 100, "batched": None}):
+            queries.check(recorder, "batched")
+            with self.assertRaises(QueryBudgetExceeded):
+                queries.check(recorder, "other")
+
+    def test_middleware_fails_when_exceeded(self):
+        self.client.force_login(self.user)
+        with override_settings(QUERY_BUDGETS={"default": 30, "courses-list": 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("courses-list"))
+
+
+@override_settings(REDIS_URL=None)
+class CheckCourseTests(TestCase):
+    def test_restricted_opening_without_restricted_subscribers(self):
+        user = User.objects.create_user("student", "student@example.com", "password")
+        (course_tuple,) = create_course_tuples(1)
+        user.profile.courses.add(course_tuple)
+        course = Course.objects.get(pk=course_tuple.course_id)
+        self.assertEqual(course.subscriber_count, 1)
+        self.assertEqual(course.restricted_subscriber_count, 0)
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(check_course(course, (1, 100, 0, 1, False)))
+
+    @override_settings(REDIS_URL=None)
+    def test_skipped_while_the_ssc_is_down(self):
+        (course_tuple,) = create_course_tuples(1)
+        with mock.patch.object(
+            ssc, "get", side_effect=breaker.CircuitOpenError
+        ), mock.patch.object(metrics, "inc") as inc:
+            self.assertIsNone(check_course(course_tuple.course))
+        inc.assert_called_once_with("ucm_checks_total", result="skipped")
+
+        # Other errors are still failed checks.
+        with mock.patch.object(
+            ssc, "get", side_effect=ConnectionError
+        ), mock.patch.object(metrics, "inc") as inc:
+            self.assertIsNone(check_course(course_tuple.course))
+        inc.assert_called_once_with("ucm_checks_total", result="failed")
+
+
+@override_settings(REDIS_URL=None)
+class SubscriberCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "student", "student@example.com", "password"
+        )
+        (self.course_tuple,) = create_course_tuples(1, restricted=True)
+        self.user.profile.courses.add(self.course_tuple)
+
+    def assertCounts(self, subscribers: int, restricted: int, priority: int):
+        course = Course.objects.get(pk=self.course_tuple.course_id)
+        self.assertEqual(
+            (
+                course.subscriber_count,
+                course.restricted_subscriber_count,
+                course.priority_subscriber_count,
+            ),
+            (subscribers, restricted, priority),
+        )
+
+    def test_subscribing_and_unsubscribing(self):
+        self.assertCounts(1, 1, 0)
+        self.user.profile.courses.remove(self.course_tuple)
+        self.assertCounts(0, 0, 0)
+
+    def test_premium_and_staff_changes(self):
+        profile = self.user.profile
+        profile.is_premium = True
+        profile.save()
+        self.assertCounts(1, 1, 1)
+        profile.is_premium = False
+        profile.save()
+        self.assertCounts(1, 1, 0)
+
+        user = User.objects.get(pk=self.user.pk)
+        user.is_staff = True
+        user.save()
+        self.assertCounts(1, 1, 1)
+
+    def test_unrelated_profile_changes_are_not_recounted(self):
+        profile = User.objects.get(pk=self.user.pk).profile
+        profile.digest_notifications = False
+        with self.assertNumQueries(1):
+            profile.save()
+
+
+@override_settings(REDIS_URL=None, METRICS_TOKEN="secret")
+class MetricsViewTests(TestCase):
+    def test_token(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(
+            self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403
+        )
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(REDIS_URL="redis://fake", METRICS_GAUGE_TTL=300)
+class MetricsRegistryTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch("courses.metrics.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def flush_gauge(self, pid: int, value: float) -> None:
+        registry = metrics.Registry()
+        with mock.patch("os.getpid", return_value=pid):
+            registry.set("ucm_circuit_breaker_open", value, breaker="ssc")
+            registry.inc("ucm_sweep_courses_total", 2)
+            registry.flush()
+
+    def test_gauges_are_read_from_every_live_process(self):
+        series = 'ucm_circuit_breaker_open{breaker="ssc"}'
+        self.flush_gauge(1, 0)
+        self.flush_gauge(2, 1)
+        totals = metrics.Registry().collect()
+        self.assertEqual(totals[series], 1)
+        self.assertEqual(totals["ucm_sweep_courses_total"], 4)
+
+        # Once a process has stopped reporting, its gauges are dropped.
+        index = self.redis.data[metrics.GAUGES_INDEX_KEY][0]
+        for key in list(index):
+            if key.endswith(":2"):
+                index[key] = time.time() - 1
+        self.assertEqual(metrics.Registry().collect()[series], 0)
+        self.assertEqual(len(self.redis.zrange(metrics.GAUGES_INDEX_KEY, 0, -1)), 1)
+
+
+class MailConnectionTests(TestCase):
+    def tearDown(self):
+        while not notifications._idle_connections.empty():
+            notifications._idle_connections.get_nowait()
+
+    def test_connections_are_reused(self):
+        for address in ("a@example.com", "b@example.com"):
+            self.assertTrue(notifications.send_email("Subject", "Body", address))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(notifications._idle_connections.qsize(), 1)
+
+    def test_timed_out_connections_are_replaced(self):
+        stale = mock.Mock()
+        stale.send_messages.side_effect = socket.timeout
+        notifications.release_mail_connection(stale)
+        self.assertTrue(notifications.send_email("Subject", "Body", "a@example.com"))
+        stale.close.assert_called_once()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(notifications._idle_connections.qsize(), 1)
+        self.assertIsNot(notifications._idle_connections.get_nowait(), stale)
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend")
+    def test_smtp_connections_time_out(self):
+        connection = get_connection()
+        self.assertIsNotNone(connection.timeout)
+        self.assertEqual(connection.timeout, settings.EMAIL_TIMEOUT)
+
+    def test_concurrent_sends_use_separate_connections(self):
+        first = notifications.get_mail_connection()
+        second = notifications.get_mail_connection()
+        self.assertIsNot(first, second)
+        notifications.release_mail_connection(first)
+        notifications.release_mail_connection(second)
+        self.assertEqual(notifications._idle_connections.qsize(), 2)
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True, REDIS_URL=None)
+class ValidateCourseTests(TestCase):
+    def test_invalid_sections_are_unsubscribed(self):
+        user = User.objects.create_user("student", "student@example.com", "password")
+        (course_tuple,) = create_course_tuples(1)
+        course = course_tuple.course
+        course.status = "pending"
+        course.save()
+        user.profile.courses.add(course_tuple)
+
+        with mock.patch(
+            "courses.seat_cache.get_seats", return_value="invalid"
+        ), mock.patch.object(
+            unsubscribe_invalid,
+            "delay",
+            side_effect=lambda course_id: unsubscribe_invalid.apply((course_id,)),
+        ):
+            validate_course.apply((course.pk,))
+
+        course.refresh_from_db()
+        self.assertEqual(course.status, "invalid")
+        self.assertEqual(course.subscriber_count, 0)
+        self.assertEqual(user.profile.number_of_courses(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["student@example.com"])
+
+    @override_settings(REDIS_URL=None)
+    def test_retried_while_the_ssc_is_down(self):
+        (course_tuple,) = create_course_tuples(1)
+        course = course_tuple.course
+        course.status = "pending"
+        course.save()
+        with mock.patch.object(
+            ssc, "get", side_effect=breaker.CircuitOpenError
+        ) as get, mock.patch.object(unsubscribe_invalid, "delay") as unsubscribe:
+            validate_course.apply((course.pk,))
+        # Eager retries run right away, so they all run out before the SSC is back.
+        self.assertEqual(get.call_count, validate_course.max_retries + 1)
+        course.refresh_from_db()
+        self.assertEqual(course.status, "failed")
+        unsubscribe.assert_not_called()
+
+
+class FakePubSub:
+    """Stands in for a Redis pattern subscription, handing out the messages put on it."""
+
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.patterns = []
+        self.closed = False
+
+    def psubscribe(self, pattern: str) -> None:
+        self.patterns.append(pattern)
+
+    def get_message(self, timeout: float) -> dict or None:
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@override_settings(REDIS_URL=None, LIVE_POLL_INTERVAL=0.01)
+class LiveEventsTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "student", "student@example.com", "password"
+        )
+        (self.course_tuple,) = create_course_tuples(1)
+        self.user.profile.courses.add(self.course_tuple)
+        self.client.force_login(self.user)
+        self.pubsub = FakePubSub()
+        redis_client = mock.Mock()
+        redis_client.pubsub.return_value = self.pubsub
+        patcher = mock.patch("courses.live.get_redis", return_value=redis_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scope(self, path: str = live.EVENTS_PATH) -> dict:
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"cookie", f"{settings.SESSION_COOKIE_NAME}={session}".encode()),
+            ],
+        }
+
+    def test_updates_are_streamed(self):
+        course = self.course_tuple.course
+        course.status = "blocked"
+
+        async def stream():
+            communicator = ApplicationCommunicator(application, self.scope())
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output(5)
+            retry = await communicator.receive_output(5)
+            self.pubsub.messages.put({"data": json.dumps(live.event(course))})
+            update = await communicator.receive_output(5)
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait(5)
+            return start, retry, update
+
+        start, retry, update = asyncio.run(stream())
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+        self.assertEqual(retry["body"], b"retry: 5000\n\n")
+        self.assertTrue(update["body"].startswith(b"data: "))
+        data = json.loads(update["body"][len(b"data: ") :])
+        self.assertEqual(data["id"], self.course_tuple.pk)
+        self.assertEqual(data["status"], "blocked")
+        self.assertEqual(self.pubsub.patterns, [f"{live.CHANNEL_PREFIX}*"])
+
+        # The hub lets go of the subscription once nobody is listening.
+        reader = live.hub.reader
+        if reader is not None:
+            reader.join(5)
+        self.assertIsNone(live.hub.reader)
+        self.assertTrue(self.pubsub.closed)
+
+    def test_anonymous_streams_are_refused(self):
+        async def stream():
+            scope = dict(self.scope(), headers=[(b"host", b"testserver")])
+            communicator = ApplicationCommunicator(application, scope)
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output(5)
+            await communicator.wait(5)
+            return start
+
+        self.assertEqual(asyncio.run(stream())["status"], 403)
+
+    def test_other_paths_are_served_by_django(self):
+        async def get():
+            communicator = ApplicationCommunicator(
+                application, self.scope(reverse("courses-list"))
+            )
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output(5)
+            await communicator.wait(5)
+            return start
+
+        self.assertEqual(asyncio.run(get())["status"], 200)
+
+    def test_wsgi_view_stops_the_browser_reconnecting(self):
+        response = self.client.get(reverse("courses-events"))
+        self.assertEqual(response.status_code, 204)
+
+
+@override_settings(
+    REDIS_URL=None,
+    SSC_BREAKER_FAILURE_THRESHOLD=2,
+    SSC_BREAKER_WINDOW=20,
+    SSC_BREAKER_PROBES=2,
+)
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = breaker.CircuitBreaker("test")
+
+    def open_breaker(self):
+        for _ in range(2):
+            self.assertFalse(self.breaker.before_request())
+            self.breaker.record_failure(False)
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+
+    def wait_out_delay(self):
+        self.breaker.retry_at = time.monotonic() - 1
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure(self.breaker.before_request())
+        self.breaker.record_success(self.breaker.before_request())
+        self.breaker.record_failure(self.breaker.before_request())
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+        self.breaker.record_failure(self.breaker.before_request())
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(breaker.CircuitOpenError):
+            self.breaker.before_request()
+
+    def test_probes_close_the_breaker(self):
+        self.open_breaker()
+        self.wait_out_delay()
+        for _ in range(2):
+            self.assertTrue(self.breaker.before_request())
+            self.assertEqual(self.breaker.state, breaker.HALF_OPEN)
+            self.assertTrue(self.breaker.is_probing())
+            # Only one probe is let through at a time.
+            with self.assertRaises(breaker.CircuitOpenError):
+                self.breaker.before_request()
+            self.breaker.record_success(True)
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+        self.assertEqual(self.breaker.probes_in_flight, 0)
+        self.assertFalse(self.breaker.before_request())
+
+    def test_failed_probe_reopens_the_breaker(self):
+        self.open_breaker()
+        self.wait_out_delay()
+        self.breaker.record_success(self.breaker.before_request())
+        self.breaker.record_failure(self.breaker.before_request())
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+        self.assertEqual(self.breaker.probes_in_flight, 0)
+        self.assertEqual(self.breaker.probe_successes, 0)
+        self.assertEqual(self.breaker.opens, 2)
+
+    def test_stale_results_are_not_counted_as_probes(self):
+        # A request started while the breaker was closed finishes after it is half-open.
+        stale = self.breaker.before_request()
+        self.assertFalse(stale)
+        self.open_breaker()
+        self.wait_out_delay()
+        self.assertTrue(self.breaker.before_request())
+        self.breaker.record_success(stale)
+        self.assertEqual(self.breaker.state, breaker.HALF_OPEN)
+        self.assertEqual(self.breaker.probes_in_flight, 1)
+        self.assertEqual(self.breaker.probe_successes, 0)
+        with self.assertRaises(breaker.CircuitOpenError):
+            self.breaker.before_request()
+
+        self.breaker.record_failure(stale)
+        self.assertEqual(self.breaker.state, breaker.HALF_OPEN)
+
+        self.breaker.record_success(True)
+        self.assertEqual(self.breaker.state, breaker.HALF_OPEN)
+        self.breaker.record_success(self.breaker.before_request())
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+        self.assertEqual(self.breaker.probes_in_flight, 0)
+
+
+@override_settings(
+    REDIS_URL=None,
+    SEAT_HISTORY_RAW_RETENTION=datetime.timedelta(days=2),
+    SEAT_HISTORY_HOURLY_RETENTION=datetime.timedelta(days=30),
+    SEAT_HISTORY_DAILY_RETENTION=datetime.timedelta(days=365),
+)
+class SeatHistoryTests(TestCase):
+    now = datetime.datetime(2020, 9, 30, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def setUp(self):
+        (course_tuple,) = create_course_tuples(1)
+        self.course = course_tuple.course
+
+    def observe(self, time: datetime.datetime, seats) -> None:
+        SeatObservation.from_seats(self.course, seats, time).save()
+
+    def test_hourly_and_daily_rollups(self):
+        hour = datetime.datetime(2020, 9, 20, 10, 0, tzinfo=datetime.timezone.utc)
+        self.observe(hour, (0, 100, 0, 0, False))
+        self.observe(hour + datetime.timedelta(minutes=10), False)
+        self.observe(hour + datetime.timedelta(minutes=20), (2, 98, 1, 1, False))
+        self.observe(hour + datetime.timedelta(minutes=70), (3, 97, 3, 0, False))
+
+        self.assertEqual(history.roll_up(self.now), {"hourly": 2, "daily": 0})
+        first, second = SeatRollup.objects.filter(resolution="hour").order_by("start")
+        self.assertEqual(first.start, hour)
+        self.assertEqual((first.samples, first.open_samples, first.changes), (3, 1, 1))
+        self.assertEqual((first.min_total_open, first.max_total_open), (0, 2))
+        self.assertEqual(first.max_general_open, 1)
+        self.assertEqual((second.samples, second.changes), (1, 1))
+
+        # A month later, the hourly rollups are summarized into a daily one.
+        history.expired(self.now)["observations"].delete()
+        later = self.now + datetime.timedelta(days=30)
+        self.assertEqual(history.roll_up(later), {"hourly": 0, "daily": 1})
+        day = SeatRollup.objects.get(resolution="day")
+        self.assertEqual(day.start, hour.replace(hour=0))
+        self.assertEqual((day.samples, day.open_samples, day.changes), (4, 2, 2))
+        self.assertEqual((day.min_total_open, day.max_total_open), (0, 3))
+
+    def test_expired(self):
+        self.observe(self.now - datetime.timedelta(days=3), (1, 99, 1, 0, False))
+        self.observe(self.now - datetime.timedelta(days=1), (1, 99, 1, 0, False))
+        for resolution, age in (
+            ("hour", datetime.timedelta(days=31)),
+            ("hour", datetime.timedelta(days=29)),
+            ("day", datetime.timedelta(days=366)),
+            ("day", datetime.timedelta(days=364)),
+        ):
+            SeatRollup.objects.create(
+                course=self.course,
+                resolution=resolution,
+                start=history._truncate(self.now - age, resolution),
+            )
+        expired = history.expired(self.now)
+        self.assertEqual(
+            {name: queryset.count() for name, queryset in expired.items()},
+            {"observations": 1, "hourly": 1, "daily": 1},
+        )
+
+    def test_roll_up_task_rolls_up_everything_it_deletes(self):
+        # The run starts just before an hour boundary and finishes after it.
+        start = self.now - datetime.timedelta(seconds=1)
+        self.observe(
+            start - datetime.timedelta(days=2, minutes=30), (1, 99, 1, 0, False)
+        )
+        with mock.patch(
+            "django.utils.timezone.now",
+            side_effect=itertools.chain(
+                [start], itertools.repeat(start + datetime.timedelta(seconds=2))
+            ),
+        ):
+            result = roll_up_seat_history()
+        self.assertEqual(result["deleted_observations"], result["hourly"])
+        self.assertEqual(SeatObservation.objects.count(), 1)
+
+
+@override_settings(REDIS_URL=None, PURGE_BATCH_SIZE=2)
+class PurgeCoursesTests(TestCase):
+    def test_purges_only_what_nobody_monitors(self):
+        user = User.objects.create_user("student", "student@example.com", "password")
+        subscribed, restricted, stale, unwatched, also_unwatched = create_course_tuples(
+            5
+        )
+        user.profile.courses.add(subscribed)
+        # Only the restricted seats of this course are watched.
+        user.profile.courses.add(
+            CourseTuple.objects.create(course=restricted.course, restricted=True)
+        )
+        # An out of date count doesn't get a watched tuple deleted.
+        user.profile.courses.add(stale)
+        CourseTuple.objects.filter(pk=stale.pk).update(subscriber_count=0)
+
+        with mock.patch.object(
+            QuerySet, "delete", autospec=True, side_effect=QuerySet.delete
+        ) as delete:
+            result = purge_courses()
+        self.assertEqual(result["course_tuples"], 3)
+        self.assertEqual(result["courses"], 2)
+        self.assertEqual(
+            [queryset.model for (queryset,), _ in delete.call_args_list],
+            [CourseTuple, CourseTuple, Course],
+        )
+        self.assertCountEqual(
+            CourseTuple.objects.values_list("course_id", "restricted"),
+            [
+                (subscribed.course_id, False),
+                (restricted.course_id, True),
+                (stale.course_id, False),
+            ],
+        )
+        self.assertCountEqual(
+            Course.objects.values_list("pk", flat=True),
+            [subscribed.course_id, restricted.course_id, stale.course_id],
+        )
+        self.assertEqual(purge_courses()["course_tuples"], 0)
+
+
+class TracingTests(TestCase):
+    def records(self, logs) -> list:
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    @override_settings(TRACE_SAMPLE_RATE=1)
+    def test_spans_name_their_parent(self):
+        with self.assertLogs("courses.spans", "INFO") as logs:
+            with tracing.trace(sweep="s"), tracing.span("sweep"):
+                with tracing.span("poll", courses=1):
+                    with tracing.context(course=5), tracing.span("download") as span:
+                        span["status"] = 200
+                with tracing.span("save"):
+                    pass
+        records = self.records(logs)
+        for record in records:
+            del record["ms"]
+        self.assertEqual(
+            records,
+            [
+                {
+                    "sweep": "s",
+                    "parent": "poll",
+                    "course": 5,
+                    "span": "download",
+                    "status": 200,
+                },
+                {"sweep": "s", "parent": "sweep", "span": "poll", "courses": 1},
+                {"sweep": "s", "parent": "sweep", "span": "save"},
+                {"sweep": "s", "span": "sweep"},
+            ],
+        )
+
+    @override_settings(TRACE_SAMPLE_RATE=1)
+    def test_traces_follow_work_onto_other_threads(self):
+        def download() -> None:
+            with tracing.span("download"):
+                pass
+
+        with self.assertLogs("courses.spans", "INFO") as logs:
+            with tracing.trace(sweep="s"), tracing.span("poll"):
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    executor.submit(tracing.run_in_context(download)).result()
+                    # Without run_in_context the thread isn't part of the trace.
+                    executor.submit(download).result()
+        self.assertEqual(
+            [(record["span"], record.get("parent")) for record in self.records(logs)],
+            [("download", "poll"), ("poll", None)],
+        )
+
+    @override_settings(TRACE_SAMPLE_RATE=1)
+    def test_errors_are_recorded(self):
+        with self.assertLogs("courses.spans", "INFO") as logs:
+            with tracing.trace(sweep="s"), self.assertRaises(ValueError):
+                with tracing.span("parse"):
+                    raise ValueError
+        (record,) = self.records(logs)
+        self.assertEqual(record["error"], "ValueError")
+
+    def test_sample_rate(self):
+        for rate, sampled in ((0, False), (0.4, False), (0.6, True), (1, True)):
+            with self.subTest(rate=rate), override_settings(TRACE_SAMPLE_RATE=rate):
+                with mock.patch("courses.tracing.random.random", return_value=0.5):
+                    with mock.patch.object(tracing.logger, "info") as info:
+                        with tracing.trace(sweep="s") as traced, tracing.span("sweep"):
+                            self.assertIs(traced, sampled)
+                self.assertEqual(info.called, sampled)
+
+    def test_spans_outside_traces_are_not_logged(self):
+        with mock.patch.object(tracing.logger, "info") as info:
+            with tracing.span("sweep") as record, tracing.context(course=5):
+                record["courses"] = 1
+        info.assert_not_called()
+
+
+class SamplerTests(TestCase):
+    def test_samples_other_threads(self):
+        stop = threading.Event()
+
+        def busy_loop():
+            while not stop.is_set():
+                pass
+
+        thread = threading.Thread(target=busy_loop)
+        thread.start()
+        try:
+            with profiling.Sampler(interval=0.001) as sampler:
+                time.sleep(0.1)
+        finally:
+            stop.set()
+            thread.join()
+
+        self.assertGreater(sampler.samples, 0)
+        output = io.StringIO()
+        sampler.write_collapsed(output)
+        lines = output.getvalue().splitlines()
+        busy = [line for line in lines if "busy_loop (" in line]
+        self.assertGreater(len(busy), 0)
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+            # The sampler doesn't sample itself.
+            self.assertNotIn("_run (", stack)
+        functions = {function: own for function, own, _ in sampler.top()}
+        (busy_loop_function,) = [f for f in functions if f.startswith("busy_loop (")]
+        self.assertGreater(functions[busy_loop_function], 0)
+
+
+@override_settings(REDIS_URL=None, NOTIFICATION_DIGEST_WINDOW=0)
+class SendNotificationsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "student", "student@example.com", "password"
+        )
+        (course_tuple,) = create_course_tuples(1)
+        self.course = course_tuple.course
+        self.key = f"notification:opening:{self.user.profile.pk}:email"
+        self.redis = FakeRedis()
+        patcher = mock.patch("courses.notifications.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, failed: bool = False) -> mock.Mock:
+        """Sends the opening to the user, with every notification failing if failed is set,
+        and returns the mocked dispatch."""
+        with mock.patch(
+            "courses.notifiers.dispatch",
+            side_effect=lambda batch: list(batch) if failed else [],
+        ) as dispatch:
+            send_notifications(
+                "opening", self.course.pk, [self.user.profile.pk], time.time()
+            )
+        return dispatch
+
+    def sent_keys(self, dispatch: mock.Mock) -> list:
+        ((batch,), _) = dispatch.call_args
+        return [notification.key for notification in batch]
+
+    def test_notifications_are_sent_once(self):
+        self.assertEqual(self.sent_keys(self.send()), [self.key])
+        self.assertEqual(self.redis.get(self.key), "sent")
+        self.assertEqual(self.sent_keys(self.send()), [])
+
+    def test_failed_notifications_are_released_and_retried(self):
+        with self.assertRaises(Retry):
+            self.send(failed=True)
+        self.assertIsNone(self.redis.get(self.key))
+        self.assertEqual(self.sent_keys(self.send()), [self.key])
+        self.assertEqual(self.redis.get(self.key), "sent")
+
+    def test_claims_lapse(self):
+        # Another task is sending the notification.
+        self.redis.set(self.key, "sending", ex=0.2)
+        self.assertEqual(self.sent_keys(self.send()), [])
+        # It died before marking the notification as sent.
+        time.sleep(0.3)
+        self.assertEqual(self.sent_keys(self.send()), [self.key])
+
+
+@override_settings(REDIS_URL=None, NOTIFICATION_DIGEST_WINDOW=30)
+class DigestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "student", "student@example.com", "password"
+        )
+        self.profile = self.user.profile
+        self.courses = [course_tuple.course for course_tuple in create_course_tuples(2)]
+        self.redis = FakeRedis()
+        patcher = mock.patch("courses.notifications.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_add_pop_and_restore(self):
+        first = {"key": "notification:a", "course": self.courses[0].pk}
+        second = {"key": "notification:b", "course": self.courses[1].pk}
+        self.assertIs(
+            notifications.add_to_digest(self.profile.pk, first["key"], first["course"]),
+            True,
+        )
+        self.assertIs(
+            notifications.add_to_digest(
+                self.profile.pk, second["key"], second["course"]
+            ),
+            False,
+        )
+        self.assertEqual(notifications.pop_digest(self.profile.pk), [first, second])
+        self.assertEqual(notifications.pop_digest(self.profile.pk), [])
+
+        third = {"key": "notification:c", "course": self.courses[0].pk}
+        notifications.add_to_digest(self.profile.pk, third["key"], third["course"])
+        notifications.restore_digest(self.profile.pk, [first, second])
+        self.assertEqual(
+            notifications.pop_digest(self.profile.pk), [first, second, third]
+        )
+
+    def test_digest_is_unavailable_without_redis(self):
+        with mock.patch("courses.notifications.get_redis", return_value=None):
+            self.assertIsNone(
+                notifications.add_to_digest(self.profile.pk, "notification:a", 1)
+            )
+            self.assertEqual(notifications.pop_digest(self.profile.pk), [])
+
+    def test_openings_are_emailed_together(self):
+        with mock.patch("courses.notifiers.dispatch", return_value=[]) as dispatch:
+            with mock.patch.object(send_digest, "apply_async") as schedule:
+                for i, course in enumerate(self.courses):
+                    send_notifications(
+                        f"opening{i}", course.pk, [self.profile.pk], time.time()
+                    )
+            self.assertEqual(
+                [batch for (batch,), _ in dispatch.call_args_list], [[], []]
+            )
+            schedule.assert_called_once_with((self.profile.pk,), countdown=30)
+
+            self.assertEqual(send_digest(self.profile.pk), 2)
+        ((digest,), _) = dispatch.call_args
+        self.assertEqual(len(digest), 1)
+        self.assertEqual(digest[0].address, "student@example.com")
+        self.assertIn("2 sections", digest[0].subject)
+        for course in self.courses:
+            self.assertIn(course.url(), digest[0].body)
+        for i in range(2):
+            key = f"notification:opening{i}:{self.profile.pk}:email"
+            self.assertEqual(self.redis.get(key), "sent")
+        self.assertEqual(send_digest(self.profile.pk), 0)
+
+    def test_premium_users_are_emailed_right_away(self):
+        self.profile.is_premium = True
+        self.profile.save()
+        with mock.patch("courses.notifiers.dispatch", return_value=[]) as dispatch:
+            with mock.patch.object(send_digest, "apply_async") as schedule:
+                send_notifications(
+                    "opening", self.courses[0].pk, [self.profile.pk], time.time()
+                )
+        ((batch,), _) = dispatch.call_args
+        self.assertEqual(len(batch), 1)
+        schedule.assert_not_called()
+
+
+@override_settings(
+    SCHEDULER_MIN_INTERVAL=30,
+    SCHEDULER_MAX_INTERVAL=3600,
+    SCHEDULER_PRIORITY_WEIGHT=4,
+    SCHEDULER_CHURN_WEIGHT=4,
+)
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.courses = [course_tuple.course for course_tuple in create_course_tuples(3)]
+
+    def checked(self, course: Course, seconds_ago: float) -> Course:
+        course.last_checked = self.now - datetime.timedelta(seconds=seconds_ago)
+        return course
+
+    def test_never_checked_courses_are_due(self):
+        scheduler = Scheduler(rate=1, now=self.now)
+        for course in self.courses:
+            scheduler.add(course, 0, False)
+        self.assertEqual(scheduler.due(), self.courses)
+        self.assertEqual(scheduler.due(limit=2), self.courses[:2])
+
+    @override_settings(SCHEDULER_MIN_INTERVAL=0)
+    def test_busier_courses_are_more_overdue(self):
+        quiet, popular, churning = (self.checked(c, 100) for c in self.courses)
+        churning.seat_change_rate = 1
+        scheduler = Scheduler(rate=1, now=self.now)
+        # Weights 1, 10 and 5, so the intervals are 16, 1.6 and 3.2 seconds.
+        scheduler.add(quiet, 0, False)
+        scheduler.add(popular, 9, False)
+        scheduler.add(churning, 0, False)
+        self.assertEqual(scheduler.due(), [popular, churning, quiet])
+
+    @override_settings(SCHEDULER_MIN_INTERVAL=0)
+    def test_priority_subscribers_count_extra(self):
+        regular, priority, _ = (self.checked(c, 100) for c in self.courses)
+        scheduler = Scheduler(rate=1, now=self.now)
+        scheduler.add(regular, 1, False)
+        scheduler.add(priority, 1, True)
+        self.assertEqual(scheduler.due(), [priority, regular])
+
+    def test_minimum_interval(self):
+        recent, older, _ = self.courses
+        scheduler = Scheduler(rate=1000, now=self.now)
+        scheduler.add(self.checked(recent, 29), 100, True)
+        scheduler.add(self.checked(older, 31), 100, True)
+        self.assertEqual(scheduler.due(), [older])
+
+    def test_maximum_interval(self):
+        recent, older, _ = self.courses
+        scheduler = Scheduler(rate=0.0001, now=self.now)
+        scheduler.add(self.checked(recent, 3599), 0, False)
+        scheduler.add(self.checked(older, 3601), 0, False)
+        self.assertEqual(scheduler.due(), [older])
+
+    def test_record_tracks_seat_changes(self):
+        course = self.courses[0]
+        course.set_last_seats((1, 10, 1, 0, False))
+        scheduler = Scheduler(rate=1, now=self.now)
+        scheduler.add(course, 0, False)
+        self.assertEqual(
+            scheduler.record(course, (0, 10, 0, 0, False)),
+            ["last_checked", "seat_change_rate"],
+        )
+        self.assertAlmostEqual(course.seat_change_rate, 0.2)
+        self.assertIsNotNone(course.last_checked)
+        self.assertEqual(scheduler.record(course, False), [])
+
+
+class ShardTests(TestCase):
+    def courses(self) -> list:
+        return [
+            Course(
+                year="2020",
+                session="W",
+                subject=subject,
+                number=number,
+                section=section,
+            )
+            for subject in ("CPSC", "MATH", "PHYS", "ENGL")
+            for number in ("100", "110", "210", "221", "310")
+            for section in ("101", "102", "L1A")
+        ]
+
+    def test_sections_of_a_course_share_a_shard(self):
+        shards = {}
+        for course in self.courses():
+            shard = shard_of(course, 4)
+            self.assertIn(shard, range(4))
+            shards.setdefault((course.subject, course.number), set()).add(shard)
+        self.assertTrue(all(len(shard) == 1 for shard in shards.values()))
+        self.assertGreater(len(set.union(*shards.values())), 1)
+
+    def test_adding_a_shard_only_moves_courses_to_it(self):
+        for course in self.courses():
+            before, after = shard_of(course, 4), shard_of(course, 5)
+            self.assertIn(after, (before, 4))
+        self.assertEqual({shard_of(course, 1) for course in self.courses()}, {0})
+
+
+@override_settings(REDIS_URL="redis://fake")
+class LeaseTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch("courses.locks.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_one_holder_at_a_time(self):
+        first, second = locks.Lease("lease", 10), locks.Lease("lease", 10)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        # Only the holder can renew or release the lease.
+        self.assertFalse(second.renew())
+        second.release()
+        self.assertTrue(first.renew())
+        first.release()
+        self.assertTrue(second.acquire())
+
+    def test_lapsed_lease_can_be_taken(self):
+        first, second = locks.Lease("lease", 0.05), locks.Lease("lease", 10)
+        self.assertTrue(first.acquire())
+        time.sleep(0.1)
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.renew())
+        first.release()
+        self.assertEqual(self.redis.get("lease"), second.token)
+
+    def test_renewed_while_held(self):
+        lease = locks.Lease("lease", 0.3)
+        with lease as acquired:
+            self.assertTrue(acquired)
+            time.sleep(0.5)
+            self.assertEqual(self.redis.get("lease"), lease.token)
+            self.assertFalse(lease.lost.is_set())
+        self.assertIsNone(self.redis.get("lease"))
+
+    def test_losing_the_lease_is_signalled(self):
+        lease = locks.Lease("lease", 0.3)
+        with self.assertLogs("courses.locks", "WARNING"), lease as acquired:
+            self.assertTrue(acquired)
+            self.redis.set("lease", "someone else")
+            self.assertTrue(lease.lost.wait(1))
+        # The lease is left to whoever holds it now.
+        self.assertEqual(self.redis.get("lease"), "someone else")
+
+
+@override_settings(REDIS_URL=None)
+class PollerTests(TestCase):
+    def test_stops_when_asked(self):
+        stop = threading.Event()
+        stop.set()
+        handle = mock.Mock()
+        with mock.patch.object(Course, "get_seats") as get_seats:
+            poller.poll(
+                [Course(pk=1, year="2020", session="W", subject="CPSC", number="110")],
+                handle,
+                rate=100,
+                concurrency=1,
+                batch=False,
+                stop=stop,
+            )
+        get_seats.assert_not_called()
+        handle.assert_not_called()
+
+    def test_skips_courses_if_the_breaker_opens_before_their_download(self):
+        handle = mock.Mock()
+        with mock.patch.object(ssc, "breaker", breaker.CircuitBreaker()), mock.patch(
+            "courses.poller.get_redis", return_value=None
+        ), mock.patch(
+            "courses.seat_cache.get_redis", return_value=None
+        ), mock.patch.object(
+            ssc.breaker, "before_request", side_effect=breaker.CircuitOpenError
+        ), mock.patch.object(
+            ssc, "get_session"
+        ) as get_session:
+            poller.poll(
+                [Course(pk=1, year="2020", session="W", subject="CPSC", number="110")],
+                handle,
+                rate=100,
+                concurrency=1,
+                batch=False,
+            )
+        get_session.assert_not_called()
+        handle.assert_not_called()
+
+    def test_seats_worked_out_from_the_course_page_are_derived(self):
+        full, open_ = (
+            Course(
+                pk=pk, year="2020", session="W", subject="CPSC", number="110", section=s
+            )
+            for pk, s in ((1, "101"), (2, "102"))
+        )
+        handled = {}
+        with mock.patch.object(
+            Course, "get_section_statuses", return_value={"101": "Full", "102": ""}
+        ), mock.patch.object(
+            Course, "get_seats", return_value=(5, 195, 5, 0, False)
+        ) as get_seats:
+            poller.poll(
+                [full, open_],
+                lambda course, seats, derived=False: handled.update(
+                    {course.section: (seats, derived)}
+                ),
+                rate=100,
+                concurrency=2,
+                batch=True,
+            )
+        get_seats.assert_called_once()
+        self.assertEqual(
+            handled,
+            {
+                "101": ((0, 0, 0, 0, False), True),
+                "102": ((5, 195, 5, 0, False), False),
+            },
+        )
+
+
+class ParserTests(TestCase):
+    pages_dir = os.path.join(os.path.dirname(__file__), "ssc_pages")
+
+    def page(self, name: str) -> str:
+        with open(os.path.join(self.pages_dir, name)) as f:
+            return f.read()
+
+    def expected(self) -> dict:
+        with open(os.path.join(self.pages_dir, "expected.json")) as f:
+            return {
+                name: tuple(result) if isinstance(result, list) else result
+                for name, result in json.load(f).items()
+            }
+
+    def test_parsers_agree_with_the_corpus(self):
+        expected = self.expected()
+        # Every section page has an expected result; course.html is a course page.
+        pages = set(os.listdir(self.pages_dir)) - {"expected.json", "course.html"}
+        self.assertEqual(pages, set(expected))
+        for name, result in expected.items():
+            html = self.page(name)
+            for parser in (parse_seats_soup, parse_seats_fast):
+                with self.subTest(page=name, parser=parser.__name__):
+                    self.assertEqual(parser(html), result)
+
+    @override_settings(SSC_PARSER="shadow")
+    def test_shadow_mode_finds_no_disagreements(self):
+        for name, result in self.expected().items():
+            with self.subTest(page=name), mock.patch.object(
+                parsing.logger, "warning"
+            ) as warning:
+                self.assertEqual(parse_seats(self.page(name)), result)
+            warning.assert_not_called()
+
+
+class SectionStatusTests(TestCase):
+    def test_parse_section_statuses(self):
+        with open(os.path.join(ParserTests.pages_dir, "course.html")) as f:
+            statuses = parse_section_statuses(f.read())
+        self.assertEqual(
+            statuses,
+            {
+                "101": "",
+                "102": "Restricted",
+                "103": "Full",
+                "1S1": "STT",
+                "L1A": "Blocked",
+                "L1B": "Blocked",
+                "L1C": "Cancelled",
+                "T1A": "Full",
+                "T1B": "",
+            },
+        )
+        self.assertEqual(parse_section_statuses("<html></html>"), {})
+
+    def test_seats_from_status(self):
+        previous = (3, 197, 2, 1, False)
+        for status, last, seats in (
+            ("Full", previous, (0, 197, 0, 0, False)),
+            ("Full", None, (0, 0, 0, 0, False)),
+            ("Blocked", previous, (3, 197, 2, 1, True)),
+            ("Blocked", "stt", (0, 0, 0, 0, True)),
+            ("STT", previous, "stt"),
+            ("Cancelled", previous, "invalid"),
+            # Sections with seats, or restricted ones, need their own page.
+            ("", previous, None),
+            ("Restricted", previous, None),
+        ):
+            with self.subTest(status=status, previous=last):
+                self.assertEqual(seats_from_status(status, last), seats)
+
+    def test_derived_observations_leave_registered_unknown(self):
+        (course_tuple,) = create_course_tuples(1)
+        seats = (0, 197, 0, 0, False)
+        read = SeatObservation.from_seats(course_tuple.course, seats)
+        derived = SeatObservation.from_seats(course_tuple.course, seats, derived=True)
+        self.assertEqual((read.registered, read.derived), (197, False))
+        self.assertEqual((derived.registered, derived.derived), (None, True))
+        self.assertEqual(derived.state, "seats")
+        self.assertEqual(derived.total_open, 0)
+
+
+@override_settings(REDIS_URL=None)
+class GetSeatsTests(FakeSSCMixin, TestCase):
+    def setUp(self):
+        (course_tuple,) = create_course_tuples(1)
+        self.course = Course.objects.get(pk=course_tuple.course_id)
+        fingerprint_stats.pop()
+
+    def test_unmodified_page_is_not_downloaded_again(self):
+        fake = self.start_fake_ssc(open_rate=1, seed=1)
+        seats = self.course.get_seats()
+        self.assertIsInstance(seats, tuple)
+        self.assertNotEqual(self.course.ssc_etag, "")
+        self.course.save_ssc_state()
+
+        course = Course.objects.get(pk=self.course.pk)
+        with mock.patch("courses.models.parse_seats") as parse:
+            self.assertEqual(course.get_seats(), seats)
+        parse.assert_not_called()
+        self.assertEqual(fake.stats["not_modified"], 1)
+        self.assertEqual(fingerprint_stats.pop(), (1, 1))
+
+    def respond(self, html: str, **headers) -> mock.Mock:
+        return mock.patch.object(
+            Course,
+            "download_ssc",
+            return_value=mock.Mock(status_code=200, text=html, headers=headers),
+        )
+
+    def test_unchanged_section_is_not_parsed(self):
+        html = FakeSSC(open_rate=1, seed=1).section_page("UBC", "CPSC", "110", "101")
+        with self.respond(html):
+            seats = self.course.get_seats()
+        # Only the site's header changed.
+        changed = html.replace("<title>", "<title>New ")
+        with self.respond(changed), mock.patch("courses.models.parse_seats") as parse:
+            self.assertEqual(self.course.get_seats(), seats)
+        parse.assert_not_called()
+
+        changed = html.replace("Lecture", "Laboratory")
+        with self.respond(changed), mock.patch(
+            "courses.models.parse_seats", return_value=seats
+        ) as parse:
+            self.course.get_seats()
+        parse.assert_called_once()
+
+    def test_validators_are_only_kept_with_a_parsed_page(self):
+        html = FakeSSC(open_rate=1, seed=1).section_page("UBC", "CPSC", "110", "101")
+        with self.respond(html, ETag='"section"'):
+            seats = self.course.get_seats()
+        self.assertEqual(self.course.ssc_etag, '"section"')
+
+        with self.respond(MAINTENANCE, ETag='"maintenance"'):
+            self.assertIs(self.course.get_seats(), False)
+        self.assertEqual(self.course.ssc_etag, '"section"')
+        self.assertEqual(load_seats(self.course.last_seats), seats)
+
+    def test_dump_and_load_seats(self):
+        for seats in ((3, 197, 2, 1, False), (0, 0, 0, 0, True), "stt", "invalid"):
+            with self.subTest(seats=seats):
+                self.assertEqual(load_seats(dump_seats(seats)), seats)
+        self.assertIsNone(load_seats(""))
+        self.assertIsNone(load_seats(None))
+
+
+@override_settings(REDIS_URL=None, SEAT_CACHE_TTL=60, SEAT_CACHE_LOCK_TIMEOUT=5)
+class SeatCacheTests(TestCase):
+    seats = (1, 99, 1, 0, False)
+
+    def setUp(self):
+        (course_tuple,) = create_course_tuples(1)
+        self.course = course_tuple.course
+        self.lock = seat_cache._key(self.course) + ":lock"
+        self.redis = FakeRedis()
+        patcher = mock.patch("courses.seat_cache.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_download_per_section_at_a_time(self):
+        def download():
+            time.sleep(0.3)
+            return self.seats
+
+        with mock.patch.object(Course, "get_seats", side_effect=download) as get_seats:
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                results = list(
+                    executor.map(lambda _: seat_cache.get_seats(self.course), range(5))
+                )
+        get_seats.assert_called_once()
+        self.assertEqual(results, [self.seats] * 5)
+        self.assertIsNone(self.redis.get(self.lock))
+        # Later lookups are served from the cache.
+        self.assertEqual(seat_cache.lookup_seats(self.course), self.seats)
+
+    def test_expired_lock_is_not_released_by_its_old_holder(self):
+        def download():
+            # The lock expires during the download, and someone else takes it.
+            self.redis.delete(self.lock)
+            self.redis.set(self.lock, "someone else", ex=5)
+            return self.seats
+
+        with mock.patch.object(Course, "get_seats", side_effect=download):
+            self.assertEqual(seat_cache.download_seats(self.course), self.seats)
+        self.assertEqual(self.redis.get(self.lock), "someone else")
+
+    def test_waiters_download_once_an_abandoned_lock_expires(self):
+        self.redis.set(self.lock, "dead worker", ex=0.3)
+        start = time.monotonic()
+        with mock.patch.object(
+            Course, "get_seats", return_value=self.seats
+        ) as get_seats:
+            self.assertEqual(seat_cache.download_seats(self.course), self.seats)
+        get_seats.assert_called_once()
+        self.assertLess(time.monotonic() - start, 2)
+
+
+class FakeSSCTests(FakeSSCMixin, TestCase):
+    timeline = {
+        "CPSC 110 101": [
+            (0, (0, 150, 0, 0, False)),
+            (60, (2, 148, 1, 1, False)),
+            (120, "invalid"),
+        ],
+        "CPSC 110 102": [(0, "stt")],
+    }
+
+    def get(self, section: str = None, **headers) -> requests.Response:
+        params = {"pname": "subjarea", "dept": "CPSC", "course": "110"}
+        if section is None:
+            params["tname"] = "subj-course"
+        else:
+            params.update(tname="subj-section", section=section)
+        return requests.get(
+            f"{settings.SSC_BASE_URL}/cs/courseschedule",
+            params=params,
+            headers=headers,
+            timeout=5,
+        )
+
+    def test_seats_follow_the_timeline(self):
+        fake = self.start_fake_ssc(timeline=self.timeline)
+        self.assertEqual(parse_seats_fast(self.get("101").text), (0, 150, 0, 0, False))
+        self.assertEqual(parse_seats_fast(self.get("102").text), "stt")
+        self.assertEqual(
+            parse_section_statuses(self.get().text), {"101": "Full", "102": "STT"}
+        )
+
+        fake.started -= 60
+        self.assertEqual(parse_seats_fast(self.get("101").text), (2, 148, 1, 1, False))
+        self.assertEqual(parse_section_statuses(self.get().text)["101"], "")
+        fake.started -= 60
+        self.assertEqual(parse_seats_fast(self.get("101").text), "invalid")
+        self.assertEqual(parse_section_statuses(self.get().text)["101"], "Cancelled")
+
+    def test_errors(self):
+        fake = self.start_fake_ssc(error_rate=1)
+        for _ in range(3):
+            self.assertEqual(self.get("101").status_code, 503)
+        self.assertEqual(fake.stats["requests"], 3)
+        self.assertEqual(fake.stats["errors"], 3)
+
+        fake = self.start_fake_ssc(error_rate=0.5, seed=1)
+        statuses = [self.get("101").status_code for _ in range(40)]
+        self.assertEqual(statuses.count(503), fake.stats["errors"])
+        self.assertTrue(10 < statuses.count(503) < 30)
+        self.assertEqual(
+            requests.get(f"{settings.SSC_BASE_URL}/other", timeout=5).status_code, 404
+        )
+
+    def test_maintenance_windows(self):
+        fake = self.start_fake_ssc(maintenance=[(60, 60)], timeline=self.timeline)
+        self.assertNotEqual(self.get("101").text, MAINTENANCE)
+        fake.started -= 60
+        response = self.get("101")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, MAINTENANCE)
+        self.assertNotIn("ETag", response.headers)
+        self.assertEqual(fake.stats["maintenance"], 1)
+        fake.started -= 60
+        self.assertEqual(parse_seats_fast(self.get("101").text), "invalid")
+
+    def test_etags(self):
+        fake = self.start_fake_ssc(timeline=self.timeline)
+        response = self.get("101")
+        etag = response.headers["ETag"]
+        response = self.get("101", **{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(fake.stats["not_modified"], 1)
+        # Other sections and changed pages are tagged differently.
+        self.assertNotEqual(self.get("102").headers["ETag"], etag)
+        fake.started -= 60
+        response = self.get("101", **{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_load_timeline(self):
+        path = os.path.join(self.temporary_directory(), "timeline.json")
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "cpsc  110 101": [
+                        {"at": 60, "state": "stt"},
+                        {"at": 0, "seats": [1, 2, 1, 0], "blocked": True},
+                    ]
+                },
+                f,
+            )
+        self.assertEqual(
+            load_timeline(path),
+            {"CPSC 110 101": [(0.0, (1, 2, 1, 0, True)), (60.0, "stt")]},
+        )
+        with open(path, "w") as f:
+            json.dump({"CPSC 110 101": [{"at": 0, "state": "open"}]}, f)
+        with self.assertRaises(ValueError):
+            load_timeline(path)
+
+    def temporary_directory(self) -> str:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return directory.name
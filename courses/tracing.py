@@ -0,0 +1,87 @@
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+import typing
+
+from django.conf import settings
+
+
+# Span records are logged as JSON on their own logger, so they can be routed separately.
+logger = logging.getLogger("courses.spans")
+
+# The fields of the current trace, or None outside a trace or when it wasn't sampled.
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextlib.contextmanager
+def trace(**fields) -> typing.Iterator[bool]:
+    """Starts a trace whose spans are logged with the given fields, e.g. a sweep id.
+
+    Only TRACE_SAMPLE_RATE of traces are sampled. Spans outside a sampled trace cost a context
+    variable lookup and are not logged. Yields whether the trace was sampled.
+    """
+    sampled = random.random() < settings.TRACE_SAMPLE_RATE
+    token = _trace.set(fields if sampled else None)
+    try:
+        yield sampled
+    finally:
+        _trace.reset(token)
+
+
+@contextlib.contextmanager
+def context(**fields) -> typing.Iterator[None]:
+    """Adds fields, e.g. a course id, to every span logged in the block."""
+    current = _trace.get()
+    if current is None:
+        yield
+        return
+    token = _trace.set(dict(current, **fields))
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+
+
+def run_in_context(function: typing.Callable) -> typing.Callable:
+    """Wraps function so that it runs in the caller's trace when called on another thread."""
+    fields = _trace.get()
+    if fields is None:
+        return function
+
+    def run(*args, **kwargs):
+        token = _trace.set(fields)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _trace.reset(token)
+
+    return run
+
+
+@contextlib.contextmanager
+def span(name: str, **fields) -> typing.Iterator[dict]:
+    """Times a block and logs it as a JSON record with the fields of the current trace.
+
+    Spans started in the block, including on threads it hands work to with run_in_context(),
+    name this span as their parent. Yields the record, so the block can add fields to it, e.g.
+    what it found.
+    """
+    current = _trace.get()
+    if current is None:
+        yield {}
+        return
+    record = dict(current, span=name, **fields)
+    token = _trace.set(dict(current, parent=name))
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["ms"] = round((time.perf_counter() - start) * 1000, 3)
+        _trace.reset(token)
+        logger.info(json.dumps(record, default=str))
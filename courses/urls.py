@@ -7,4 +7,7 @@ urlpatterns = [
     path("faq/", views.faq, name="courses-faq"),
     path("about/", views.about, name="courses-about"),
     path("courses/", views.courses, name="courses-list"),
+    path("courses/status/", views.course_status, name="courses-status"),
+    path("courses/events/", views.course_events, name="courses-events"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
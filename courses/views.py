@@ -1,16 +1,37 @@
+import hmac
 from datetime import datetime
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import redirect, render
 
+from . import metrics as ucm_metrics
+from .counters import site_totals
 from .forms import CourseRegisterForm, CourseTupleRegisterForm
+from .live import seats_message
 from .models import Course, CourseTuple
+from .parsing import load_seats
+from .tasks import validate_course
 from users.models import Profile
 
 
+STATUS_MESSAGES = {
+    "pending": "We are checking this section on the SSC.",
+    "valid": "",
+    "invalid": "This section does not appear to exist. Please check your form entry for errors and try "
+    "again. If the course does, in fact, exist, please contact us at contact@ubccoursemonitor.email.",
+    "stt": "The remaining seats in this section appear to only be available through an STT. You will "
+    "be notified if any non-STT seats open up in this section.",
+    "blocked": "This section is currently blocked for registration. You will be notified if the "
+    "section is unblocked and there is an opening.",
+    "failed": "We were unable to download this section's page from the SSC. This could be because of "
+    "the SSC being down for maintenance or high SSC traffic. We will keep trying.",
+}
+
+
 def home(request):
     return render(request, "courses/home.html", context())
 
@@ -91,48 +112,21 @@ def courses(request):
                 )
                 c_name = c.sub_num_sec()
 
+                if new_c:
+                    validate_course.delay(c.pk)
+                elif c.status == "invalid":
+                    messages.warning(request, STATUS_MESSAGES["invalid"])
+                    return redirect("courses-list")
+
                 ct_form.instance.course = c
                 ct, new_ct = CourseTuple.objects.get_or_create(
                     course=ct_form.instance.course,
                     restricted=ct_form.instance.restricted,
                 )
 
-                get_seats = c.get_seats()
-                if new_c:
-                    if get_seats is False:
-                        fail_message = (
-                            f"We were unable to download {c_name}'s page from the SSC. This could be "
-                            f"because of the SSC being down for maintenance or a database update (this "
-                            f"usually occurs in the early morning, Pacific time). It could also be caused "
-                            f"by high SSC traffic, usually around registration or grade releases. Please "
-                            f"try again in a couple hours."
-                        )
-                        messages.warning(request, fail_message)
-                        c.delete()
-                        return redirect("courses-list")
-                    elif get_seats == "invalid":
-                        invalid_message = (
-                            f"This section does not appear to exist. Please check your form entry for "
-                            f"errors and try again. If the course does, in fact, exist, please contact "
-                            f"us at contact@ubccoursemonitor.email."
-                        )
-                        messages.warning(request, invalid_message)
-                        c.delete()
-                        return redirect("courses-list")
-
                 if ct not in request.user.profile.courses.all():
-                    if get_seats == "stt":
-                        stt_message = (
-                            "The remaining seats in this section appear to only be available through an "
-                            "STT. You will be notified if any non-STT seats open up in this section."
-                        )
-                        messages.warning(request, stt_message)
-                    elif isinstance(get_seats, tuple) and get_seats[4]:
-                        blocked_message = (
-                            "This section is currently blocked for registration. You will be notified "
-                            "if the section is unblocked and there is an opening."
-                        )
-                        messages.warning(request, blocked_message)
+                    if c.status in ("stt", "blocked"):
+                        messages.warning(request, STATUS_MESSAGES[c.status])
 
                     try:
                         ct_opposite_restricted = CourseTuple.objects.get(
@@ -185,29 +179,73 @@ def courses(request):
         )
         ct_form = CourseTupleRegisterForm()
 
-    user_courses = request.user.profile.courses.all()
-
     view_context = context(
-        title="Add Course", c_form=c_form, ct_form=ct_form, courses=user_courses
+        title="Add Course",
+        c_form=c_form,
+        ct_form=ct_form,
+        subscriptions=subscriptions(request.user.profile),
     )
 
     return render(request, "courses/courses.html", view_context)
 
 
+@login_required()
+def course_status(request):
+    return JsonResponse({"subscriptions": subscriptions(request.user.profile)})
+
+
+@login_required()
+def course_events(request):
+    """Stands in for the live event stream where the site is served over WSGI.
+
+    The stream itself is served by courses.live.events from the ASGI application. Here the
+    browser is told not to reconnect, so it polls courses-status instead.
+    """
+    return HttpResponse(status=204)
+
+
+def metrics(request):
+    """Reports the monitor's metrics to staff, or to a scraper with the METRICS_TOKEN."""
+    token = request.META.get("HTTP_AUTHORIZATION", "")
+    if not (
+        request.user.is_staff
+        or (
+            settings.METRICS_TOKEN
+            and hmac.compare_digest(
+                token.encode("utf-8"), f"Bearer {settings.METRICS_TOKEN}".encode("utf-8")
+            )
+        )
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        ucm_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def subscriptions(profile: Profile) -> list:
+    """Lists the sections that a user is monitoring along with what we know about them."""
+    return [
+        {
+            "id": ct.pk,
+            "name": str(ct),
+            "status": ct.course.status,
+            "message": STATUS_MESSAGES[ct.course.status],
+            "seats": seats_message(load_seats(ct.course.last_seats)),
+        }
+        for ct in profile.courses.select_related("course")
+    ]
+
+
 def context(title=None, **kwargs):
     output = {}
 
     if title is not None:
         output["title"] = title
 
-    users = Profile.objects.all()
-    courses_list = []
-    for course in Course.objects.all():
-        if users.filter(courses__course=course).count() > 0:
-            courses_list.append(course)
-    if len(courses_list) > 0:
-        output["courses_total"] = len(courses_list)
-        output["users_total"] = Profile.objects.count()
+    courses_total, users_total = site_totals()
+    if courses_total > 0:
+        output["courses_total"] = courses_total
+        output["users_total"] = users_total
 
     output["active"] = settings.NON_PREMIUM_NOTIFICATIONS
 
@@ -3,14 +3,49 @@ ASGI config for ubccoursemonitor project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The web process serves the whole site over ASGI. The live event stream is served directly, and
+every other request is handed to Django.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ubccoursemonitor.settings")
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Imported once Django is set up.
+from courses import live  # noqa: E402
+
+
+class ClosingASGIHandler(ASGIHandler):
+    """Django's ASGI handler, cleaning up database connections on the thread that used them.
+
+    Django 3.0 runs each view on an executor thread, but sends the signals that close stale
+    connections from whichever thread is free, so the view's thread never closes its own.
+    """
+
+    def get_response(self, request):
+        close_old_connections()
+        try:
+            return super().get_response(request)
+        finally:
+            close_old_connections()
+
+
+django_application = ClosingASGIHandler()
+
+
+async def application(scope, receive, send):
+    # Django 3.0 views can't hold a connection open without tying up a thread, so the live
+    # event stream is served directly.
+    if scope["type"] == "http" and scope["path"] == live.EVENTS_PATH:
+        await live.events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
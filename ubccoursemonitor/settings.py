@@ -59,6 +59,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "courses.queries.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -142,13 +143,19 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = "apikey"
 EMAIL_HOST_PASSWORD = os.environ.get("UCM_SENDGRID_API_KEY")
+# Seconds before a blocked SMTP call gives up, so that a pooled connection that the server
+# dropped without telling us is reopened rather than hanging a notifier thread.
+EMAIL_TIMEOUT = 20
 DEFAULT_FROM_EMAIL = "accounts@ubccoursemonitor.email"
 SERVER_EMAIL = "server@ubccoursemonitor.email"
 EMAIL_NOTIFIER_ADDRESS = "notifier@ubccoursemonitor.email"
 
+REDIS_URL = os.environ.get("REDIS_URL")
+REDIS_SOCKET_TIMEOUT = 5
+
 # Celery
-CELERY_BROKER_URL = os.environ.get("REDIS_URL")
-CELERY_RESULT_BACKEND = os.environ.get("REDIS_URL")
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
@@ -167,3 +174,159 @@ MAX_NON_PREMIUM_SECTIONS = 2
 NON_PREMIUM_NOTIFICATIONS = (
     True if os.environ.get("UCM_DJANGO_NOTIFY_ALL") == "True" else False
 )
+
+# SSC polling
+# Point this at a fake SSC (see the fake_ssc command) to test the poller without hitting UBC.
+SSC_BASE_URL = os.environ.get(
+    "UCM_SSC_BASE_URL", "https://courses.students.ubc.ca"
+).rstrip("/")
+SSC_REQUESTS_PER_SECOND = float(
+    os.environ.get("UCM_SSC_REQUESTS_PER_SECOND", 1 / POLL_FREQUENCY)
+)
+SSC_MAX_CONCURRENT_REQUESTS = int(
+    os.environ.get("UCM_SSC_MAX_CONCURRENT_REQUESTS", "4")
+)
+SSC_CONNECT_TIMEOUT = float(os.environ.get("UCM_SSC_CONNECT_TIMEOUT", "5"))
+SSC_READ_TIMEOUT = float(os.environ.get("UCM_SSC_READ_TIMEOUT", "20"))
+# Retries of SSC requests that failed to connect. Responses and timeouts aren't retried, since
+# every request to the SSC should go through the rate limiter and the circuit breaker.
+SSC_MAX_RETRIES = int(os.environ.get("UCM_SSC_MAX_RETRIES", "2"))
+# One of "fast", "soup" (BeautifulSoup), or "shadow" (run both and log any disagreement).
+SSC_PARSER = os.environ.get("UCM_SSC_PARSER", "fast")
+SSC_BATCH_REQUESTS = os.environ.get("UCM_SSC_BATCH_REQUESTS", "True") == "True"
+# Seconds that a section's seats are cached for, and that a download of them may hold its lock.
+SEAT_CACHE_TTL = int(os.environ.get("UCM_SEAT_CACHE_TTL", "60"))
+SEAT_CACHE_LOCK_TIMEOUT = 30
+SITE_TOTALS_TTL = 15 * 60
+
+# Polling schedule. Each course gets a share of SSC_REQUESTS_PER_SECOND in proportion to its
+# subscribers, whether any of them are premium or staff, and how often its seats change.
+SCHEDULER_MIN_INTERVAL = int(os.environ.get("UCM_SCHEDULER_MIN_INTERVAL", "30"))
+SCHEDULER_MAX_INTERVAL = int(os.environ.get("UCM_SCHEDULER_MAX_INTERVAL", "3600"))
+SCHEDULER_PRIORITY_WEIGHT = 4
+SCHEDULER_CHURN_WEIGHT = 4
+# Maximum number of courses checked per run of the monitor task, or None for every due course.
+MONITOR_SWEEP_BUDGET = None
+# Number of shard tasks that each run of the monitor task is split into.
+MONITOR_SHARDS = int(os.environ.get("UCM_MONITOR_SHARDS", "1"))
+MONITOR_LEASE_TIMEOUT = 5 * 60
+PURGE_BATCH_SIZE = 500
+
+# SSC circuit breaker
+SSC_BREAKER_FAILURE_THRESHOLD = 5
+SSC_BREAKER_ERROR_RATE = 0.5
+SSC_BREAKER_WINDOW = 20
+SSC_BREAKER_BASE_DELAY = 30
+SSC_BREAKER_MAX_DELAY = 30 * 60
+SSC_BREAKER_PROBES = 2
+
+# Seat history. Observations are kept for SEAT_HISTORY_RAW_RETENTION, then summarized into hourly
+# rollups that are kept for SEAT_HISTORY_HOURLY_RETENTION, then into daily rollups that are kept
+# for SEAT_HISTORY_DAILY_RETENTION.
+SEAT_HISTORY_BUFFER_SIZE = 500
+SEAT_HISTORY_RAW_RETENTION = datetime.timedelta(days=2)
+SEAT_HISTORY_HOURLY_RETENTION = datetime.timedelta(days=30)
+SEAT_HISTORY_DAILY_RETENTION = datetime.timedelta(days=365)
+
+# Notifications are sent by workers consuming the notifications queue, in batches of
+# NOTIFICATION_BATCH_SIZE subscribers. A subscriber is only emailed once about each opening.
+CELERY_TASK_ROUTES = {
+    "courses.tasks.notify_opening": {"queue": "notifications"},
+    "courses.tasks.send_notifications": {"queue": "notifications"},
+    "courses.tasks.send_digest": {"queue": "notifications"},
+    "courses.tasks.unsubscribe_invalid": {"queue": "notifications"},
+}
+NOTIFICATION_BATCH_SIZE = 50
+NOTIFICATION_CLAIM_TIMEOUT = 5 * 60
+NOTIFICATION_IDEMPOTENCY_TTL = 7 * 24 * 60 * 60
+# Seconds that openings are collected for before non-premium users who asked for digests are
+# emailed a single message listing all of them, or 0 to email every opening right away. Digests
+# delay those emails by up to the window, so they are off unless this is set.
+NOTIFICATION_DIGEST_WINDOW = int(os.environ.get("UCM_NOTIFICATION_DIGEST_WINDOW", "0"))
+
+# Notification channels. Each backend sends at most RATE messages per second from up to
+# CONCURRENCY threads. Set UCM_EMAIL_NOTIFIER to courses.notifiers.SendGridNotifier to email
+# through SendGrid's HTTP API instead of SMTP.
+NOTIFIERS = {
+    "email": {
+        "BACKEND": os.environ.get(
+            "UCM_EMAIL_NOTIFIER", "courses.notifiers.SMTPNotifier"
+        ),
+        "RATE": 10,
+        "CONCURRENCY": 2,
+    },
+    "webhook": {
+        "BACKEND": "courses.notifiers.WebhookNotifier",
+        "RATE": 20,
+        "CONCURRENCY": 8,
+    },
+}
+if os.environ.get("UCM_TWILIO_ACCOUNT_SID") is not None:
+    NOTIFIERS["sms"] = {
+        "BACKEND": "courses.notifiers.TwilioSMSNotifier",
+        "RATE": 1,
+        "CONCURRENCY": 1,
+        "OPTIONS": {
+            "account_sid": os.environ.get("UCM_TWILIO_ACCOUNT_SID"),
+            "auth_token": os.environ.get("UCM_TWILIO_AUTH_TOKEN"),
+            "from_number": os.environ.get("UCM_TWILIO_FROM_NUMBER"),
+        },
+    }
+
+# Live updates. Seconds that the hub waits for a published update before checking whether
+# anyone is still listening, before reconnecting to Redis, between keepalive comments, and
+# before a browser reconnects to a closed event stream.
+LIVE_POLL_INTERVAL = 0.2
+LIVE_RECONNECT_DELAY = 5
+LIVE_KEEPALIVE = 15
+LIVE_RETRY = 5
+
+# Metrics are added to the totals in Redis every METRICS_FLUSH_INTERVAL seconds by each process.
+# Gauges are kept per process, and expire METRICS_GAUGE_TTL seconds after the process last
+# reported them so that those of exited processes are dropped. Scrapers authenticate to the
+# metrics view with "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_FLUSH_INTERVAL = 10
+METRICS_GAUGE_TTL = 300
+METRICS_TOKEN = os.environ.get("UCM_METRICS_TOKEN")
+
+# Fraction of sweeps and notification batches whose stages are logged as JSON spans on the
+# courses.spans logger.
+TRACE_SAMPLE_RATE = float(os.environ.get("UCM_TRACE_SAMPLE_RATE", "0.1"))
+# If set, every sweep is profiled by sampling each thread's stack every MONITOR_PROFILE_INTERVAL
+# seconds, and the samples are written to this directory. The profile_sweep command profiles a
+# single sweep on demand.
+MONITOR_PROFILE_DIR = os.environ.get("UCM_MONITOR_PROFILE_DIR")
+MONITOR_PROFILE_INTERVAL = 0.005
+
+# Most queries that each view (by URL name) or Celery task (by task name) should make, with
+# "default" applying to any other view or task, and None turning the checks off. Going over a
+# budget, or running the same statement QUERY_DUPLICATE_THRESHOLD times, is logged, or fails if
+# QUERY_BUDGET_ENFORCE is set as it should be in tests.
+QUERY_BUDGETS = {
+    "default": 30,
+    "courses-home": 6,
+    "courses-faq": 6,
+    "courses-about": 6,
+    "courses-list": 8,
+    "courses-status": 5,
+    "courses-events": 5,
+    "profile": 8,
+    "admin:courses_course_changelist": 7,
+    "admin:courses_coursetuple_changelist": 7,
+    "admin:users_profile_changelist": 7,
+    "admin:users_profile_change": 9,
+    "courses.tasks.send_notifications": 10,
+    "courses.tasks.send_digest": 6,
+    "courses.tasks.validate_course": 6,
+    # Sweeps and purges scale with the data by design and are measured by the benchmark command.
+    "courses.tasks.monitor_shard": None,
+    "courses.tasks.purge_courses": None,
+    "courses.tasks.roll_up_seat_history": None,
+}
+QUERY_DUPLICATE_THRESHOLD = 5
+QUERY_BUDGET_ENFORCE = os.environ.get("UCM_QUERY_BUDGET_ENFORCE") == "True"
+# Reports which line of code first ran each repeated statement. Finding it walks the stack for
+# every new statement, so it is left off in production unless asked for.
+QUERY_ORIGINS = DEBUG or os.environ.get("UCM_QUERY_ORIGINS") == "True"
+# Adds a Server-Timing header with the time spent on queries to every response.
+QUERY_SERVER_TIMING = DEBUG
@@ -1,13 +1,59 @@
 from django.contrib import admin
+from django.db.models import Count
 
 from .models import Profile
 
 
-class CourseTupleInline(admin.StackedInline):
+class CourseTupleInline(admin.TabularInline):
+    """Lists the sections that the user monitors, which can be removed from here.
+
+    The sections are shown read-only, since they are then labelled from the joined course
+    rather than by a query for each row.
+    """
+
+    model = Profile.courses.through
+    fields = ("coursetuple",)
+    readonly_fields = ("coursetuple",)
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("coursetuple__course")
+
+    def has_add_permission(self, request, obj=None) -> bool:
+        return False
+
+
+class AddCourseTupleInline(admin.TabularInline):
+    """Adds sections for the user to monitor, by the ids of their course tuples."""
+
     model = Profile.courses.through
+    # A select would list every course tuple, each loading its course to label it.
+    raw_id_fields = ("coursetuple",)
+    extra = 1
+    verbose_name = "New monitored section"
+    verbose_name_plural = "New monitored sections"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).none()
 
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    inlines = [CourseTupleInline]
+    inlines = [CourseTupleInline, AddCourseTupleInline]
+    # Edited through the inlines instead of a select listing every course tuple.
+    exclude = ("courses",)
     list_display = ("__str__", "is_premium", "number_of_courses")
+    list_select_related = ("user",)
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(course_count=Count("courses", distinct=True))
+        )
+
+    def number_of_courses(self, obj: Profile) -> int:
+        return obj.course_count
+
+    number_of_courses.short_description = "Number of monitored courses"
+    number_of_courses.admin_order_field = "course_count"
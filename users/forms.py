@@ -1,8 +1,10 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 
 from .models import Profile
+from courses.notifiers import check_webhook_url
 
 
 class UserRegisterForm(UserCreationForm):
@@ -64,10 +66,28 @@ class ProfileUpdateForm(forms.ModelForm):
 
     class Meta:
         model = Profile
-        fields = ["courses"]
+        fields = [
+            "courses",
+            "notify_by_email",
+            "digest_notifications",
+            "phone_number",
+            "webhook_url",
+        ]
+
+    def clean_webhook_url(self):
+        webhook_url = self.cleaned_data["webhook_url"]
+        if webhook_url:
+            try:
+                check_webhook_url(webhook_url)
+            except ValueError as e:
+                raise forms.ValidationError(str(e))
+        return webhook_url
 
     def __init__(self, user, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields["courses"].queryset = (
-            Profile.objects.filter(user=user).first().courses
-        )
+        # Each checkbox is labelled with its course, so the courses are fetched up front.
+        self.fields["courses"].queryset = user.profile.courses.select_related("course")
+        # Only offer the channels that notifications can actually be sent on.
+        for channel, field in (("sms", "phone_number"), ("webhook", "webhook_url")):
+            if channel not in settings.NOTIFIERS:
+                del self.fields[field]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='digest_notifications',
+            field=models.BooleanField(default=True, help_text='Openings in several of your sections that are found at about the same time will be listed in a single email. Premium users are always emailed right away.', verbose_name='Combine openings into one email'),
+        ),
+    ]
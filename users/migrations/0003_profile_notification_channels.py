@@ -0,0 +1,29 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:51
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profile_digest_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='notify_by_email',
+            field=models.BooleanField(default=True, verbose_name='Email me about openings'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='phone_number',
+            field=models.CharField(blank=True, default='', help_text='Text me about openings at this number, e.g. +16045551234.', max_length=16, validators=[django.core.validators.RegexValidator(regex='^\\+[1-9]\\d{6,14}$')]),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='webhook_url',
+            field=models.URLField(blank=True, default='', help_text='Post openings as JSON to this HTTPS URL.', validators=[django.core.validators.URLValidator(schemes=['https'])], verbose_name='Webhook URL'),
+        ),
+    ]
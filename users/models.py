@@ -1,13 +1,43 @@
+from typing import List, Tuple
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.validators import RegexValidator, URLValidator
 from django.db import models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 
+phone_number_validator = r"^\+[1-9]\d{6,14}$"
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, unique=True)
     courses = models.ManyToManyField("courses.CourseTuple", blank=True)
     is_premium = models.BooleanField(default=False)
+    digest_notifications = models.BooleanField(
+        default=True,
+        verbose_name="Combine openings into one email",
+        help_text="Openings in several of your sections that are found at about the same time "
+        "will be listed in a single email. Premium users are always emailed right away.",
+    )
+    notify_by_email = models.BooleanField(
+        default=True, verbose_name="Email me about openings"
+    )
+    phone_number = models.CharField(
+        max_length=16,
+        blank=True,
+        default="",
+        validators=[RegexValidator(regex=phone_number_validator)],
+        help_text="Text me about openings at this number, e.g. +16045551234.",
+    )
+    webhook_url = models.URLField(
+        blank=True,
+        default="",
+        validators=[URLValidator(schemes=["https"])],
+        verbose_name="Webhook URL",
+        help_text="Post openings as JSON to this HTTPS URL.",
+    )
 
     class Meta:
         ordering = ["user"]
@@ -16,10 +46,29 @@ class Profile(models.Model):
         return f"{self.user.username}"
 
     def number_of_courses(self) -> int:
-        return self.courses.count()
+        return self.courses.exclude(course__status="invalid").count()
 
     number_of_courses.short_description = "Number of monitored courses"
 
+    def notification_channels(self) -> List[Tuple[str, str]]:
+        """Returns the channels that the user wants to be notified on and their address on each.
+
+        Channels without a notifier in the NOTIFIERS setting are left out, since notifications
+        on them could never be sent.
+        """
+        channels = []
+        if self.notify_by_email:
+            channels.append(("email", self.user.email))
+        if self.phone_number:
+            channels.append(("sms", self.phone_number))
+        if self.webhook_url:
+            channels.append(("webhook", self.webhook_url))
+        return [
+            (channel, address)
+            for channel, address in channels
+            if channel in settings.NOTIFIERS
+        ]
+
 
 @receiver(post_save, sender=User)
 def update_user_profile(sender, instance, created, **kwargs):
@@ -1,3 +1,123 @@
-from django.test import TestCase
+import socket
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .forms import ProfileUpdateForm
+from courses.models import Course, CourseTuple
+from courses.notifiers import Notification, WebhookNotifier, check_webhook_url
+from courses.queries import query_budget
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True, REDIS_URL=None)
+class QueryBudgetTests(TestCase):
+    """Checks that the profile pages stay within their query budgets however many sections a
+    user monitors."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            "student", "student@example.com", "password"
+        )
+        for i in range(20):
+            course = Course.objects.create(
+                year="2020",
+                session="W",
+                subject="CPSC",
+                number="110",
+                section=str(101 + i),
+                status="valid",
+            )
+            cls.user.profile.courses.add(
+                CourseTuple.objects.create(course=course, restricted=False)
+            )
+        cls.admin = User.objects.create_superuser(
+            "admin", "admin@example.com", "password"
+        )
+
+    def test_profile_view(self):
+        self.client.force_login(self.user)
+        with query_budget("profile"):
+            response = self.client.get(reverse("profile"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_admin(self):
+        self.client.force_login(self.admin)
+        for name, args in (
+            ("admin:users_profile_changelist", ()),
+            ("admin:users_profile_change", (self.user.profile.pk,)),
+        ):
+            with self.subTest(name=name), query_budget(name):
+                response = self.client.get(reverse(name, args=args))
+            self.assertEqual(response.status_code, 200)
+
+
+class WebhookURLTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            "student", "student@example.com", "password"
+        )
+
+    def form(self, webhook_url: str) -> ProfileUpdateForm:
+        return ProfileUpdateForm(
+            self.user,
+            {"notify_by_email": True, "webhook_url": webhook_url},
+            instance=self.user.profile,
+        )
+
+    def test_internal_addresses_are_refused(self):
+        for url in (
+            "https://127.0.0.1/hook",
+            "https://169.254.169.254/latest/meta-data/",
+            "https://10.0.0.1/hook",
+            "https://[::1]/hook",
+            "https://localhost/hook",
+        ):
+            with self.subTest(url=url):
+                self.assertIn("webhook_url", self.form(url).errors)
+                with self.assertRaises(ValueError):
+                    check_webhook_url(url)
+
+    def test_public_addresses_are_allowed(self):
+        with mock.patch(
+            "socket.getaddrinfo",
+            return_value=[(None, None, None, "", ("93.184.216.34", 443))],
+        ):
+            check_webhook_url("https://example.com/hook")
+            self.assertTrue(self.form("https://example.com/hook").is_valid())
+
+
+class WebhookNotifierTests(TestCase):
+    notification = Notification(
+        "key", "webhook", "https://hooks.example.com/hook", "Subject", "Body", "URL"
+    )
+
+    def resolve(self, *addresses):
+        """Patches DNS so that hooks.example.com resolves to each address in turn."""
+        answers = iter(addresses)
+        getaddrinfo = socket.getaddrinfo
+
+        def fake_getaddrinfo(host, port, *args, **kwargs):
+            if host == "hooks.example.com":
+                return [(None, None, None, "", (next(answers), port))]
+            return getaddrinfo(host, port, *args, **kwargs)
+
+        return mock.patch("socket.getaddrinfo", side_effect=fake_getaddrinfo)
+
+    def test_connects_to_the_checked_address(self):
+        with self.resolve("93.184.216.34", "93.184.216.35"), mock.patch(
+            "urllib3.util.connection.create_connection",
+            side_effect=OSError("unreachable"),
+        ) as create_connection, self.assertLogs("courses.notifiers", "ERROR"):
+            self.assertFalse(WebhookNotifier()._send_one(self.notification))
+        self.assertEqual(create_connection.call_args[0][0], ("93.184.216.35", 443))
+
+    def test_rebinding_to_an_internal_address_is_refused(self):
+        with self.resolve("93.184.216.34", "127.0.0.1"), mock.patch(
+            "urllib3.util.connection.create_connection"
+        ) as create_connection, self.assertLogs("courses.notifiers", "WARNING"):
+            self.assertFalse(WebhookNotifier()._send_one(self.notification))
+        create_connection.assert_not_called()